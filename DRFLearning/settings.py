@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'common.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,6 +61,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Response compression, see common.middleware.CompressionMiddleware
+COMPRESSION_MIN_LENGTH = 1024
+COMPRESSION_LEVEL = 6
+COMPRESSION_CACHE_TIMEOUT = 300
+
 ROOT_URLCONF = 'DRFLearning.urls'
 
 TEMPLATES = [
@@ -106,22 +112,48 @@ DATABASES = {
     }
 }
 
+# Read replicas, see common.core.routers.ReplicaRouter
+DATABASES.update(project_settings.replica.databases(DATABASES['default']))
+DATABASE_ROUTERS = ['common.core.routers.ReplicaRouter']
+REPLICA = project_settings.replica.router_options
+
 # Caches
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
         "LOCATION": project_settings.redis.default_location,
+        # key为"项目名:版本:命名空间:..."，purge_cache按命名空间、模型删除
+        "KEY_PREFIX": project_settings.default.project_name,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
             "PICKLE_VERSION": -1,  # Use the latest protocol version
             "SOCKET_CONNECT_TIMEOUT": 3,  # set connection time out in seconds
             "SOCKET_TIMEOUT": 3,  # operation timeout in seconds
             "CONNECTION_POOL_KWARGS": {"max_connections": 10000},
-            "COMPRESSOR": "django_redis.compressors.zlib.ZlibCompressor",
+            # 小于256字节不压缩，按长度选择压缩级别；标志、统计等简单的值用msgpack（bench_cache_compression）
+            "COMPRESSOR": "common.core.redis_cache.AdaptiveCompressor",
+            "SERIALIZER": "common.core.redis_cache.AdaptiveSerializer",
         }
     },
 }
 
+# 进程内LRU + redis两级缓存（common.core.cache.TieredCache），进程间通过pub/sub失效
+TIERED_CACHE = {
+    'ALIAS': 'default',
+    'MAX_ENTRIES': 10000,
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'LOCAL_TIMEOUT': 60,
+    'CHANNEL': 'cache:invalidate',
+}
+
+# 缓存统计（common.core.cache_metrics），关闭时没有额外开销
+CACHE_METRICS = False
+
+# 修改settings.ini后自动重新读取project_settings（common.core.settings）
+PROJECT_SETTINGS_WATCH = True
+# 收到SIGHUP时也立即重新读取；服务器（如uWSGI）已使用SIGHUP时不要开启
+PROJECT_SETTINGS_SIGHUP = False
+
 # Authentication
 
 AUTH_USER_MODEL = 'main.User'
@@ -168,6 +200,18 @@ AWS_SECRET_ACCESS_KEY = project_settings.storage.secret_key
 AWS_S3_BUCKET_NAME = project_settings.storage.bucket_name
 AWS_S3_BUCKET_AUTH = False
 AWS_S3_FILE_OVERWRITE = True
+# 分段上传（common.core.storage.BaseS3Storage）：超过阈值的文件按分段大小并发上传，
+# 内存中约保留(并发数 + 1) * 分段大小
+AWS_S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+AWS_S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+AWS_S3_MAX_CONCURRENCY = 4
+
+# 上传的base64图片（common.serializers.fields.Base64ImageField）解码后的最大字节数
+BASE64_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+# Base64ImageField(represent_in_base64=True)的编码结果在每个进程中的缓存大小
+BASE64_IMAGE_CACHE_SIZE = 32 * 1024 * 1024
+# S3上的图片在该时间（秒）内不重复请求ETag，同名替换后最多该时间内仍返回旧的编码结果
+BASE64_IMAGE_VERSION_TIMEOUT = 60
 
 AWS_S3_ENDPOINT_URL_STATIC = project_settings.storage.endpoint_url
 AWS_S3_BUCKET_NAME_STATIC = 'static'
@@ -197,6 +241,17 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'common.permissions.BaseModelPermissions'
     ],
+    'DEFAULT_RENDERER_CLASSES': (
+        'common.core.renderers.JSONRenderer',
+        'common.core.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'rest_framework.parsers.JSONParser',
+        'common.core.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
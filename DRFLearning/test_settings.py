@@ -0,0 +1,32 @@
+"""
+测试用的配置：两个SQLite数据库分别作为主库和从库，缓存使用本地内存，不需要MySQL、redis
+
+需要settings.ini（可由settings.ini.template复制）；main.models.auth给auth.Group添加了description字段，
+该字段的迁移生成在django的auth应用中，新环境中先执行一次：
+
+python manage.py makemigrations auth --settings=DRFLearning.test_settings
+python manage.py test --settings=DRFLearning.test_settings
+"""
+from DRFLearning.settings import *  # noqa
+from DRFLearning.settings import BASE_DIR
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'test_default.sqlite3',
+        'ATOMIC_REQUESTS': True,
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'test_replica.sqlite3',
+    },
+}
+REPLICA = {'ALIASES': ['replica'], 'STICKY_SECONDS': 5, 'MAX_LAG': 3, 'LAG_CHECK_INTERVAL': 5}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# 测试中不启动后台线程
+PROJECT_SETTINGS_WATCH = False
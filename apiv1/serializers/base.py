@@ -1,5 +1,4 @@
-from rest_framework import serializers
-
+from common import serializers
 from main.models import ServerGroup
 
 
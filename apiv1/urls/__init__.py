@@ -3,4 +3,5 @@ from django.urls import path, include
 urlpatterns = [
     path('auth/', include('apiv1.urls.auth')),
     path('base/', include('apiv1.urls.base')),
+    path('metrics/', include('apiv1.urls.metrics')),
 ]
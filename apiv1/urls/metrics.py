@@ -0,0 +1,7 @@
+from django.urls import path
+
+from apiv1.views import metrics as views
+
+urlpatterns = [
+    path('cache/', views.CacheMetrics.as_view(), name='cache_metrics'),
+]
@@ -0,0 +1,15 @@
+from rest_framework.permissions import IsAdminUser
+
+from common.core.cache_metrics import collect
+from common.views import generics
+from common.views.response import Response
+
+
+class CacheMetrics(generics.APIView):
+    """
+    各进程汇总的缓存统计（需开启CACHE_METRICS）
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, *args, **kwargs):
+        return Response(collect())
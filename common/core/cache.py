@@ -0,0 +1,300 @@
+"""
+两级缓存：进程内LRU + django cache（redis）
+
+写入、删除时通过redis pub/sub通知其他进程删除进程内的缓存
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from itertools import islice
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import caches
+
+from common.utils.cache import LRUCache
+
+__all__ = [
+    'TieredCache',
+    'tiered_cache',
+]
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'ALIAS': 'default',
+    'MAX_ENTRIES': 10000,
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'LOCAL_TIMEOUT': 60,  # 进程内缓存的最长时间，防止丢失失效通知时一直使用旧数据
+    'CHANNEL': 'cache:invalidate',
+}
+
+_missing = object()
+
+
+def estimate_size(value, sample=8, budget=64):
+    """
+    估算对象占用的内存，不序列化：容器按前sample个元素的平均大小乘以元素数，
+    最多展开budget个对象（之后只计算对象本身），开销与值的大小无关
+    """
+    remaining = [budget]
+
+    def size_of(obj):
+        size = sys.getsizeof(obj)
+        if remaining[0] <= 0:
+            return size
+        remaining[0] -= 1
+        if isinstance(obj, (list, tuple, set, frozenset)):
+            items = list(islice(obj, sample))
+            if items:
+                size += sum(size_of(item) for item in items) * len(obj) // len(items)
+        elif isinstance(obj, dict):
+            items = list(islice(obj.items(), sample))
+            if items:
+                size += sum(size_of(k) + size_of(v) for k, v in items) * len(obj) // len(items)
+        return size
+
+    return size_of(value)
+
+
+class TieredCache(object):
+    """
+    进程内LRU（按条目数和字节数淘汰）在前，django cache在后
+
+    进程内缓存的值直接返回，不反序列化，调用方不应修改返回的可变对象；
+    set、delete、incr后发布失效通知，其他进程收到后删除对应的进程内缓存，
+    订阅断开重连后清空进程内缓存；后端不是django-redis时不订阅（如测试中的locmem）
+    """
+
+    def __init__(self, **options):
+        self.options = {**DEFAULT_OPTIONS, **getattr(settings, 'TIERED_CACHE', {}), **options}
+        self.local = LRUCache(
+            max_entries=self.options['MAX_ENTRIES'],
+            max_bytes=self.options['MAX_BYTES'],
+            sizeof=itemgetter(2),
+        )
+        self.local_hits = self.remote_hits = self.misses = 0
+        self._token = uuid.uuid4().hex  # 忽略自己发布的通知
+        self._pid = None
+        self._listener = None
+        self._lock = threading.Lock()
+
+    @property
+    def remote(self):
+        return caches[self.options['ALIAS']]
+
+    def _redis(self):
+        try:
+            from django_redis import get_redis_connection
+            from django_redis.cache import RedisCache
+        except ImportError:
+            return
+        if not isinstance(self.remote, RedisCache):
+            return
+        return get_redis_connection(self.options['ALIAS'])
+
+    # 进程内缓存
+
+    def _ensure_listener(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            # fork后的子进程：丢弃父进程的缓存，重新订阅
+            self.local.clear()
+            self._pid = pid
+            if self._redis() is not None:
+                self._listener = threading.Thread(target=self._listen, name='tiered-cache-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        channel = self.options['CHANNEL']
+        while True:
+            try:
+                pubsub = self._redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel)
+                # 订阅前可能错过了通知
+                self.local.clear()
+                for message in pubsub.listen():
+                    self._handle_message(message['data'])
+            except Exception as exc:
+                logger.warning('Tiered cache listener disconnected: %s', exc)
+                self.local.clear()
+                time.sleep(1)
+
+    def _handle_message(self, data):
+        message = json.loads(data)
+        if message.get('token') == self._token:
+            return
+        if message.get('clear'):
+            self.local.clear()
+            return
+        for key in message.get('keys', ()):
+            self.local.delete(key)
+
+    def _publish(self, keys=None, clear=False):
+        redis = self._redis()
+        if redis is None:
+            return
+        message = {'token': self._token}
+        if clear:
+            message['clear'] = True
+        else:
+            message['keys'] = list(keys)
+        try:
+            redis.publish(self.options['CHANNEL'], json.dumps(message))
+        except Exception as exc:
+            logger.warning('Failed to publish cache invalidation: %s', exc)
+
+    def _set_local(self, key, value, timeout):
+        local_timeout = self.options['LOCAL_TIMEOUT']
+        if timeout is not None:
+            local_timeout = min(timeout, local_timeout)
+        if local_timeout <= 0:
+            return
+        self.local.set(key, (value, time.monotonic() + local_timeout, estimate_size(value)))
+
+    def _get_local(self, key):
+        entry = self.local.get(key)
+        if entry is None:
+            return _missing
+        value, expires_at, _ = entry
+        if expires_at < time.monotonic():
+            self.local.delete(key)
+            return _missing
+        return value
+
+    # django cache的接口
+
+    def get(self, key, default=None, timeout=None):
+        """
+        timeout：写入进程内缓存的时间，默认为LOCAL_TIMEOUT
+        """
+        self._ensure_listener()
+        value = self._get_local(key)
+        if value is not _missing:
+            self.local_hits += 1
+            return value
+        value = self.remote.get(key, _missing)
+        if value is _missing:
+            self.misses += 1
+            return default
+        self.remote_hits += 1
+        self._set_local(key, value, timeout)
+        return value
+
+    def get_many(self, keys, timeout=None):
+        self._ensure_listener()
+        result = dict()
+        remote_keys = list()
+        for key in keys:
+            value = self._get_local(key)
+            if value is _missing:
+                remote_keys.append(key)
+            else:
+                result[key] = value
+        self.local_hits += len(result)
+        if remote_keys:
+            remote = self.remote.get_many(remote_keys)
+            self.remote_hits += len(remote)
+            self.misses += len(remote_keys) - len(remote)
+            for key, value in remote.items():
+                self._set_local(key, value, timeout)
+            result.update(remote)
+        return result
+
+    def set(self, key, value, timeout=None):
+        self._ensure_listener()
+        self.remote.set(key, value, timeout)
+        self._set_local(key, value, timeout)
+        self._publish([key])
+
+    def set_many(self, data, timeout=None):
+        self._ensure_listener()
+        self.remote.set_many(data, timeout)
+        for key, value in data.items():
+            self._set_local(key, value, timeout)
+        self._publish(data.keys())
+
+    def add(self, key, value, timeout=None):
+        self._ensure_listener()
+        added = self.remote.add(key, value, timeout)
+        if added:
+            self._set_local(key, value, timeout)
+        return added
+
+    def delete(self, key):
+        self._ensure_listener()
+        self.local.delete(key)
+        deleted = self.remote.delete(key)
+        self._publish([key])
+        return deleted
+
+    def delete_many(self, keys):
+        self._ensure_listener()
+        keys = list(keys)
+        for key in keys:
+            self.local.delete(key)
+        self.remote.delete_many(keys)
+        self._publish(keys)
+
+    def incr(self, key, delta=1):
+        """
+        不存在时抛出ValueError（与django cache一致）
+        """
+        self._ensure_listener()
+        self.local.delete(key)
+        value = self.remote.incr(key, delta)
+        self._publish([key])
+        return value
+
+    def clear(self):
+        """
+        django-redis后端只删除本项目（KEY_PREFIX）的key（SCAN、UNLINK），不执行FLUSHDB，
+        不影响同一redis中的其他数据
+        """
+        self.local.clear()
+        if self._redis() is None:
+            self.remote.clear()
+            return
+        # cache_purge依赖本模块
+        from common.core.cache_purge import purge
+        purge(['*'], alias=self.options['ALIAS'], cache=self)
+
+    def clear_local(self):
+        """
+        只清空各进程的进程内缓存（如直接删除了redis中的key后）
+        """
+        self.local.clear()
+        self._publish(clear=True)
+
+    def stats(self):
+        """
+        各级缓存的命中情况
+        """
+        lookups = self.local_hits + self.remote_hits + self.misses
+        remote_lookups = self.remote_hits + self.misses
+        return {
+            'local': {
+                'hits': self.local_hits,
+                'hit_ratio': self.local_hits / lookups if lookups else 0,
+                'entries': len(self.local),
+                'evictions': self.local.evictions,
+                'bytes': self.local.total_bytes,
+            },
+            'remote': {
+                'hits': self.remote_hits,
+                'misses': self.misses,
+                'hit_ratio': self.remote_hits / remote_lookups if remote_lookups else 0,
+            },
+            'hit_ratio': (self.local_hits + self.remote_hits) / lookups if lookups else 0,
+        }
+
+
+tiered_cache = TieredCache()
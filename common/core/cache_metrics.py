@@ -0,0 +1,286 @@
+"""
+缓存的命中、耗时统计
+
+CACHE_METRICS为真时，instrument()返回的包装对象按key的命名空间（见key_namespace）
+和模型label记录hits、misses、sets、deletes及耗时分布；为假时直接返回原缓存，没有额外开销
+
+每个进程定期（FLUSH_INTERVAL）在后台线程中将统计写入缓存，cache_stats命令和指标接口汇总各进程的结果
+"""
+import bisect
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+__all__ = [
+    'CacheMetrics',
+    'InstrumentedCache',
+    'cache_metrics',
+    'instrument',
+    'collect',
+]
+
+# 耗时分布的上界（秒），最后一个桶为超出的部分
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+EVENTS = ('hits', 'misses', 'sets', 'deletes')
+
+FLUSH_INTERVAL = 10
+WORKERS_KEY = 'cache:metrics:workers'  # redis中为hash，{进程: 最后写入的时间}
+WORKER_KEY = 'cache:metrics:%s'
+
+logger = logging.getLogger(__name__)
+
+_missing = object()
+
+
+def key_namespace(key):
+    """
+    第一个冒号之前的部分；"cache:"开头的内部key（cache:version、cache:lock、cache:metrics）取前两段
+    """
+    parts = str(key).split(':', 2)
+    if parts[0] == 'cache' and len(parts) > 1:
+        return 'cache:' + parts[1]
+    return parts[0]
+
+
+def _redis(alias):
+    """
+    django-redis的连接，后端不是django-redis时为None
+    """
+    try:
+        from django_redis import get_redis_connection
+        from django_redis.cache import RedisCache
+    except ImportError:
+        return
+    if not isinstance(caches[alias], RedisCache):
+        return
+    return get_redis_connection(alias)
+
+
+def get_workers(alias='default'):
+    """
+    已注册的进程，{进程: 最后写入的时间}
+    """
+    redis = _redis(alias)
+    if redis is None:
+        return caches[alias].get(WORKERS_KEY) or dict()
+    workers = redis.hgetall(caches[alias].make_key(WORKERS_KEY))
+    return {worker.decode(): float(at) for worker, at in workers.items()}
+
+
+class CacheMetrics(object):
+    """
+    当前进程的统计，{group: {hits, misses, sets, deletes, latency: [各桶的次数]}}
+
+    group为"namespace:<命名空间>"或"model:<模型label>"
+    """
+
+    def __init__(self, alias='default', flush_interval=FLUSH_INTERVAL):
+        self.alias = alias
+        self.flush_interval = flush_interval
+        self.worker = '%s:%s' % (socket.gethostname(), os.getpid())
+        self.groups = dict()
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._flushing = False
+
+    def _group(self, name):
+        group = self.groups.get(name)
+        if group is None:
+            group = self.groups.setdefault(name, dict(
+                {event: 0 for event in EVENTS}, latency=[0] * (len(LATENCY_BUCKETS) + 1)
+            ))
+        return group
+
+    def record(self, groups, event, count, seconds=None):
+        """
+        seconds为None时不计入耗时分布（同一次调用的多个事件只记录一次耗时）
+        """
+        bucket = None if seconds is None else bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        flush = False
+        with self._lock:
+            for name in groups:
+                group = self._group(name)
+                group[event] += count
+                if bucket is not None:
+                    group['latency'][bucket] += 1
+            if not self._flushing and time.monotonic() - self._flushed_at > self.flush_interval:
+                self._flushing = flush = True
+        if flush:
+            # 不在请求中等待写入缓存
+            threading.Thread(target=self._background_flush, name='cache-metrics-flush', daemon=True).start()
+
+    def _background_flush(self):
+        try:
+            self.flush()
+        except Exception as exc:
+            logger.warning('Failed to flush cache metrics: %s', exc)
+        finally:
+            self._flushing = False
+
+    def snapshot(self):
+        from common.core.cache import tiered_cache
+
+        with self._lock:
+            groups = {name: dict(group, latency=list(group['latency'])) for name, group in self.groups.items()}
+        return {
+            'worker': self.worker,
+            'updated_at': time.time(),
+            'groups': groups,
+            'tiered': tiered_cache.stats(),
+        }
+
+    def flush(self):
+        """
+        写入缓存，供其他进程汇总
+        """
+        self._flushed_at = time.monotonic()
+        remote = caches[self.alias]
+        timeout = self.flush_interval * 6
+        remote.set(WORKER_KEY % self.worker, self.snapshot(), timeout)
+        self._register(remote, timeout)
+
+    def _register(self, remote, timeout):
+        """
+        注册当前进程，顺便清理已退出的进程；redis中用HSET、HDEL，各进程同时写入时不会覆盖
+        """
+        now = time.time()
+        redis = _redis(self.alias)
+        if redis is None:
+            # 非redis后端（如测试中的locmem）只在当前进程内
+            workers = {worker: at for worker, at in get_workers(self.alias).items() if now - at < timeout}
+            workers[self.worker] = now
+            remote.set(WORKERS_KEY, workers, None)
+            return
+        key = remote.make_key(WORKERS_KEY)
+        redis.hset(key, self.worker, now)
+        expired = [worker for worker, at in get_workers(self.alias).items() if now - at >= timeout]
+        if expired:
+            redis.hdel(key, *expired)
+
+    def reset(self):
+        with self._lock:
+            self.groups.clear()
+
+
+cache_metrics = CacheMetrics()
+
+
+class InstrumentedCache(object):
+    """
+    记录统计的缓存包装，接口与django cache一致，未包装的方法直接转发
+    """
+
+    def __init__(self, backend, model_label=None, metrics=None):
+        self.backend = backend
+        self.model_label = model_label
+        self.metrics = metrics or cache_metrics
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _groups(self, key):
+        groups = ['namespace:' + key_namespace(key)]
+        if self.model_label:
+            groups.append('model:' + self.model_label)
+        return groups
+
+    def get(self, key, default=None, **kwargs):
+        start = time.perf_counter()
+        value = self.backend.get(key, _missing, **kwargs)
+        event = 'misses' if value is _missing else 'hits'
+        self.metrics.record(self._groups(key), event, 1, time.perf_counter() - start)
+        return default if value is _missing else value
+
+    def get_many(self, keys, **kwargs):
+        keys = list(keys)
+        start = time.perf_counter()
+        result = self.backend.get_many(keys, **kwargs)
+        seconds = time.perf_counter() - start
+        if keys:
+            groups = self._groups(keys[0])
+            self.metrics.record(groups, 'hits', len(result), seconds)
+            self.metrics.record(groups, 'misses', len(keys) - len(result))
+        return result
+
+    def _write(self, event, key, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(key, *args, **kwargs)
+        self.metrics.record(self._groups(key), event, 1, time.perf_counter() - start)
+        return result
+
+    def set(self, key, *args, **kwargs):
+        return self._write('sets', key, self.backend.set, *args, **kwargs)
+
+    def add(self, key, *args, **kwargs):
+        return self._write('sets', key, self.backend.add, *args, **kwargs)
+
+    def incr(self, key, *args, **kwargs):
+        return self._write('sets', key, self.backend.incr, *args, **kwargs)
+
+    def delete(self, key, *args, **kwargs):
+        return self._write('deletes', key, self.backend.delete, *args, **kwargs)
+
+    def set_many(self, data, *args, **kwargs):
+        start = time.perf_counter()
+        result = self.backend.set_many(data, *args, **kwargs)
+        if data:
+            self.metrics.record(self._groups(next(iter(data))), 'sets', len(data), time.perf_counter() - start)
+        return result
+
+
+def instrument(backend, model_label=None):
+    """
+    CACHE_METRICS为假时原样返回
+    """
+    if not getattr(settings, 'CACHE_METRICS', False):
+        return backend
+    return InstrumentedCache(backend, model_label)
+
+
+def _merge(target, source):
+    for name, group in source.items():
+        merged = target.setdefault(name, dict(
+            {event: 0 for event in EVENTS}, latency=[0] * (len(LATENCY_BUCKETS) + 1)
+        ))
+        for event in EVENTS:
+            merged[event] += group[event]
+        merged['latency'] = [a + b for a, b in zip(merged['latency'], group['latency'])]
+
+
+def collect(alias='default'):
+    """
+    汇总各进程写入缓存的统计（包含当前进程），返回{groups, workers, buckets, redis}
+    """
+    remote = caches[alias]
+    if cache_metrics.groups:
+        cache_metrics.flush()
+    workers = get_workers(alias)
+    snapshots = remote.get_many([WORKER_KEY % worker for worker in workers])
+    groups = dict()
+    for snapshot in snapshots.values():
+        _merge(groups, snapshot['groups'])
+    for group in groups.values():
+        lookups = group['hits'] + group['misses']
+        group['hit_ratio'] = group['hits'] / lookups if lookups else 0
+    return {
+        'buckets': list(LATENCY_BUCKETS),
+        'groups': groups,
+        'workers': {snapshot['worker']: snapshot['tiered'] for snapshot in snapshots.values()},
+        'redis': _redis_stats(alias),
+    }
+
+
+def _redis_stats(alias):
+    """
+    redis自身的命中与淘汰，后端不是django-redis时为None
+    """
+    redis = _redis(alias)
+    if redis is None:
+        return
+    info = redis.info('stats')
+    return {key: info.get(key) for key in ('keyspace_hits', 'keyspace_misses', 'evicted_keys', 'expired_keys')}
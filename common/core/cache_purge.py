@@ -0,0 +1,97 @@
+"""
+按命名空间、模型删除redis中的缓存
+
+缓存的key为"KEY_PREFIX:版本:命名空间:..."（django cache的key_func），只删除本项目的缓存，
+不影响同一redis中Celery的broker、result数据；用SCAN遍历、UNLINK（后台释放内存）分批删除，不阻塞redis
+"""
+import time
+
+from django.core.cache import caches
+
+from common.core.cache import tiered_cache
+from common.core.cache_metrics import WORKER_KEY, WORKERS_KEY
+from common.core.routers import STICKY_KEY
+from common.models.managers import INSTANCE, LOCK_KEY, QUERYSET, VERSION_KEY
+
+__all__ = [
+    'NAMESPACES',
+    'get_patterns',
+    'purge',
+]
+
+# {命名空间: key的模式}
+NAMESPACES = {
+    'instance': INSTANCE + ':*',
+    'queryset': QUERYSET + ':*',
+    'version': VERSION_KEY % '*',
+    'lock': LOCK_KEY % '*',
+    'metrics': WORKER_KEY % '*',
+    'compressed': 'compressed:*',
+    'response': 'response:*',
+    'sticky': STICKY_KEY % '*',
+}
+
+
+def get_patterns(namespaces=(), models=(), everything=False):
+    """
+    要删除的key的模式（不含KEY_PREFIX、版本）
+
+    models：模型label，删除该模型的实例、查询集缓存、版本号和刷新锁
+    """
+    if everything:
+        return ['*']
+    patterns = [NAMESPACES[namespace] for namespace in namespaces]
+    for label in models:
+        patterns += [
+            '%s:%s:*' % (INSTANCE, label),
+            '%s:%s:*' % (QUERYSET, label),
+            LOCK_KEY % ('%s:%s:*' % (INSTANCE, label)),
+            VERSION_KEY % label,
+            'response:%s:*' % label,
+        ]
+    if WORKER_KEY % '*' in patterns:
+        patterns.append(WORKERS_KEY)
+    return patterns
+
+
+def purge(patterns, alias='default', batch_size=500, pipeline_size=10, dry_run=False, callback=None, cache=None):
+    """
+    删除匹配的key，返回{pattern: (删除的数量, 耗时)}
+
+    每batch_size个key一条UNLINK，每pipeline_size条UNLINK一次往返；dry_run时只统计数量
+    callback(pattern, count)：每次往返后调用，用于显示进度
+    cache：删除后清空进程内缓存的TieredCache，默认为tiered_cache
+    """
+    from django_redis import get_redis_connection
+
+    backend = caches[alias]
+    redis = get_redis_connection(alias)
+    result = dict()
+    for pattern in patterns:
+        # 所有版本
+        match = backend.make_key(pattern, version='*')
+        start = time.perf_counter()
+        count = 0
+        pipeline = redis.pipeline(transaction=False)
+        batch = list()
+        for key in redis.scan_iter(match=match, count=batch_size * 2):
+            batch.append(key)
+            if len(batch) < batch_size:
+                continue
+            count += len(batch)
+            if not dry_run:
+                pipeline.unlink(*batch)
+            batch = list()
+            if len(pipeline) >= pipeline_size:
+                pipeline.execute()
+                if callback:
+                    callback(pattern, count)
+        count += len(batch)
+        if batch and not dry_run:
+            pipeline.unlink(*batch)
+        pipeline.execute()
+        result[pattern] = (count, time.perf_counter() - start)
+    if not dry_run:
+        # 各进程的进程内缓存也需要清空
+        (cache or tiered_cache).clear_local()
+    return result
@@ -2,6 +2,7 @@ import sys
 
 from django.core.management.base import BaseCommand, OutputWrapper
 
+from common.core.routers import replica_reads
 from common.filters.backends import QuerySetFilter
 from common.logging import loggers
 from common.utils.text import query_str2dict
@@ -9,8 +10,13 @@ from common.utils.text import query_str2dict
 
 class QuerySetCommand(BaseCommand):
     filter_backend = QuerySetFilter(strict=True)
+    use_replica = True  # 读操作使用从库（配置了从库时）
 
     def add_arguments(self, parser):
+        parser.add_argument(
+            '--use-primary', action='store_true', default=False,
+            help='Read from the primary database instead of replicas.'
+        )
         parser.add_argument(
             '--order-by', type=str, default=None,
             help='Queryset order argument'
@@ -28,6 +34,12 @@ class QuerySetCommand(BaseCommand):
             help='Queryset exclude queries, similar to filter.'
         )
 
+    def execute(self, *args, **options):
+        if not self.use_replica or options.get('use_primary'):
+            return super().execute(*args, **options)
+        with replica_reads():
+            return super().execute(*args, **options)
+
     def handle(self, *args, **options):
         if options.get('filter'):
             self.filter_backend.filter_kwargs.update(**options['filter'])
@@ -0,0 +1,20 @@
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+__all__ = [
+    'MessagePackParser',
+]
+
+
+class MessagePackParser(BaseParser):
+    """
+    MessagePack，供内部服务使用（Content-Type: application/msgpack）
+    """
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as exc:
+            raise ParseError('MessagePack parse error - %s' % (str(exc) or exc.__class__.__name__))
@@ -0,0 +1,98 @@
+import json
+
+import msgpack
+from rest_framework import renderers
+
+from common.utils.json import JsonEncoder, RawJSON, dumps_bytes
+from common.views.response import Envelope
+
+__all__ = [
+    'JSONRenderer',
+    'MessagePackRenderer',
+]
+
+ENVELOPE_KEYS = {'code', 'msg', 'data'}
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    使用项目的JsonEncoder，紧凑格式时走common.utils.json.dumps_bytes（安装了orjson时使用orjson）
+
+    Response的数据（Envelope）只编码data，前后缀直接拼接；
+    数据或Envelope的data为RawJSON（CachedResponseMixin缓存的响应）时原样输出
+    """
+    encoder_class = JsonEncoder
+    _prefixes = dict()  # {code: b'{"code":200,"msg":[],"data":'}，msg为空时的前缀
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, RawJSON):
+            return bytes(data)
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if isinstance(data, Envelope) and data.keys() == ENVELOPE_KEYS:
+            return self.render_envelope(data)
+        return self._escape(dumps_bytes(data, encoder_class=self.encoder_class))
+
+    def render_envelope(self, envelope: Envelope):
+        code, msg, payload = envelope['code'], envelope['msg'], envelope['data']
+        prefix = None if msg else self._prefixes.get(code)
+        if prefix is None:
+            prefix = b'{"code":%s,"msg":%s,"data":' % (
+                dumps_bytes(code, encoder_class=self.encoder_class),
+                self._escape(dumps_bytes(msg, encoder_class=self.encoder_class))
+            )
+            if not msg:
+                self._prefixes[code] = prefix
+        if isinstance(payload, RawJSON):
+            body = payload
+        else:
+            body = self._escape(dumps_bytes(payload, encoder_class=self.encoder_class))
+        return b''.join((prefix, body, b'}'))
+
+    @staticmethod
+    def _escape(ret: bytes):
+        # 与DRF一致，转义\u2028和\u2029
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """
+    MessagePack，供内部服务使用（Accept: application/msgpack）
+
+    支持的类型与JsonEncoder一致（datetime、Decimal、UUID、FieldFile的url等）；
+    RawJSON（在任意位置）解码后再编码，不会被当作二进制
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    encoder_class = JsonEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # strict_types：bytes、list、dict等的子类（RawJSON、ReturnList、OrderedDict）交给default处理
+        return msgpack.packb(data, default=self.get_default(), use_bin_type=True, strict_types=True)
+
+    def get_default(self):
+        encoder_default = self.encoder_class().default
+
+        def default(obj):
+            if isinstance(obj, RawJSON):
+                return json.loads(obj)
+            if isinstance(obj, (list, tuple)):
+                return list(obj)
+            if isinstance(obj, dict):
+                return dict(obj)
+            for base in (str, bytes, bool, int, float):
+                if isinstance(obj, base):
+                    return base(obj)
+            return encoder_default(obj)
+
+        return default
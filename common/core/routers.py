@@ -0,0 +1,125 @@
+"""
+Database routers
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+__all__ = [
+    'ReplicaRouter',
+    'replica_reads',
+    'stick_to_primary',
+    'is_stuck_to_primary'
+]
+
+# 协程间互不影响（ASGI下同一线程中会运行多个请求）
+use_replica_var = ContextVar('use_replica', default=False)
+
+STICKY_KEY = 'replica:sticky:%s'
+
+
+class ReplicaRouter(object):
+    """
+    读写分离
+
+    只有在replica_reads上下文中（generics的list/retrieve，QuerySetCommand）的读操作会使用从库，
+    其余读操作和所有写操作都使用主库（包括从库读出的实例save()、delete()时）。
+    从库复制延迟超过MAX_LAG秒时跳过该从库，所有从库都不可用时使用主库。
+    """
+    _lags = dict()  # {alias: (checked_at, lag)}
+
+    def db_for_read(self, model, **hints):
+        if not use_replica_var.get():
+            return
+        return self.choose_replica()
+
+    def db_for_write(self, model, **hints):
+        # 不指定时django写入实例读出的数据库（instance._state.db），可能是只读的从库
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 主库和从库的数据相同，实例间可以关联
+        aliases = {'default', *settings.REPLICA['ALIASES']}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+
+    def choose_replica(self):
+        options = settings.REPLICA
+        aliases = [alias for alias in options['ALIASES']
+                   if self.replication_lag(alias) <= options['MAX_LAG']]
+        if aliases:
+            return random.choice(aliases)
+
+    def replication_lag(self, alias):
+        """
+        复制延迟，每个进程按LAG_CHECK_INTERVAL缓存检查结果
+        """
+        now = time.monotonic()
+        checked = self._lags.get(alias)
+        if checked and now - checked[0] < settings.REPLICA['LAG_CHECK_INTERVAL']:
+            return checked[1]
+        lag = self.get_replication_lag(alias)
+        self._lags[alias] = (now, lag)
+        return lag
+
+    @staticmethod
+    def get_replication_lag(alias):
+        """
+        从库不可用或未在复制时返回无穷大
+        """
+        connection = connections[alias]
+        if connection.vendor != 'mysql':
+            return 0
+        try:
+            with connection.cursor() as cursor:
+                try:
+                    # MySQL 8.0.22+
+                    cursor.execute('SHOW REPLICA STATUS')
+                    lag_column = 'Seconds_Behind_Source'
+                except DatabaseError:
+                    cursor.execute('SHOW SLAVE STATUS')
+                    lag_column = 'Seconds_Behind_Master'
+                row = cursor.fetchone()
+                columns = [column[0] for column in cursor.description or ()]
+        except DatabaseError:
+            return float('inf')
+        if not row:
+            return float('inf')
+        lag = dict(zip(columns, row)).get(lag_column)
+        return float('inf') if lag is None else lag
+
+
+def stick_to_primary(user):
+    """
+    用户写操作后，STICKY_SECONDS秒内其读操作都使用主库
+    """
+    seconds = settings.REPLICA['STICKY_SECONDS']
+    if not seconds or user is None or not user.is_authenticated:
+        return
+    cache.set(STICKY_KEY % user.pk, 1, seconds)
+
+
+def is_stuck_to_primary(user):
+    if user is None or not user.is_authenticated:
+        return False
+    return bool(cache.get(STICKY_KEY % user.pk))
+
+
+@contextmanager
+def replica_reads(user=None):
+    """
+    上下文中的读操作使用从库
+
+    user：当前用户，刚写过数据的用户仍使用主库
+    """
+    use_replica = bool(settings.REPLICA['ALIASES']) and not is_stuck_to_primary(user)
+    token = use_replica_var.set(use_replica)
+    try:
+        yield use_replica
+    finally:
+        use_replica_var.reset(token)
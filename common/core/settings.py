@@ -1,8 +1,24 @@
 """
 Project settings
+
+启动时读取并转换settings.ini的所有配置项，保存为只读的快照，读取配置时不再解析；
+watch()后修改settings.ini（或开启sighup时收到SIGHUP）时重新读取，全部校验通过后才整体替换快照；
+project_settings在main.apps.MainConfig.ready中按PROJECT_SETTINGS_WATCH开启
+
+注意：Django settings中由project_settings计算的配置（DATABASES、CACHES等）不会随之改变，
+只有运行时读取project_settings的代码（如密码校验、S3地址）使用新的配置
 """
-from configparser import ConfigParser
+import logging
+import os
+import signal
+import threading
+from collections import namedtuple
+from configparser import ConfigParser, Error as ConfigParserError, NoOptionError, NoSectionError
+from copy import deepcopy
 from pathlib import Path
+from types import MappingProxyType
+
+from django.core.exceptions import ImproperlyConfigured
 
 from common import BASE_DIR
 from common.utils.text import is_list, str2iter
@@ -13,6 +29,11 @@ __all__ = [
     'BaseSection'
 ]
 
+logger = logging.getLogger(__name__)
+
+# parser：ConfigParser，sections：{section名: {option: 转换后的值}}，mtime：配置文件的修改时间
+Snapshot = namedtuple('Snapshot', ('parser', 'sections', 'mtime'))
+
 
 class SectionMetaClass(type):
 
@@ -56,51 +77,81 @@ class BaseSection(object, metaclass=SectionMetaClass):
 
     注意：定义的option（属性名）不要以下划线开头
     """
-    _parser = None
+    _settings = None  # 所属的BaseSettings实例
     _allow_undefined = True  # 是否允许未定义的属性
+    _required = True  # 配置文件中是否必须有该section
 
-    def __init__(self, allow_undefined=None):
+    def __init__(self, allow_undefined=None, required=None):
         """
         allow_undefined: 是否允许读取未定义配置项（如果存在，默认转为字符串）
+        required: 配置文件中是否必须有该section，缺少时读取配置文件失败
         """
         self._section_name = self.__class__.__name__
         if allow_undefined is not None:
             self._allow_undefined = allow_undefined
+        if required is not None:
+            self._required = required
+
+    @property
+    def _parser(self):
+        return self._settings._snapshot.parser
 
     def __getattr__(self, key):
         """
-        通过注解类型获取配置的值
-        """
-        options = self.__annotations__
-        option_keys = options.keys()
-        section_name = self.__class__.__name__
-        if key not in option_keys:
-            if self._allow_undefined:
-                # build undefined option
-                options[key] = str
-            else:
-                raise AttributeError("No option '%s' defined in section %s." % (key, section_name))
+        从快照中获取已转换的值
+        """
+        if key.startswith('_'):
+            raise AttributeError(key)
+        section_name = self._section_name
+        values = self._settings._snapshot.sections.get(section_name)
+        if values is None:
+            raise NoSectionError(section_name)
+        try:
+            return values[key]
+        except KeyError:
+            pass
+        if key in self.__annotations__ or self._allow_undefined:
+            raise NoOptionError(key, section_name)
+        raise AttributeError("No option '%s' defined in section %s." % (key, section_name))
+
+    def _convert(self, value, a_type):
+        type_name = self._supported_types.get(a_type)
+        # try to get the self defined method
+        converter = getattr(type(self), 'to_' + type_name, None)
+        if converter is not None:
+            return converter(value)
+        return a_type(value)
+
+    def _compile(self, parser):
+        """
+        读取并转换本section的所有配置项，返回(values, errors)，section不存在时values为None
+        """
+        section_name = self._section_name
+        if section_name == parser.default_section:
+            defined = list(parser.defaults())
+        elif parser.has_section(section_name):
+            defined = parser.options(section_name)
+        else:
+            return None, [f'[{section_name}]: missing section'] if self._required else []
+        options = dict(self.__annotations__)
+        if self._allow_undefined:
+            for option in defined:
+                options.setdefault(option, str)
+        values, errors = dict(), list()
         for option, a_type in options.items():
-            if key == option:
-                try:
-                    value = self._parser.get(section_name, option)
-                except Exception as e:
-                    raise e
-                # type changing
-                type_name = self._supported_types.get(a_type)
-                try:
-                    # try to get the self defined method
-                    return object.__getattribute__(self, 'to_' + type_name).__call__(value)
-                except AttributeError:
-                    pass
-                except TypeError:
-                    raise TypeError(f'The value "{value}" for option {option} is invalid.')
-
-                if value is None:
-                    return value
-                # default action
-                return a_type.__call__(value)
-        return super().__getattribute__(key)
+            try:
+                value = parser.get(section_name, option)
+            except NoOptionError:
+                errors.append(f'[{section_name}] {option}: missing')
+                continue
+            except ConfigParserError as e:
+                errors.append(f'[{section_name}] {option}: {e}')
+                continue
+            try:
+                values[option] = self._convert(value, a_type)
+            except (TypeError, ValueError):
+                errors.append(f'[{section_name}] {option}: invalid {a_type.__name__} value "{value}"')
+        return MappingProxyType(values), errors
 
     def __repr__(self):
         return '<%s section object>' % self.__class__.__name__
@@ -176,6 +227,63 @@ class RabbitMQ(BaseSection):
         return f'amqp://{self.user}:{self.password}@{self.host}:{self.port}/{self.vhost}'
 
 
+class Replica(BaseSection):
+    """
+    MySQL从库（读写分离），用户名、密码和库名与MySQL一致
+
+    hosts：从库地址，逗号隔开，如192.168.0.11:3306,192.168.0.12:3306，为空时不使用从库
+    sticky_seconds：用户写操作后，其读操作固定使用主库的秒数
+    max_lag：从库复制延迟（秒）超过该值时跳过该从库
+    lag_check_interval：复制延迟的检查间隔（秒）
+    """
+    hosts: str
+    sticky_seconds: int
+    max_lag: int
+    lag_check_interval: int
+
+    @property
+    def addresses(self):
+        if not self._parser.has_section(self._section_name):
+            return []
+        return [item.strip() for item in self.hosts.split(',') if item.strip()]
+
+    @property
+    def aliases(self):
+        return [f'replica{i}' for i, _ in enumerate(self.addresses, start=1)]
+
+    def databases(self, primary: dict) -> dict:
+        """
+        根据主库配置生成从库配置
+        """
+        databases = dict()
+        for alias, address in zip(self.aliases, self.addresses):
+            host, _, port = address.partition(':')
+            database = deepcopy(primary)
+            database.update({
+                'HOST': host,
+                'PORT': int(port) if port else primary['PORT'],
+                'ATOMIC_REQUESTS': False,
+                'TEST': {'MIRROR': 'default'}
+            })
+            databases[alias] = database
+        return databases
+
+    @property
+    def router_options(self):
+        """
+        common.core.routers.ReplicaRouter的配置
+        """
+        aliases = self.aliases
+        if not aliases:
+            return {'ALIASES': [], 'STICKY_SECONDS': 0, 'MAX_LAG': 0, 'LAG_CHECK_INTERVAL': 0}
+        return {
+            'ALIASES': aliases,
+            'STICKY_SECONDS': self.sticky_seconds,
+            'MAX_LAG': self.max_lag,
+            'LAG_CHECK_INTERVAL': self.lag_check_interval
+        }
+
+
 class Storage(BaseSection):
     endpoint_url: str
     access_key: str
@@ -205,17 +313,139 @@ class Security(BaseSection):
 
 class BaseSettings(object):
     path = None
+    reload_interval = 5  # watch()检查配置文件修改时间的间隔（秒）
 
     def __new__(cls, *args, **kwargs):
         assert cls.path is not None, "The attribute 'path' must be given."
+        instance = super().__new__(cls, *args, **kwargs)
+        for _, section in instance._sections():
+            section._settings = instance
+        instance._lock = threading.Lock()
+        instance._reload_requested = threading.Event()
+        instance._watcher = None
+        instance._interval = None
+        instance._fork_hook = False
+        # 配置有误时启动失败
+        instance._snapshot = instance._load()
+        return instance
+
+    @classmethod
+    def _sections(cls):
+        return [
+            (attr, obj) for attr, obj in cls.__dict__.items()
+            if not attr.startswith('__') and isinstance(obj, BaseSection)
+        ]
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return
+
+    def _load(self):
+        """
+        读取、校验整个配置文件，有错误时抛出ImproperlyConfigured（列出所有错误）
+        """
+        mtime = self._mtime()
         parser = ConfigParser()
-        parser.read(cls.path)
-        dicts = filter(
-            lambda item: not item[0].startswith('__') and isinstance(item[1], BaseSection),
-            cls.__dict__.items())
-        for attr, obj in dicts:
-            setattr(obj, '_parser', parser)
-        return super().__new__(cls, *args, **kwargs)
+        parser.read(self.path)
+        sections, errors = dict(), list()
+        for _, section in self._sections():
+            values, section_errors = section._compile(parser)
+            errors += section_errors
+            if values is not None:
+                sections[section._section_name] = values
+        if errors:
+            raise ImproperlyConfigured('Invalid settings in %s:\n  %s' % (self.path, '\n  '.join(errors)))
+        return Snapshot(parser, MappingProxyType(sections), mtime)
+
+    def reload(self):
+        """
+        重新读取配置文件，校验通过后整体替换快照；有错误时保留原配置并抛出ImproperlyConfigured
+        """
+        with self._lock:
+            self._snapshot = self._load()
+
+    def reload_if_changed(self):
+        """
+        配置文件的修改时间改变时重新读取，返回是否已重新读取；有错误时记录日志，文件再次修改前不再尝试
+
+        检查和替换都在锁中，与reload()（SIGHUP）不会同时读取，后读取的（较新的文件）最后生效
+        """
+        with self._lock:
+            mtime = self._mtime()
+            if mtime == self._snapshot.mtime:
+                return False
+            try:
+                self._snapshot = self._load()
+            except ImproperlyConfigured as e:
+                logger.error('%s, the previous settings are kept.', e)
+                self._snapshot = self._snapshot._replace(mtime=mtime)
+                return False
+        logger.info('Settings reloaded from %s.', self.path)
+        return True
+
+    def watch(self, interval=None, sighup=False):
+        """
+        在后台线程中每interval秒检查配置文件的修改时间，修改后重新读取
+
+        线程不会随fork复制，os.fork()出的子进程（如gunicorn preload的worker）中自动重新启动；
+        uWSGI的worker需开启py-call-osafterfork或lazy-apps
+
+        sighup：收到SIGHUP时也立即重新读取，只能在主线程中开启。处理函数只通知后台线程，
+        原有的Python处理函数仍会被调用；原有的处理函数不是Python函数时（signal.getsignal返回None，
+        如服务器用C注册的）不替换，只检查修改时间
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._interval = interval or self.reload_interval
+        if sighup:
+            self._handle_sighup()
+        if not self._fork_hook:
+            os.register_at_fork(after_in_child=self._after_fork)
+            self._fork_hook = True
+        self._start_watcher()
+
+    def _handle_sighup(self):
+        if threading.current_thread() is not threading.main_thread() or not hasattr(signal, 'SIGHUP'):
+            logger.warning('SIGHUP can only be handled in the main thread, watching %s for changes only.', self.path)
+            return
+        previous = signal.getsignal(signal.SIGHUP)
+        if previous is None:
+            logger.warning('SIGHUP is handled outside Python, watching %s for changes only.', self.path)
+            return
+
+        def handle_sighup(signum, frame):
+            self._reload_requested.set()
+            if callable(previous):
+                previous(signum, frame)
+
+        signal.signal(signal.SIGHUP, handle_sighup)
+
+    def _start_watcher(self):
+        self._watcher = threading.Thread(
+            target=self._watch, args=(self._interval,), name='settings-watcher', daemon=True
+        )
+        self._watcher.start()
+
+    def _after_fork(self):
+        # fork时其他线程可能持有锁
+        self._lock = threading.Lock()
+        self._reload_requested = threading.Event()
+        self._start_watcher()
+
+    def _watch(self, interval):
+        while True:
+            requested = self._reload_requested.wait(interval)
+            self._reload_requested.clear()
+            try:
+                if requested:
+                    self.reload()
+                    logger.info('Settings reloaded from %s on SIGHUP.', self.path)
+                else:
+                    self.reload_if_changed()
+            except Exception as e:
+                logger.error('Failed to reload settings: %s', e)
 
     def __dir__(self):
         dirs = super().__dir__()
@@ -238,10 +468,11 @@ class ProjectSettings(BaseSettings):
 
     default = DEFAULT()
     mysql = MySQL()
+    replica = Replica(required=False)  # 没有该section时不使用从库
     redis = Redis()
     storage = Storage()
     security = Security()
-    rabbitmq = RabbitMQ()
+    rabbitmq = RabbitMQ(required=False)
 
 
 project_settings = ProjectSettings()
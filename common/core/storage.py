@@ -2,9 +2,10 @@ import os
 from urllib.parse import urlsplit, urljoin
 
 from boto3 import Session
+from boto3.s3.constants import CLASSIC_TRANSFER_CLIENT
+from boto3.s3.transfer import TransferConfig
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
-from django.core.files.temp import NamedTemporaryFile
 from django.utils import timezone
 from django_s3_storage.storage import S3Storage
 
@@ -45,31 +46,36 @@ class BaseS3Storage(S3Storage):
     """
     基础存储
 
-    修复图片保存失败问题等
+    上传时直接从文件对象分段读取、并发上传（不复制到临时文件），内存中最多保留
+    AWS_S3_MAX_BUFFER_PARTS + 1个分段（多出的一个为等待上传的分段）；
+    小于AWS_S3_MULTIPART_THRESHOLD的文件一次上传
     """
+    default_s3_settings = {
+        **S3Storage.default_s3_settings,
+        'AWS_S3_MULTIPART_THRESHOLD': 16 * 1024 * 1024,
+        # S3要求除最后一段外每段不小于5MB
+        'AWS_S3_MULTIPART_CHUNKSIZE': 8 * 1024 * 1024,
+        'AWS_S3_MAX_CONCURRENCY': 4,
+        # 已读取、未上传完成的分段数，默认与并发数相同
+        'AWS_S3_MAX_BUFFER_PARTS': None,
+    }
+
+    def _setup(self):
+        super()._setup()
+        max_concurrency = self.settings.AWS_S3_MAX_CONCURRENCY
+        self._transfer_config = TransferConfig(
+            multipart_threshold=self.settings.AWS_S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=self.settings.AWS_S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=max_concurrency,
+            use_threads=self.settings.AWS_S3_USE_THREADS,
+            # 安装了awscrt时auto会使用CRT，不受下面的分段数限制
+            preferred_transfer_client=CLASSIC_TRANSFER_CLIENT,
+        )
+        self._transfer_config.max_in_memory_upload_chunks = self.settings.AWS_S3_MAX_BUFFER_PARTS or max_concurrency
 
     def path(self, name):
         return
 
-    def _save(self, name, content):
-        """
-        Create a clone of the content file as when this is passed to boto3 it wrongly closes
-        the file upon upload whereas the storage backend expects it to still be open
-        """
-        content.seek(0, os.SEEK_SET)
-
-        # Create a new temporary file in order to solve close file issue
-        new_content = NamedTemporaryFile()
-        new_content.write(content.read())
-
-        name = super()._save(name, new_content)
-
-        # Cleanup if this is fixed upstream our duplicate should always close
-        if not new_content.closed:
-            new_content.close()
-
-        return name
-
 
 class UnReadingS3Storage(BaseS3Storage):
     """
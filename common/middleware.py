@@ -1,12 +1,20 @@
+import hashlib
 import threading
 import uuid
+import zlib
 
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
 from django.utils.deprecation import MiddlewareMixin
 
+from common.core.cache import tiered_cache
+from common.core.cache_metrics import instrument
+
 local = threading.local()
 
 __all__ = [
     'CommonMiddleware',
+    'CompressionMiddleware',
 ]
 
 
@@ -28,3 +36,125 @@ class CommonMiddleware(MiddlewareMixin):
     # def process_exception(self, request, exception):
     #     if hasattr(request, 'request_id'):
     #         ...
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    响应压缩，按Accept-Encoding协商gzip或deflate
+
+    COMPRESSION_MIN_LENGTH：小于该长度的响应不压缩
+    COMPRESSION_LEVEL：压缩级别
+    COMPRESSION_CACHE_TIMEOUT：response.cache_compressed为真时（如data为缓存的RawJSON），
+        压缩结果按内容摘要缓存，相同内容不再重复压缩；为0时不缓存
+
+    流式响应逐块压缩并立即输出，不等待全部内容
+    """
+    encodings = {
+        # {encoding: wbits}
+        'gzip': 16 + zlib.MAX_WBITS,
+        'deflate': zlib.MAX_WBITS,
+    }
+    # 已压缩的格式，再压缩没有意义
+    skip_content_types = ('image/', 'video/', 'audio/', 'application/zip', 'application/gzip')
+    cache_key_prefix = 'compressed'
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.min_length = getattr(settings, 'COMPRESSION_MIN_LENGTH', 1024)
+        self.level = getattr(settings, 'COMPRESSION_LEVEL', 6)
+        self.cache_timeout = getattr(settings, 'COMPRESSION_CACHE_TIMEOUT', 300)
+        self.cache = instrument(tiered_cache)
+
+    def negotiate(self, accept_encoding: str):
+        """
+        按q值选择编码，q相同时优先gzip，不接受压缩时返回None
+        """
+        accepted = dict()
+        for item in accept_encoding.split(','):
+            coding, _, params = item.strip().partition(';')
+            q = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    q = float(params[2:])
+                except ValueError:
+                    q = 0
+            accepted[coding.strip().lower()] = q
+        wildcard = accepted.get('*', 0)
+        best, best_q = None, 0
+        for coding in self.encodings:
+            q = accepted.get(coding, wildcard)
+            if q > best_q:
+                best, best_q = coding, q
+        return best
+
+    def compress(self, content: bytes, encoding: str):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, self.encodings[encoding])
+        return compressor.compress(content) + compressor.flush()
+
+    def compress_cached(self, content: bytes, encoding: str):
+        digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+        key = '%s:%s:%s' % (self.cache_key_prefix, encoding, digest)
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = self.compress(content, encoding)
+            self.cache.set(key, compressed, self.cache_timeout)
+        return compressed
+
+    def compress_sequence(self, sequence, encoding: str):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, self.encodings[encoding])
+        for chunk in sequence:
+            data = compressor.compress(chunk)
+            if chunk:
+                # 每块都刷新，客户端可以立即得到已压缩的部分
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    async def compress_async_sequence(self, sequence, encoding: str):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, self.encodings[encoding])
+        async for chunk in sequence:
+            data = compressor.compress(chunk)
+            if chunk:
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < self.min_length:
+            return response
+        if response.get('Content-Type', '').startswith(self.skip_content_types):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self.compress_async_sequence(response.streaming_content, encoding)
+            else:
+                response.streaming_content = self.compress_sequence(response.streaming_content, encoding)
+            # 压缩后的长度未知
+            del response.headers['Content-Length']
+        else:
+            if self.cache_timeout and getattr(response, 'cache_compressed', False):
+                compressed = self.compress_cached(response.content, encoding)
+            else:
+                compressed = self.compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # 内容已改变，强ETag改为弱ETag
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
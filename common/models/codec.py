@@ -0,0 +1,129 @@
+"""
+缓存中模型实例的紧凑编码
+
+只保存各字段的值（按concrete_fields的顺序），不保存_state、字段缓存和类的引用；
+编码结果带有表结构的指纹，字段增删改后旧的缓存条目不再使用
+"""
+import hashlib
+
+from django.db.models import Model
+from django.db.models.base import ModelState
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.signals import post_init, pre_init
+
+__all__ = [
+    'ModelCodec',
+]
+
+
+class ModelCodec(object):
+    """
+    encode(instances) -> (fingerprint, rows)
+    decode(payload, using) -> 实例列表（Model.from_db或等价的快速构造），指纹不一致时返回None
+
+    select_related：同时编码的关联实例（外键、一对一的路径），关联实例为None时保存None
+    """
+
+    def __init__(self, model, select_related=()):
+        self.model = model
+        self.attnames = [field.attname for field in model._meta.concrete_fields]
+        self.plan = self._make_plan(select_related)
+        self.fingerprint = self._make_fingerprint()
+        self.build = self._builder(model, self.attnames)
+        self.related_builds = [self._builder(related_model, attnames) for _, _, related_model, attnames in self.plan]
+
+    def _make_plan(self, select_related):
+        """
+        [(上级实例的序号, 字段, 关联模型, 关联模型的attnames)]，序号0为本模型的实例
+        """
+        plan = list()
+        indexes = {(): 0}
+        for path in select_related:
+            model, names = self.model, tuple(path.split(LOOKUP_SEP))
+            for i in range(1, len(names) + 1):
+                field = model._meta.get_field(names[i - 1])
+                model = field.remote_field.model
+                if names[:i] not in indexes:
+                    indexes[names[:i]] = len(plan) + 1
+                    attnames = [f.attname for f in model._meta.concrete_fields]
+                    plan.append((indexes[names[:i - 1]], field, model, attnames))
+        return plan
+
+    def _make_fingerprint(self):
+        schema = [self._schema(self.model)]
+        schema += [(field.name, self._schema(model)) for _, field, model, _ in self.plan]
+        return hashlib.blake2b(repr(schema).encode(), digest_size=8).hexdigest()
+
+    @staticmethod
+    def _schema(model):
+        return model._meta.label, [(field.attname, field.get_internal_type()) for field in model._meta.concrete_fields]
+
+    @staticmethod
+    def _builder(model, attnames):
+        """
+        重建实例的函数(using, row) -> instance
+
+        模型未重写from_db、没有pre_init、post_init的接收者时，直接填充__dict__（与from_db的结果相同），
+        省去Model.__init__逐个字段setattr的开销；否则使用from_db
+        """
+        if model.from_db.__func__ is not Model.from_db.__func__ or \
+                pre_init.has_listeners(model) or post_init.has_listeners(model):
+            return lambda using, row: model.from_db(using, attnames, row)
+        new = Model.__new__
+
+        def build(using, row):
+            obj = new(model)
+            state = ModelState()
+            state.adding = False
+            state.db = using
+            obj._state = state
+            obj.__dict__.update(zip(attnames, row))
+            return obj
+
+        return build
+
+    @staticmethod
+    def _values(instance, attnames):
+        # 直接取实例__dict__中的值，延迟加载的字段才通过描述器获取
+        values = instance.__dict__
+        return tuple(values[attname] if attname in values else getattr(instance, attname) for attname in attnames)
+
+    def encode(self, instances):
+        attnames = self.attnames
+        plan = self.plan
+        rows = list()
+        for instance in instances:
+            row = self._values(instance, attnames)
+            if plan:
+                objs = [instance]
+                related_rows = list()
+                for parent, field, _, related_attnames in plan:
+                    obj = objs[parent] and field.get_cached_value(objs[parent], None)
+                    objs.append(obj)
+                    related_rows.append(obj and self._values(obj, related_attnames))
+                row = (row, tuple(related_rows))
+            rows.append(row)
+        return self.fingerprint, rows
+
+    def decode(self, payload, using):
+        try:
+            fingerprint, rows = payload
+        except (TypeError, ValueError):
+            return
+        if fingerprint != self.fingerprint:
+            return
+        build = self.build
+        if not self.plan:
+            return [build(using, row) for row in rows]
+        related = [(parent, field, related_build) for (parent, field, _, _), related_build in
+                   zip(self.plan, self.related_builds)]
+        instances = list()
+        for row, related_rows in rows:
+            objs = [build(using, row)]
+            for (parent, field, related_build), related_row in zip(related, related_rows):
+                obj = related_row and related_build(using, related_row)
+                if objs[parent] is not None:
+                    field.set_cached_value(objs[parent], obj)
+                objs.append(obj)
+            instances.append(objs[0])
+        return instances
@@ -3,17 +3,29 @@ import json
 from django.core.exceptions import ValidationError
 from django.db import models
 
-from common.utils.text import is_json_str, CJsonEncoder
+from common.utils.json import JsonEncoder
 from common.validators import ListFieldValidator, DictFieldValidator
 
 
 class JsonField(models.TextField):
+    """
+    JSON文本列，读取时即解码（不延迟解码：from_db_value无法区分模型实例和values()、values_list()，
+    两者得到的都是解码后的值）
+
+    列表查询不需要该列时用defer()/only()跳过，不读取也不解码
+    """
     max_length = 2048
+    blank_string = None  # 值无法编码时value_to_string返回的字符串，为None时抛出异常
 
     def __init__(self, *args, **kwargs):
         max_length = kwargs.pop('max_length') if 'max_length' in kwargs else self.max_length
         super().__init__(*args, max_length=max_length, **kwargs)
 
+    @staticmethod
+    def dumps(value):
+        # 保持原有的存储格式（默认分隔符、转义非ASCII字符），不改变已有数据的文本，响应中的紧凑格式不影响这里
+        return json.dumps(value, cls=JsonEncoder)
+
     def get_prep_value(self, value):
         # before saving to db, value could be a string or Promise
         if value is None:
@@ -23,7 +35,7 @@ class JsonField(models.TextField):
         # here, value could be a python object
         if isinstance(value, Exception):
             raise value
-        return json.dumps(value, cls=CJsonEncoder)
+        return self.dumps(value)
 
     def from_db_value(self, value, *_):
         return self.to_python(value)
@@ -44,12 +56,16 @@ class JsonField(models.TextField):
                 )
 
     def value_to_string(self, obj):
+        # 与保存时写入的文本相同（get_prep_value），只编码一次，不解析
         value = self.value_from_object(obj)
         if value is None:
             return
-        if is_json_str(value):
-            return value
-        return json.dumps(value, cls=CJsonEncoder)
+        try:
+            return self.dumps(value)
+        except TypeError:
+            if self.blank_string is None:
+                raise
+            return self.blank_string
 
 
 class ListField(JsonField):
@@ -59,17 +75,7 @@ class ListField(JsonField):
     }
     default_validators = [ListFieldValidator()]
     empty_values = [[], None, '[]']
-
-    def value_to_string(self, obj):
-        value = self.value_from_object(obj)
-        if value is None:
-            return
-        if is_json_str(value):
-            return value
-        try:
-            return json.dumps(value, cls=CJsonEncoder)
-        except TypeError:
-            return '[]'  # blank
+    blank_string = '[]'
 
     def to_python(self, value):
         if isinstance(value, str) and not value:
@@ -92,17 +98,7 @@ class DictField(JsonField):
     }
     default_validators = [DictFieldValidator()]
     empty_values = [{}, None, '{}']
-
-    def value_to_string(self, obj):
-        value = self.value_from_object(obj)
-        if value is None:
-            return
-        if is_json_str(value):
-            return value
-        try:
-            return json.dumps(value, cls=CJsonEncoder)
-        except TypeError:
-            return '{}'  # blank
+    blank_string = '{}'
 
     def to_python(self, value):
         if isinstance(value, str) and not value:
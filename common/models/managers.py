@@ -1,10 +1,27 @@
-from django.core.cache import cache
-from django.db import models
+import hashlib
+import math
+import random
+import time
+from collections import defaultdict
+from functools import partial
+from itertools import islice
+
+from django.db import connections, models, transaction
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.query import ModelIterable
+from django.db.models.fields.related import lazy_related_operation
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.utils.functional import cached_property
+
+from common.core.cache import tiered_cache
+from common.core.cache_metrics import instrument
+from common.models.codec import ModelCodec
 
 __all__ = [
     "CustomManager",
     'CacheManager',
-    'ResourceManager'
+    'ResourceManager',
+    'cache_version',
 ]
 
 
@@ -25,35 +42,247 @@ class CustomManager(models.Manager):
 INSTANCE = 'I'
 QUERYSET = 'Q'
 
+VERSION_KEY = 'cache:version:%s'
+LOCK_KEY = 'cache:lock:%s'
+NOT_FOUND = 'not-found'  # 不存在的记录缓存的值
+MAX_KEY_LENGTH = 200  # 超过该长度的key，查询条件部分使用hash
+
+cache = instrument(tiered_cache)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_version(model):
+    """
+    模型的缓存版本号，不存在时以当前时间（毫秒）初始化，不会与被淘汰前的版本号重复
+    """
+    key = VERSION_KEY % model._meta.concrete_model._meta.label
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(model):
+    """
+    版本号加1，该模型所有的缓存失效
+    """
+    key = VERSION_KEY % model._meta.concrete_model._meta.label
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), None)
+
+
+# {模型label: {依赖该模型的模型}}，模型写入时依赖它的模型的版本号也加1
+_dependents = defaultdict(set)
+
 
-class CacheManager(models.Manager):
+def _affected_models(model):
     """
-    暂不支持跨表缓存
+    模型本身，以及直接、间接依赖它的模型
+    """
+    affected = [model]
+    labels = {model._meta.concrete_model._meta.label}
+    for current in affected:
+        for dependent in _dependents[current._meta.concrete_model._meta.label]:
+            label = dependent._meta.concrete_model._meta.label
+            if label not in labels:
+                labels.add(label)
+                affected.append(dependent)
+    return affected
+
+
+def _model_changed(sender, **kwargs):
+    if kwargs.get('action', 'post').split('_')[0] != 'post':
+        # m2m_changed的pre_add等
+        return
+    # 立即失效，写入的请求不会读到旧数据；
+    # 提交后再次失效，防止提交前其他请求用旧数据重新写入缓存
+    for model in _affected_models(sender):
+        bump_version(model)
+        transaction.on_commit(partial(bump_version, model), using=kwargs.get('using'))
+
+
+_watched = set()
+
+
+def _watch(model):
+    """
+    模型写入（多对多的through模型为m2m_changed）时使缓存失效
+    """
+    label = model._meta.label
+    if label in _watched:
+        return
+    _watched.add(label)
+    for signal in (post_save, post_delete, m2m_changed):
+        signal.connect(
+            _model_changed, sender=model, weak=False,
+            dispatch_uid=f'cache_manager:{model._meta.label}'
+        )
+
+
+def cache_version(model):
+    """
+    模型的缓存版本号，用于CacheManager以外的缓存（如视图的响应缓存）；模型写入时版本号改变
+    """
+    _watch(model)
+    return get_version(model)
+
+
+def _add_dependency(dependent, dependency):
+    _dependents[dependency._meta.concrete_model._meta.label].add(dependent)
+    _watch(dependency)
+
+
+class CachedQuerySet(models.QuerySet):
+    """
+    CacheManager的filter、all返回的QuerySet，执行查询后将结果写入缓存
+
+    链式调用（filter、values、count等）返回的新QuerySet不再写入缓存
+    """
+    _cache_key = None  # 缓存的key，或返回key的函数（执行查询时才获取版本号）
+    _cache_manager = None
+
+    def _fetch_all(self):
+        if self._result_cache is not None or self._cache_key is None:
+            return super()._fetch_all()
+        if self._iterable_class is not ModelIterable or self._prefetch_related_lookups:
+            return super()._fetch_all()
+        # 查询前取得版本号：查询期间有写入时，结果写入旧版本的key，不会被当作新数据读取
+        key = self._cache_key() if callable(self._cache_key) else self._cache_key
+        start = time.perf_counter()
+        super()._fetch_all()
+        self._cache_manager._update_cache(key, self._result_cache, time.perf_counter() - start)
+
+
+class CacheManager(models.Manager.from_queryset(CachedQuerySet)):
+    """
+    缓存查询结果（已执行的行数据），按模型的版本号失效
+
+    缓存的是各字段的值（ModelCodec编码，带表结构指纹），读取时用Model.from_db重建实例，命中时不执行SQL；
+    模型的post_save、post_delete使版本号加1，该模型的所有缓存随之失效，
+    queryset.update()、bulk_create()等不发送信号，需调用invalidate()
+
+    缓存条目为(rows, expires_at, delta)，delta为查询耗时；get在过期前按概率提前刷新（XFetch），
+    过期后stale_seconds内只有取得锁的进程查询数据库，其他进程返回旧值；过期时间带随机抖动，
+    同时写入的key不会同时过期
+
+    get、get_many查询不存在的记录时缓存NOT_FOUND（negative_seconds），直接抛出DoesNotExist；
+    创建记录时版本号改变，这些缓存随之失效
+
+    跨表缓存：select_related（外键、一对一的路径）的关联实例与行数据一起缓存，路径上的模型自动作为依赖；
+    depends_on声明其他依赖的模型（如多对多的through模型），依赖的模型写入时本模型的版本号也加1
     """
 
     cache_seconds = 5 * 60  # 默认缓存过期时间
+    stale_seconds = 60  # 过期后旧值保留的时间
+    lock_seconds = 10  # 刷新锁的超时时间
+    jitter = 0.1  # 过期时间随机缩短的最大比例
+    early_refresh_beta = 1.0  # 越大越早刷新，为0时不提前刷新
+    negative_seconds = 30  # 不存在的记录的缓存时间，为0时不缓存
 
-    def __init__(self, cache_seconds=None, **kwargs):
+    def __init__(self, cache_seconds=None, select_related=(), depends_on=(), **kwargs):
         super().__init__(**kwargs)
         self.cache_seconds = cache_seconds or self.cache_seconds
+        self.select_related_fields = tuple(select_related)
+        self.depends_on = tuple(depends_on)
+
+    def contribute_to_class(self, cls, name):
+        super().contribute_to_class(cls, name)
+        if cls._meta.abstract:
+            return
+        _watch(cls)
+        # 模型注册后才能解析字段和关联的模型
+        lazy_related_operation(self._register_dependencies, cls, *self.depends_on)
+
+    def _register_dependencies(self, model, *depends_on):
+        for dependency in depends_on:
+            _add_dependency(model, dependency)
+        for path in self.select_related_fields:
+            self._register_path(model, model, path.split(LOOKUP_SEP))
+
+    def _register_path(self, dependent, model, names):
+        field = model._meta.get_field(names[0])
+
+        def register(_, related_model):
+            _add_dependency(dependent, related_model)
+            if len(names) > 1:
+                self._register_path(dependent, related_model, names[1:])
+
+        lazy_related_operation(register, model, field.remote_field.model)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.select_related_fields:
+            queryset = queryset.select_related(*self.select_related_fields)
+        return queryset
+
+    def invalidate(self):
+        bump_version(self.model)
 
     def _makeup_key(self, data_type, *args, **kwargs):
-        """
-        args 暂时不用
-        """
         assert data_type in (INSTANCE, QUERYSET)
         sorted_kwargs = sorted(kwargs.items(), key=lambda i: i[0])
-        post = ':'.join(map(lambda x: x[0] + '.' + str(x[1]), sorted_kwargs))
-        model_label = self.model._meta.label
-        key = '%s:%s:%s' % (data_type, model_label, post)
-        # print('key: %s' % key)
-        return key
+        post = ':'.join(
+            x[0] + '.' + str(x[1].pk if isinstance(x[1], models.Model) else x[1]) for x in sorted_kwargs
+        )
+        if args:
+            # Q对象等
+            post += ':' + ':'.join(map(str, args))
+        if len(post) > MAX_KEY_LENGTH:
+            post = hashlib.blake2b(post.encode(), digest_size=16).hexdigest()
+        model_label = self.model._meta.concrete_model._meta.label
+        return '%s:%s:%s:%s' % (data_type, model_label, get_version(self.model), post)
 
     def set_expire(self, seconds):
         self.cache_seconds = seconds
 
-    def _update_cache(self, key, obj):
-        cache.set(key, obj, self.cache_seconds)
+    @cached_property
+    def _cache(self):
+        return instrument(tiered_cache, self.model._meta.concrete_model._meta.label)
+
+    @cached_property
+    def _codec(self):
+        return ModelCodec(self.model, self.select_related_fields)
+
+    def _encode(self, instances):
+        return self._codec.encode(instances)
+
+    def _decode(self, payload):
+        """
+        表结构改变前写入的缓存返回None
+        """
+        return self._codec.decode(payload, self.db)
+
+    def _expires_at(self):
+        return time.time() + self.cache_seconds * (1 - random.random() * self.jitter)
+
+    def _update_cache(self, key, instances, delta=0):
+        entry = (self._encode(instances), self._expires_at(), delta)
+        self._cache.set(key, entry, self.cache_seconds + self.stale_seconds)
+
+    def _from_cache(self, key):
+        """
+        缓存的实例列表，未命中或已过期时返回None
+        """
+        entry = self._cache.get(key)
+        if entry is None or entry[1] < time.time():
+            return
+        return self._decode(entry[0])
+
+    def _should_refresh(self, expires_at, delta):
+        # XFetch：查询越慢、越接近过期，提前刷新的概率越大
+        return time.time() - delta * self.early_refresh_beta * math.log(1 - random.random()) >= expires_at
 
     def get(self, *args, use_cache=True, update_cache=True, **kwargs):
         """
@@ -61,55 +290,104 @@ class CacheManager(models.Manager):
         use_cache：使用缓存，优先从缓存中读取
         update_cache：任何情况下都更新缓存
         """
+        if not use_cache and not update_cache:
+            return super().get(*args, **kwargs)
         key = self._makeup_key(INSTANCE, *args, **kwargs)
+        lock_key = None
         if use_cache:
-            _cache = cache.get(key)
-            if _cache:
-                return _cache
-            try:
-                instance = super().get(*args, **kwargs)
-            except self.model.DoesNotExist:
-                cache.delete(key)
-                raise
-            if use_cache:
-                self._update_cache(key, instance)
-            return instance
-
-        instance = super().get(*args, **kwargs)
-        if update_cache:
-            self._update_cache(key, instance)
+            entry = self._cache.get(key)
+            if entry == NOT_FOUND:
+                raise self.model.DoesNotExist(
+                    '%s matching query does not exist.' % self.model._meta.object_name
+                )
+            instances = entry and self._decode(entry[0])
+            if instances:
+                _, expires_at, delta = entry
+                if not self._should_refresh(expires_at, delta):
+                    return instances[0]
+                # 已被其他进程锁定刷新，返回旧值
+                if not self._cache.add(LOCK_KEY % key, 1, self.lock_seconds):
+                    return instances[0]
+                lock_key = LOCK_KEY % key
+        try:
+            start = time.perf_counter()
+            instance = super().get(*args, **kwargs)
+            self._update_cache(key, [instance], time.perf_counter() - start)
+        except self.model.DoesNotExist:
+            if self.negative_seconds:
+                self._cache.set(key, NOT_FOUND, self.negative_seconds)
+            raise
+        finally:
+            if lock_key:
+                self._cache.delete(lock_key)
         return instance
 
-    def filter(self, *args, use_cache=False, update_cache=True, **kwargs):
-        key = self._makeup_key(QUERYSET, *args, **kwargs)
-        if use_cache:
-            _cache = cache.get(key)
-            if _cache:
-                return _cache
-            queryset = super().filter(*args, **kwargs)
-            if update_cache:
-                self._update_cache(key, queryset)
-            return queryset
-        queryset = super().filter(*args, **kwargs)
+    def get_many(self, pks, use_cache=True, update_cache=True):
+        """
+        按主键批量获取，返回{pk: instance}，不存在的pk不在结果中
+
+        与get(pk=...)共用缓存，一次cache.get_many取命中的，未命中的一次in_bulk查询后set_many回填
+        """
+        to_python = self.model._meta.pk.to_python
+        keys = {self._makeup_key(INSTANCE, pk=pk): pk for pk in map(to_python, pks)}
+        result = dict()
+        not_found = set()
+        if use_cache and keys:
+            now = time.time()
+            for key, entry in self._cache.get_many(keys).items():
+                if entry == NOT_FOUND:
+                    not_found.add(keys[key])
+                elif entry[1] >= now:
+                    instances = self._decode(entry[0])
+                    if instances:
+                        result[instances[0].pk] = instances[0]
+        missing = {key: pk for key, pk in keys.items() if pk not in result and pk not in not_found}
+        if not missing:
+            return result
+        # 带select_related，与get写入的缓存条目相同（包含关联实例）
+        fetched = self.get_queryset().in_bulk(missing.values())
+        result.update(fetched)
         if update_cache:
-            self._update_cache(key, queryset)
-        return queryset
+            if fetched:
+                # 使用查询前生成的key，查询期间版本号改变时不会写入新版本的key
+                self._cache.set_many(
+                    {
+                        key: (self._encode([fetched[pk]]), self._expires_at(), 0)
+                        for key, pk in missing.items() if pk in fetched
+                    },
+                    self.cache_seconds + self.stale_seconds
+                )
+            if self.negative_seconds and len(fetched) < len(missing):
+                self._cache.set_many(
+                    {key: NOT_FOUND for key, pk in missing.items() if pk not in fetched},
+                    self.negative_seconds
+                )
+        return result
 
-    def all(self, use_cache=False, update_cache=True):
-        key = self._makeup_key(QUERYSET)
+    def _cached_queryset(self, queryset, use_cache, update_cache, *args, **kwargs):
         if use_cache:
-            _cache = cache.get(key)
-            if _cache:
-                return _cache
-            queryset = super().all()
-            if update_cache:
-                self._update_cache(key, queryset)
+            key = self._makeup_key(QUERYSET, *args, **kwargs)
+            instances = self._from_cache(key)
+            if instances is not None:
+                queryset._result_cache = instances
+                queryset._prefetch_done = True
+                return queryset
+        elif update_cache:
+            # 执行查询时才生成key
+            key = partial(self._makeup_key, QUERYSET, *args, **kwargs)
+        else:
             return queryset
-        queryset = super().all()
-        if update_cache:
-            self._update_cache(key, queryset)
+        queryset._cache_key = key
+        queryset._cache_manager = self
         return queryset
 
+    def filter(self, *args, use_cache=False, update_cache=True, **kwargs):
+        queryset = super().filter(*args, **kwargs)
+        return self._cached_queryset(queryset, use_cache, update_cache, *args, **kwargs)
+
+    def all(self, use_cache=False, update_cache=True):
+        return self._cached_queryset(super().all(), use_cache, update_cache)
+
     def delete(self):
         return super().delete()
 
@@ -117,17 +395,60 @@ class CacheManager(models.Manager):
 class ResourceManager(models.Manager):
     """
     Supported method:
-    create, update, get_or_create, update_or_create
+    create, update, get_or_create, update_or_create, bulk_upsert
     """
 
-    def _extract_model_params(self, **kwargs):
+    @cached_property
+    def _field_names(self):
+        """
+        可接受的参数名：字段名，以及外键的attname（xxx_id）
+        """
         fields = self.model._meta.concrete_fields
-        field_attnames = [field.attname for field in fields if field.many_to_one or field.one_to_one]
-        field_names = [field.name for field in fields]
-        field_names += field_attnames
-        [kwargs.pop(arg) for arg in list(kwargs.keys()) if
-         arg not in field_names]
-        return kwargs
+        field_names = {field.name for field in fields}
+        field_names.update(field.attname for field in fields if field.many_to_one or field.one_to_one)
+        return frozenset(field_names)
+
+    @cached_property
+    def _upsert_update_fields(self):
+        """
+        bulk_upsert默认更新的字段：除主键和auto_now_add字段外的所有字段
+        """
+        return [
+            field.name for field in self.model._meta.concrete_fields
+            if not field.primary_key and not getattr(field, 'auto_now_add', False)
+        ]
+
+    def _extract_model_params(self, **kwargs):
+        field_names = self._field_names
+        return {key: value for key, value in kwargs.items() if key in field_names}
+
+    def bulk_upsert(self, rows, unique_fields, update_fields=None, batch_size=1000):
+        """
+        批量插入，unique_fields冲突时更新update_fields（MySQL为INSERT ... ON DUPLICATE KEY UPDATE）
+
+        rows：dict或模型实例，dict中不是字段的key被忽略；按batch_size分批构造实例并写入，在一个事务中执行
+        MySQL按表上任意唯一索引判断冲突，不使用unique_fields（需有对应的唯一索引）
+        返回写入的行数；不发送post_save信号
+        """
+        unique_fields = list(unique_fields)
+        if update_fields is None:
+            update_fields = [name for name in self._upsert_update_fields if name not in unique_fields]
+        connection = connections[self.db]
+        conflict_fields = unique_fields if connection.features.supports_update_conflicts_with_target else None
+        queryset = self.get_queryset()
+        count = 0
+        with transaction.atomic(using=self.db, savepoint=False):
+            for batch in chunked(rows, batch_size):
+                objs = [
+                    row if isinstance(row, self.model) else self.model(**self._extract_model_params(**row))
+                    for row in batch
+                ]
+                queryset.bulk_create(
+                    objs, batch_size=batch_size, update_conflicts=True,
+                    unique_fields=conflict_fields, update_fields=update_fields,
+                )
+                count += len(objs)
+        return count
 
     def get_or_none(self, *args, **kwargs):
         try:
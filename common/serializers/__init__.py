@@ -1,6 +1,14 @@
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied
 
+from common.serializers.compiled import CompiledValidationMixin
+
+
+class ModelSerializer(CompiledValidationMixin, serializers.ModelSerializer):
+    """
+    输入校验使用编译的校验函数（common.serializers.compiled.compile_validator）
+    """
+
 
 class DynamicFieldsModelSerializer(serializers.ModelSerializer):
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,497 @@
+"""
+ModelSerializer的编译模式
+
+读取：只包含简单字段的ModelSerializer，编译为values_list的投影，
+不实例化模型，也不逐行调用字段的get_attribute/to_representation
+
+写入：输入校验编译为每个类一个的校验函数，常见字段的合法输入直接检查，
+不合法的输入交给字段的run_validation，错误信息与DRF完全一致
+"""
+from collections.abc import Mapping
+from copy import deepcopy
+from functools import partial
+
+from django.core import validators as django_validators
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.core.signals import setting_changed
+from django.db.models import QuerySet
+from django.db.models.query_utils import DeferredAttribute
+from rest_framework import ISO_8601, serializers, relations
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import SkipField, empty, get_error_detail
+from rest_framework.settings import api_settings
+from rest_framework.validators import ProhibitSurrogateCharactersValidator
+
+__all__ = [
+    'ValuesProjection',
+    'compile_values_serializer',
+    'CompiledValidator',
+    'compile_validator',
+    'CompiledValidationMixin',
+]
+
+# 支持的序列化字段（精确类型，子类可能重写了to_representation）
+VALUES_FIELDS = {
+    serializers.CharField,
+    serializers.EmailField,
+    serializers.SlugField,
+    serializers.URLField,
+    serializers.IPAddressField,
+    serializers.IntegerField,
+    serializers.FloatField,
+    serializers.DecimalField,
+    serializers.BooleanField,
+    serializers.DateTimeField,
+    serializers.DateField,
+    serializers.TimeField,
+    serializers.DurationField,
+    serializers.UUIDField,
+    serializers.ChoiceField,
+    serializers.ReadOnlyField,
+    relations.PrimaryKeyRelatedField,
+}
+
+# 数据库中的值与to_representation的结果相同，不需要转换
+IDENTITY_FIELDS = {
+    serializers.CharField: {
+        'CharField', 'TextField', 'SlugField', 'EmailField', 'URLField',
+    },
+    serializers.IntegerField: {
+        'AutoField', 'BigAutoField', 'SmallAutoField',
+        'IntegerField', 'BigIntegerField', 'SmallIntegerField',
+        'PositiveIntegerField', 'PositiveBigIntegerField', 'PositiveSmallIntegerField',
+    },
+}
+
+if hasattr(serializers, 'BigIntegerField'):
+    # DRF 3.15+，BigAutoField等映射为BigIntegerField
+    VALUES_FIELDS.add(serializers.BigIntegerField)
+    IDENTITY_FIELDS[serializers.BigIntegerField] = IDENTITY_FIELDS[serializers.IntegerField]
+
+
+class ValuesProjection:
+    """
+    names：输出的字段名
+    sources：values_list的字段
+    conversions：需要转换的字段，[(name, converter factory)]，
+        每次to_representation调用一次factory得到转换函数（如只获取一次当前时区），值为None时不转换
+    """
+
+    def __init__(self, names, sources, conversions):
+        self.names = tuple(names)
+        self.sources = tuple(sources)
+        self.conversions = tuple(conversions)
+
+    def values_list(self, queryset: QuerySet):
+        return queryset.values_list(*self.sources)
+
+    def to_representation(self, rows):
+        names = self.names
+        data = [dict(zip(names, row)) for row in rows]
+        for name, factory in self.conversions:
+            convert = factory()
+            for item in data:
+                value = item[name]
+                if value is not None:
+                    item[name] = convert(value)
+        return data
+
+
+def _representation_factory(field):
+    return lambda: field.to_representation
+
+
+def _datetime_factory(field):
+    """
+    ISO 8601格式时，时区只获取一次；其他情况仍使用字段的to_representation
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+
+    def factory():
+        tz = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if output_format is None or tz is None or output_format.lower() != ISO_8601:
+            return field.to_representation
+
+        def convert(value):
+            if isinstance(value, str) or value.tzinfo is None:
+                return field.to_representation(value)
+            value = value.astimezone(tz).isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return convert
+    return factory
+
+
+MAX_SIGNATURES = 32  # 每个serializer类缓存的编译结果数，超过时清空
+
+_settings_generation = 0  # REST_FRAMEWORK改变时加1，之前的编译结果不再使用
+
+
+def _settings_changed(setting, **kwargs):
+    global _settings_generation
+    if setting == 'REST_FRAMEWORK':
+        _settings_generation += 1
+
+
+setting_changed.connect(_settings_changed)
+
+
+def _freeze(value):
+    """
+    构造参数转为可哈希的值：Django校验器用deconstruct，QuerySet只取模型（编译结果与查询条件无关），
+    定义了__eq__而不可哈希的对象（如DRF的校验器）取其属性；其余对象按自身哈希，key引用对象，id不会被复用
+    """
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return type(value).__name__, tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return 'dict', tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, QuerySet):
+        return 'queryset', value.model
+    if getattr(value, '__hash__', None) is not None:
+        return value
+    if hasattr(value, 'deconstruct'):
+        return _freeze(value.deconstruct())
+    return type(value), _freeze(vars(value))
+
+
+def _signature(fields):
+    """
+    影响编译结果的所有内容：各字段的名称、类型、source和构造参数，以及DRF的配置
+
+    字段与context有关（如get_fields中按用户生成）时签名不同，分别编译
+    """
+    return _settings_generation, tuple(
+        (field.field_name, type(field), field.source, _freeze(field._kwargs)) for field in fields
+    )
+
+
+def _cached(serializer_class, attr, key, build):
+    """
+    编译结果保存在serializer类上（不被子类继承），每个类最多MAX_SIGNATURES个
+    """
+    cache = serializer_class.__dict__.get(attr)
+    if cache is None:
+        cache = dict()
+        setattr(serializer_class, attr, cache)
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+    if len(cache) >= MAX_SIGNATURES:
+        cache.clear()
+    result = cache[key] = build()
+    return result
+
+
+def _compile_field(model, field):
+    """
+    返回(source, converter factory)，不支持时返回None
+
+    converter使用字段的副本，编译结果不引用serializer及其context
+    """
+    field_class = type(field)
+    if field_class not in VALUES_FIELDS:
+        return
+    source = field.source
+    if source == '*' or '.' in source:
+        return
+    try:
+        model_field = model._meta.pk if source == 'pk' else model._meta.get_field(source)
+    except FieldDoesNotExist:
+        # 如annotate的字段、property
+        return
+    if not model_field.concrete or model_field.many_to_many:
+        return
+
+    if model_field.is_relation:
+        if field_class is not relations.PrimaryKeyRelatedField:
+            return
+        if field.pk_field is not None:
+            return model_field.attname, _representation_factory(deepcopy(field.pk_field))
+        return model_field.attname, None
+    if field_class is relations.PrimaryKeyRelatedField:
+        return
+    if model_field.descriptor_class is not DeferredAttribute:
+        # 自定义描述器：实例上的值与数据库中的值不一定相同
+        return
+
+    if field_class is serializers.ReadOnlyField:
+        return model_field.attname, None
+    if model_field.get_internal_type() in IDENTITY_FIELDS.get(field_class, ()) and \
+            not getattr(field, 'coerce_to_string', api_settings.user_settings.get('COERCE_BIGINT_TO_STRING')):
+        return model_field.attname, None
+    if field_class is serializers.DateTimeField:
+        return model_field.attname, _datetime_factory(deepcopy(field))
+    return model_field.attname, _representation_factory(deepcopy(field))
+
+
+def compile_values_serializer(serializer):
+    """
+    编译ModelSerializer（或many=True的ListSerializer）为ValuesProjection，
+    有不支持的字段，或重写了to_representation时返回None
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    if not isinstance(serializer, serializers.ModelSerializer):
+        return
+    serializer_class = type(serializer)
+    if serializer_class.to_representation is not serializers.ModelSerializer.to_representation:
+        return
+
+    readable_fields = list(serializer._readable_fields)
+    return _cached(
+        serializer_class, '_values_projections', _signature(readable_fields),
+        partial(_compile_projection, serializer.Meta.model, readable_fields)
+    )
+
+
+def _compile_projection(model, readable_fields):
+    names, sources, conversions = list(), list(), list()
+    for field in readable_fields:
+        compiled = _compile_field(model, field)
+        if compiled is None:
+            return
+        source, factory = compiled
+        names.append(field.field_name)
+        sources.append(source)
+        if factory is not None:
+            conversions.append((field.field_name, factory))
+    return ValuesProjection(names, sources, conversions)
+
+
+MISSING = object()  # 快速检查未通过，交给字段的run_validation
+
+# 快速检查中已包含的校验器
+KNOWN_VALIDATORS = (
+    django_validators.MaxLengthValidator,
+    django_validators.MinLengthValidator,
+    django_validators.MaxValueValidator,
+    django_validators.MinValueValidator,
+    django_validators.ProhibitNullCharactersValidator,
+    ProhibitSurrogateCharactersValidator,
+)
+
+
+def _limits(field):
+    """
+    返回({校验器类型: 限制值}, 是否有其他校验器)
+    """
+    limits = dict()
+    extra = False
+    for validator in field.validators:
+        validator_class = type(validator)
+        if validator_class not in KNOWN_VALIDATORS or callable(getattr(validator, 'limit_value', None)):
+            extra = True
+        elif validator_class in limits:
+            # 同类校验器有多个时取最严格的
+            if validator_class in (django_validators.MaxLengthValidator, django_validators.MaxValueValidator):
+                limits[validator_class] = min(limits[validator_class], validator.limit_value)
+            else:
+                limits[validator_class] = max(limits[validator_class], validator.limit_value)
+        else:
+            limits[validator_class] = getattr(validator, 'limit_value', None)
+    return limits, extra
+
+
+def _run_extra_validators(field, value):
+    return _run_validators(field, value, skip_known=True)
+
+
+def _run_validators(field, value, skip_known=False):
+    """
+    skip_known：跳过快速检查中已包含的校验器
+    """
+    for validator in field.validators:
+        if skip_known and type(validator) in KNOWN_VALIDATORS and not callable(getattr(validator, 'limit_value', None)):
+            continue
+        try:
+            if getattr(validator, 'requires_context', False):
+                validator(value, field)
+            else:
+                validator(value)
+        except (ValidationError, DjangoValidationError):
+            return False
+    return True
+
+
+def _char_check(field):
+    limits, extra = _limits(field)
+    max_length = limits.get(django_validators.MaxLengthValidator)
+    min_length = limits.get(django_validators.MinLengthValidator)
+    trim_whitespace = field.trim_whitespace
+
+    def check(field, data):
+        if type(data) is not str:
+            return MISSING
+        value = data.strip() if trim_whitespace else data
+        if not value:
+            return MISSING
+        if max_length is not None and len(value) > max_length:
+            return MISSING
+        if min_length is not None and len(value) < min_length:
+            return MISSING
+        if '\x00' in value:
+            return MISSING
+        try:
+            value.encode()
+        except UnicodeEncodeError:
+            # surrogate
+            return MISSING
+        if extra and not _run_extra_validators(field, value):
+            return MISSING
+        return value
+    return check
+
+
+def _integer_check(field):
+    limits, extra = _limits(field)
+    max_value = limits.get(django_validators.MaxValueValidator)
+    min_value = limits.get(django_validators.MinValueValidator)
+
+    def check(field, data):
+        if type(data) is not int:
+            return MISSING
+        if max_value is not None and data > max_value:
+            return MISSING
+        if min_value is not None and data < min_value:
+            return MISSING
+        if extra and not _run_extra_validators(field, data):
+            return MISSING
+        return data
+    return check
+
+
+# 布尔、选项字段的值不检查长度、大小，有校验器（包括模型字段带来的Max/MinValueValidator等）时全部执行
+
+def _boolean_check(field):
+    has_validators = bool(field.validators)
+
+    def check(field, data):
+        if type(data) is not bool:
+            return MISSING
+        if has_validators and not _run_validators(field, data):
+            return MISSING
+        return data
+    return check
+
+
+def _choice_check(field):
+    has_validators = bool(field.validators)
+
+    def check(field, data):
+        if type(data) not in (str, int) or data == '':
+            return MISSING
+        value = field.choice_strings_to_values.get(str(data), MISSING)
+        if value is not MISSING and has_validators and not _run_validators(field, value):
+            return MISSING
+        return value
+    return check
+
+
+# 按精确类型编译（子类可能重写了to_internal_value或get_value）
+VALIDATION_CHECKS = {
+    serializers.CharField: _char_check,
+    serializers.EmailField: _char_check,
+    serializers.SlugField: _char_check,
+    serializers.URLField: _char_check,
+    serializers.RegexField: _char_check,
+    serializers.IntegerField: _integer_check,
+    serializers.BooleanField: _boolean_check,
+    serializers.ChoiceField: _choice_check,
+}
+
+if hasattr(serializers, 'BigIntegerField'):
+    VALIDATION_CHECKS[serializers.BigIntegerField] = _integer_check
+
+
+class CompiledValidator:
+    """
+    steps：[(field name, check)]，check为None的字段直接使用字段的run_validation
+
+    与Serializer.to_internal_value的流程一致（validate_<field>方法、SkipField、source_attrs）
+    """
+
+    def __init__(self, steps):
+        self.steps = tuple(steps)
+
+    def bind(self, serializer):
+        """
+        绑定到serializer实例的字段，many=True时child只绑定一次
+        """
+        fields = serializer.fields
+        return [
+            (name, fields[name], check, getattr(serializer, 'validate_' + name, None))
+            for name, check in self.steps
+        ]
+
+    @staticmethod
+    def validate(serializer, bound_steps, data):
+        ret = dict()
+        errors = dict()
+        for name, field, check, validate_method in bound_steps:
+            if check is None:
+                primitive_value = field.get_value(data)
+            else:
+                primitive_value = data.get(name, empty)
+            try:
+                value = MISSING
+                if check is not None and primitive_value is not empty and primitive_value is not None:
+                    value = check(field, primitive_value)
+                if value is MISSING:
+                    # 缺失、null、不合法的值等，交给DRF处理，错误信息保持一致
+                    value = field.run_validation(primitive_value)
+                if validate_method is not None:
+                    value = validate_method(value)
+            except ValidationError as exc:
+                errors[name] = exc.detail
+            except DjangoValidationError as exc:
+                errors[name] = get_error_detail(exc)
+            except SkipField:
+                pass
+            else:
+                source_attrs = field.source_attrs
+                if len(source_attrs) == 1:
+                    ret[source_attrs[0]] = value
+                else:
+                    serializer.set_value(ret, source_attrs, value)
+
+        if errors:
+            raise ValidationError(errors)
+        return ret
+
+
+def compile_validator(serializer):
+    """
+    编译serializer的输入校验，每个类按可写字段的签名缓存（见_signature）
+    """
+    writable_fields = list(serializer._writable_fields)
+    return _cached(
+        type(serializer), '_compiled_validators', _signature(writable_fields),
+        partial(_compile_validator, writable_fields)
+    )
+
+
+def _compile_validator(writable_fields):
+    steps = list()
+    for field in writable_fields:
+        factory = VALIDATION_CHECKS.get(type(field))
+        steps.append((field.field_name, factory(field) if factory is not None else None))
+    return CompiledValidator(steps)
+
+
+class CompiledValidationMixin:
+    """
+    Serializer的输入校验使用compile_validator编译的校验函数
+
+    表单数据（QueryDict）仍使用DRF的to_internal_value
+    """
+    compiled_validation = True
+    _bound_validation_steps = None
+
+    def to_internal_value(self, data):
+        if not self.compiled_validation or not isinstance(data, Mapping) or hasattr(data, 'getlist'):
+            return super().to_internal_value(data)
+        if self._bound_validation_steps is None:
+            self._bound_validation_steps = compile_validator(self).bind(self)
+        return CompiledValidator.validate(self, self._bound_validation_steps, data)
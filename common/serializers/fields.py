@@ -1,15 +1,42 @@
 import base64
 import binascii
-import imghdr
 import io
+import time
 import uuid
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
 from django.core.validators import EMPTY_VALUES
 from django.utils.translation import gettext_lazy as _
 from rest_framework.fields import ImageField
 
+from common.utils.cache import LRUCache
+
+WHITESPACE = str.maketrans('', '', ' \t\r\n')
+
+# 文件头
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+)
+
+
+def detect_image_type(header: bytes):
+    """
+    根据文件头判断图片类型，无法判断时返回None
+    """
+    for signature, image_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+
 
 class Base64ImageField(ImageField):
     """
@@ -25,9 +52,25 @@ class Base64ImageField(ImageField):
     invalid_file_message = _("Please upload a valid image.")
     invalid_type_message = _("The type of the image couldn't be determined.")
 
-    def __init__(self, trust_provided_content_type=False, represent_in_base64=False, **kwargs):
+    invalid_size_message = _("The image is too large, the maximum size is {max_size} bytes.")
+    chunk_size = 64 * 1024  # 每次解码的base64字符数
+    encode_chunk_size = 48 * 1024  # 每次编码的字节数，3的倍数
+    # 编码结果缓存，按存储（类和位置）、文件名、版本、缩略图尺寸
+    base64_cache = LRUCache(max_bytes=getattr(settings, 'BASE64_IMAGE_CACHE_SIZE', 32 * 1024 * 1024))
+    # S3存储的文件版本（ETag）缓存，{(存储, 文件名): (ETag, 过期时间)}，每个文件在该时间内最多一次HEAD请求
+    version_cache = LRUCache(max_entries=10000)
+    version_timeout = getattr(settings, 'BASE64_IMAGE_VERSION_TIMEOUT', 60)
+
+    def __init__(self, trust_provided_content_type=False, represent_in_base64=False, max_size=None,
+                 thumbnail_size=None, **kwargs):
+        """
+        max_size：解码后的最大字节数，默认为settings.BASE64_IMAGE_MAX_SIZE，为None时不限制
+        thumbnail_size：(width, height)，represent_in_base64时输出不超过该尺寸的缩略图
+        """
         self.trust_provided_content_type = trust_provided_content_type
         self.represent_in_base64 = represent_in_base64
+        self.thumbnail_size = tuple(thumbnail_size) if thumbnail_size else None
+        self.max_size = max_size if max_size is not None else getattr(settings, 'BASE64_IMAGE_MAX_SIZE', None)
         super().__init__(**kwargs)
 
     def to_internal_value(self, base64_data):
@@ -35,60 +78,93 @@ class Base64ImageField(ImageField):
         if base64_data in EMPTY_VALUES:
             return None
 
-        if isinstance(base64_data, str):
-            file_mime_type = None
+        if not isinstance(base64_data, str):
+            raise ValidationError(_(f"Invalid type. This is not an base64 string"))
 
-            # Strip base64 header, get mime_type from base64 header.
-            if ";base64," in base64_data:
-                header, base64_data = base64_data.split(";base64,")
-                if self.trust_provided_content_type:
-                    file_mime_type = header.replace("data:", "")
-
-            # Try to decode the file. Return validation error if it fails.
-            try:
-                decoded_file = base64.b64decode(base64_data)
-            except (TypeError, binascii.Error, ValueError):
-                raise ValidationError(self.invalid_file_message)
-
-            # Generate file name:
-            file_name = self.get_file_name()
-
-            # Get the file name extension:
-            file_extension = self.get_file_extension(file_name, decoded_file)
+        # Strip base64 header, get mime_type from base64 header.
+        file_mime_type = None
+        start = base64_data.find(";base64,")
+        if start == -1:
+            start = 0
+        else:
+            if self.trust_provided_content_type:
+                file_mime_type = base64_data[:start].replace("data:", "")
+            start += len(";base64,")
 
+        file = self.get_upload_file(file_mime_type, (len(base64_data) - start) // 4 * 3)
+        try:
+            size = self.decode_into(base64_data, start, file)
+            file.seek(0)
+            file_extension = self.get_file_extension(file.read(32), file)
             if file_extension not in self.allowed_types:
                 raise ValidationError(self.invalid_type_message)
+        except Exception:
+            file.close()
+            raise
 
-            complete_file_name = file_name + "." + file_extension
-            data = SimpleUploadedFile(
-                name=complete_file_name,
-                content=decoded_file,
-                content_type=file_mime_type
-            )
+        file.seek(0)
+        file.size = size
+        file.name = self.get_file_name() + "." + file_extension
+        return super().to_internal_value(file)
 
-            return super().to_internal_value(data)
+    @staticmethod
+    def get_upload_file(content_type, estimated_size):
+        """
+        与django处理上传文件一致，较小的文件在内存中，较大的文件写入临时文件
+        """
+        if estimated_size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            return TemporaryUploadedFile('base64', content_type, 0, None)
+        return InMemoryUploadedFile(io.BytesIO(), None, 'base64', content_type, 0, None)
 
-        raise ValidationError(_(f"Invalid type. This is not an base64 string"))
+    def decode_into(self, base64_data, start, file):
+        """
+        分块解码写入file，不复制整个字符串；超过max_size或文件头不是允许的类型时立即停止
+        """
+        size = 0
+        leftover = ""
+        for offset in range(start, len(base64_data), self.chunk_size):
+            chunk = leftover + base64_data[offset:offset + self.chunk_size].translate(WHITESPACE)
+            usable = len(chunk) - len(chunk) % 4
+            chunk, leftover = chunk[:usable], chunk[usable:]
+            try:
+                decoded = base64.b64decode(chunk, validate=True)
+            except (TypeError, binascii.Error, ValueError):
+                raise ValidationError(self.invalid_file_message)
+            if size == 0:
+                image_type = detect_image_type(decoded[:32])
+                if image_type is not None and self._normalize_type(image_type) not in self.allowed_types:
+                    raise ValidationError(self.invalid_type_message)
+            size += len(decoded)
+            if self.max_size is not None and size > self.max_size:
+                raise ValidationError(self.invalid_size_message.format(max_size=self.max_size))
+            file.write(decoded)
+        if leftover or size == 0:
+            # 长度不是4的倍数（缺少padding）
+            raise ValidationError(self.invalid_file_message)
+        return size
 
-    def get_file_extension(self, filename, decoded_file):
-        try:
-            from PIL import Image
-        except ImportError:
-            raise ImportError("Pillow is not installed.")
-        extension = imghdr.what(filename, decoded_file)
+    @staticmethod
+    def _normalize_type(image_type):
+        return "jpg" if image_type == "jpeg" else image_type
 
-        # Try with PIL as fallback if format not detected due
-        # to bug in imghdr https://bugs.python.org/issue16512
+    def get_file_extension(self, header, file):
+        """
+        先根据文件头判断，无法判断时用PIL打开（只读取文件头，不加载图片数据）
+        """
+        extension = detect_image_type(header)
         if extension is None:
             try:
-                image = Image.open(io.BytesIO(decoded_file))
+                from PIL import Image
+            except ImportError:
+                raise ImportError("Pillow is not installed.")
+            file.seek(0)
+            try:
+                image = Image.open(file)
             except OSError:
                 raise ValidationError(self.invalid_file_message)
-
             extension = image.format.lower()
 
-        extension = "jpg" if extension == "jpeg" else extension
-        return extension
+        return self._normalize_type(extension)
 
     @staticmethod
     def get_file_name():
@@ -104,9 +180,78 @@ class Base64ImageField(ImageField):
                 return ""
 
             try:
-                with open(file.path, "rb") as f:
-                    return base64.b64encode(f.read()).decode()
-            except Exception:
-                raise OSError("Error encoding file")
+                key = (self.get_storage_key(file.storage), file.name, self.get_file_version(file),
+                       self.thumbnail_size)
+                encoded = self.base64_cache.get(key)
+                if encoded is None:
+                    encoded = self.encode_file(file)
+                    self.base64_cache.set(key, encoded)
+                return encoded
+            except Exception as exc:
+                raise OSError("Error encoding file") from exc
         else:
             return super().to_representation(file)
+
+    @staticmethod
+    def get_storage_key(storage):
+        """
+        存储的标识：类的路径和位置（本地目录，或S3的endpoint、bucket、前缀），不同进程、不同实例相同
+        """
+        storage_class = type(storage)
+        s3_settings = getattr(storage, 'settings', None)
+        if s3_settings is not None and hasattr(s3_settings, 'AWS_S3_BUCKET_NAME'):
+            location = (s3_settings.AWS_S3_ENDPOINT_URL, s3_settings.AWS_S3_BUCKET_NAME, s3_settings.AWS_S3_KEY_PREFIX)
+        else:
+            location = getattr(storage, 'location', None)
+        return '%s.%s' % (storage_class.__module__, storage_class.__qualname__), location
+
+    def get_file_version(self, file):
+        """
+        文件内容的版本：S3存储为ETag（version_timeout内不重复HEAD请求），其他存储为大小和修改时间
+        """
+        storage = file.storage
+        if not hasattr(storage, 'meta'):
+            return storage.size(file.name), storage.get_modified_time(file.name).timestamp()
+        key = (self.get_storage_key(storage), file.name)
+        cached = self.version_cache.get(key)
+        now = time.monotonic()
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        version = storage.meta(file.name).get('ETag')
+        self.version_cache.set(key, (version, now + self.version_timeout))
+        return version
+
+    def encode_file(self, file):
+        """
+        通过存储的API读取，不依赖file.path（S3存储的path()为None）
+        """
+        with file.storage.open(file.name, "rb") as f:
+            if self.thumbnail_size:
+                return self.encode_thumbnail(f)
+            # 按3的倍数分块编码，不同时持有完整的原文件和编码结果
+            chunks = list()
+            leftover = b""
+            while True:
+                data = f.read(self.encode_chunk_size)
+                if not data:
+                    break
+                data = leftover + data
+                usable = len(data) - len(data) % 3
+                chunks.append(base64.b64encode(data[:usable]).decode())
+                leftover = data[usable:]
+            chunks.append(base64.b64encode(leftover).decode())
+            return "".join(chunks)
+
+    def encode_thumbnail(self, f):
+        from PIL import Image
+
+        image = Image.open(f)
+        image_format = image.format or "PNG"
+        # JPEG按缩小的比例解码
+        image.draft("RGB", self.thumbnail_size)
+        image.thumbnail(self.thumbnail_size)
+        if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, image_format)
+        return base64.b64encode(output.getvalue()).decode()
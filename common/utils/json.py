@@ -1,42 +1,181 @@
 import decimal
 import json
 import uuid
-from datetime import datetime, date, time
+from datetime import datetime, date, time, timedelta
 
-from django.db.models import Model
+from django.db.models import Model, QuerySet
 from django.db.models.fields.files import FieldFile
 from django.forms import model_to_dict
 from django.utils import timezone
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 __all__ = [
     'JsonEncoder',
+    'RawJSON',
+    'dumps',
+    'dumps_bytes',
     'is_json_str',
 ]
 
 SENSITIVE_FIELDS = ['password']
 
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+class RawJSON(bytes):
+    """
+    已编码的JSON（如缓存的响应数据），作为Response的data时原样输出，不再解码和重新编码
+    """
+
 
 class JsonEncoder(json.JSONEncoder):
-    objects_to_string = (decimal.Decimal, uuid.UUID)
+    """
+    项目统一的JSON编码器
 
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return timezone.localtime(obj).strftime('%Y-%m-%d %H:%M:%S')
-        elif isinstance(obj, date):
-            return timezone.localdate(obj).strftime('%Y-%m-%d')
-        elif isinstance(obj, time):
-            return obj.strftime('%H:%M:%S')
-        elif isinstance(obj, self.objects_to_string):
-            return str(obj)
-        elif obj.__class__.__name__ == 'GenericRelatedObjectManager':
-            return
-        elif isinstance(obj, FieldFile):
-            if obj:
-                return obj.url
-        elif isinstance(obj, Model):
-            return model_to_dict(obj, exclude=SENSITIVE_FIELDS)
+    datetime：当前时区，%Y-%m-%d %H:%M:%S
+    date：%Y-%m-%d
+    time：%H:%M:%S
+    Decimal、UUID、惰性字符串：字符串
+    timedelta：秒数的字符串
+    bytes：解码为字符串
+    FieldFile：url
+    Model：字典（不包含敏感字段）
+    其他映射：字典；其他可迭代对象：列表
+
+    按精确类型查表（handlers：{类型: 方法名}）分发，未命中时沿MRO查找，结果按类型缓存（每个子类各自缓存）；
+    通过getattr调用，子类重写encode_*方法即可改变编码方式；当前时区每个编码器实例只获取一次
+    """
+    handlers = {
+        datetime: 'encode_datetime',
+        date: 'encode_date',
+        time: 'encode_time',
+        decimal.Decimal: 'encode_string',
+        uuid.UUID: 'encode_string',
+        Promise: 'encode_promise',
+        timedelta: 'encode_timedelta',
+        RawJSON: 'encode_raw',
+        bytes: 'encode_bytes',
+        FieldFile: 'encode_file',
+        Model: 'encode_model',
+        QuerySet: 'encode_iterable',
+    }
+    _resolved = dict()  # {type: 方法名}，MRO查找结果缓存
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # 子类的handlers可能不同，不能共用缓存
+        cls._resolved = dict()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tz = None
+
+    def encode_datetime(self, obj):
+        if obj.tzinfo is None:
+            raise ValueError('Naive datetime %s is not supported.' % obj)
+        if self._tz is None:
+            self._tz = timezone.get_current_timezone()
+        obj = obj.astimezone(self._tz)
+        return '%04d-%02d-%02d %02d:%02d:%02d' % (
+            obj.year, obj.month, obj.day, obj.hour, obj.minute, obj.second)
+
+    def encode_date(self, obj):
+        return '%04d-%02d-%02d' % (obj.year, obj.month, obj.day)
+
+    def encode_time(self, obj):
+        return '%02d:%02d:%02d' % (obj.hour, obj.minute, obj.second)
+
+    def encode_string(self, obj):
+        return str(obj)
+
+    def encode_promise(self, obj):
+        return force_str(obj)
+
+    def encode_timedelta(self, obj):
+        return str(obj.total_seconds())
+
+    def encode_bytes(self, obj):
+        return obj.decode()
+
+    def encode_raw(self, obj):
+        # 嵌套在其他数据中时，只能解码后重新编码
+        return json.loads(obj)
+
+    def encode_file(self, obj):
+        if obj:
+            return obj.url
+
+    def encode_model(self, obj):
+        return model_to_dict(obj, exclude=SENSITIVE_FIELDS)
+
+    def encode_none(self, obj):
+        return
+
+    def encode_mapping(self, obj):
+        return dict(obj)
+
+    def encode_iterable(self, obj):
+        return tuple(obj)
+
+    @classmethod
+    def resolve(cls, obj_type):
+        """
+        沿MRO查找编码方法名，找不到时返回None
+        """
+        try:
+            return cls._resolved[obj_type]
+        except KeyError:
+            pass
+        name = None
+        if obj_type.__name__ == 'GenericRelatedObjectManager':
+            name = 'encode_none'
         else:
+            for base in obj_type.__mro__:
+                if base in cls.handlers:
+                    name = cls.handlers[base]
+                    break
+            else:
+                if hasattr(obj_type, 'keys') and hasattr(obj_type, '__getitem__'):
+                    name = 'encode_mapping'
+                elif hasattr(obj_type, '__iter__'):
+                    name = 'encode_iterable'
+        cls._resolved[obj_type] = name
+        return name
+
+    def default(self, obj):
+        name = self.resolve(obj.__class__)
+        if name is None:
             return json.JSONEncoder.default(self, obj)
+        return getattr(self, name)(obj)
+
+
+def dumps_bytes(obj, encoder_class=JsonEncoder) -> bytes:
+    """
+    紧凑格式编码，不转义非ASCII字符
+
+    安装了orjson时使用orjson，不支持的类型仍由encoder_class处理
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # 如超出64位的整数，交给标准库处理
+            pass
+    return json.dumps(
+        obj, cls=encoder_class, ensure_ascii=False, separators=(',', ':')
+    ).encode()
+
+
+def dumps(obj, encoder_class=JsonEncoder) -> str:
+    if orjson is None:
+        return json.dumps(obj, cls=encoder_class, ensure_ascii=False, separators=(',', ':'))
+    return dumps_bytes(obj, encoder_class=encoder_class).decode()
 
 
 def is_json_str(raw_str):
@@ -6,6 +6,7 @@ from pathlib import Path
 from django.apps import apps
 from django.db.models import Model, QuerySet
 
+from common.models.managers import CacheManager
 from common.utils.text import obj2iter
 
 
@@ -48,7 +49,12 @@ def trans_objs_to_pks(objs: typing.Union[int, Model, list, QuerySet], model_cls,
             raise ValueError('Unknown object %s in list' % type(item))
 
     if exclude_nonexists:
-        return list(model_cls.objects.filter(pk__in=pk_list).values_list('pk', flat=True))
+        manager = next((m for m in model_cls._meta.managers if isinstance(m, CacheManager)), None)
+        if manager is None:
+            return list(model_cls.objects.filter(pk__in=pk_list).values_list('pk', flat=True))
+        # 有CacheManager时批量从缓存中取
+        exists = manager.get_many(pk_list)
+        return [pk for pk in dict.fromkeys(pk_list) if pk in exists]
 
     return pk_list
 
@@ -1,25 +1,20 @@
 """
 String helper
 """
-import decimal
 import hashlib
 import json
 import os
 import re
 import sys
 import typing
-import uuid
-from datetime import datetime, date, time
 from pathlib import Path
 from urllib.parse import urlparse
 
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
-from django.db.models import Model
-from django.db.models.fields.files import FieldFile
-from django.forms import model_to_dict
-from django.utils import timezone
-from django.utils.functional import Promise
+
+# CJsonEncoder已与common.utils.json.JsonEncoder合并，保留名称兼容旧代码
+from common.utils.json import JsonEncoder as CJsonEncoder, is_json_str
 
 __all__ = [
     'is_int', 'is_float', 'is_list', 'is_dict', 'is_tuple', 'is_bool',
@@ -379,44 +374,6 @@ def get_filename_extension(filename):
     # return extension if extension and intact else extension
 
 
-SENSITIVE_FIELDS = ['password']
-
-
-class CJsonEncoder(json.JSONEncoder):
-    objects_to_string = (decimal.Decimal, uuid.UUID, Promise)
-
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return timezone.localtime(obj).strftime('%Y-%m-%d %H:%M:%S')
-        elif isinstance(obj, date):
-            obj = datetime(obj.year, obj.month, obj.day, 0, 0, 0, tzinfo=timezone.get_current_timezone())
-            return timezone.localdate(obj).strftime('%Y-%m-%d')
-        elif isinstance(obj, time):
-            return obj.strftime('%H:%M:%S')
-        elif isinstance(obj, self.objects_to_string):
-            return str(obj)
-        elif obj.__class__.__name__ == 'GenericRelatedObjectManager':
-            return
-        elif isinstance(obj, FieldFile):
-            if obj:
-                return obj.url
-        elif isinstance(obj, Model):
-            return model_to_dict(obj, exclude=SENSITIVE_FIELDS)
-        else:
-            return json.JSONEncoder.default(self, obj)
-
-
-def is_json_str(raw_str):
-    if isinstance(raw_str, str):
-        try:
-            json.loads(raw_str)
-        except ValueError:
-            return False
-        return True
-    else:
-        return False
-
-
 def crypto_mobile(mobile_phone):
     if not mobile_phone:
         return mobile_phone
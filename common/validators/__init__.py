@@ -1,5 +1,4 @@
 import json
-import re
 
 from django.core import validators
 from django.core.exceptions import ValidationError
@@ -9,29 +8,45 @@ from django.utils.translation import gettext_lazy as _
 from common.utils.regex import MOBILE_REGEX, SMS_CODE_REGEX, GLOBAL_MOBILE_REGEX
 
 
-@deconstructible
-class ListFieldValidator(validators.RegexValidator):
-    regex = r'^(\[.*?\]|null)$'
-    message = 'List field only accepts list-like or null string'
-    flags = re.UNICODE
+class JsonContainerValidator:
+    """
+    只检查首尾字符，不用正则扫描整个字符串；已解码的值只检查类型
+    """
+    message = 'Enter a valid json string.'
+    code = 'invalid'
+    python_type = None
+    brackets = ('', '')
 
     def __call__(self, value):
+        if isinstance(value, self.python_type):
+            return
         if isinstance(value, str):
-            super().__call__(value)
-        elif isinstance(value, list):
-            pass
-        else:
-            raise ValidationError(self.message, code=self.code, params={'value': value})
+            if value == 'null':
+                return
+            if value[:1] == self.brackets[0] and value[-1:] == self.brackets[1]:
+                return
+        raise ValidationError(self.message, code=self.code, params={'value': value})
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, self.__class__) and
+            self.message == other.message and
+            self.code == other.code
+        )
 
 
 @deconstructible
-class DictFieldValidator(validators.RegexValidator):
-    regex = r'^(\{.*?\}|null)$'
-    message = _(
-        'Enter a valid username. This value may contain only English letters, '
-        'numbers, and @/./+/-/_ characters.'
-    )
-    flags = re.UNICODE
+class ListFieldValidator(JsonContainerValidator):
+    message = 'List field only accepts list-like or null string'
+    python_type = list
+    brackets = ('[', ']')
+
+
+@deconstructible
+class DictFieldValidator(JsonContainerValidator):
+    message = 'Dict field only accepts dict-like or null string'
+    python_type = dict
+    brackets = ('{', '}')
 
 
 class MobilePhoneValidator(validators.RegexValidator):
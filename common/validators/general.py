@@ -1,4 +1,3 @@
-import re
 from datetime import datetime
 
 from django.core import validators
@@ -8,25 +7,6 @@ from django.utils.deconstruct import deconstructible
 from django.utils.translation import gettext_lazy as _
 
 
-@deconstructible
-class ListFieldValidator(validators.RegexValidator):
-    regex = r'^(\[.*?\]|null)$'
-    message = _(
-        'List field only accepts list-like or null string'
-    )
-    flags = re.UNICODE
-
-
-@deconstructible
-class DictFieldValidator(validators.RegexValidator):
-    regex = r'^(\{.*?\}|null)$'
-    message = _(
-        'Enter a valid username. This value may contain only English letters, '
-        'numbers, and @/./+/-/_ characters.'
-    )
-    flags = re.UNICODE
-
-
 @deconstructible
 class ClassNameValidator(validators.RegexValidator):
     regex = r'^([A-Z]|_){1}[a-zA-Z0-9_]?'
@@ -1,14 +1,21 @@
-from rest_framework.generics import GenericAPIView
+from rest_framework.generics import GenericAPIView as _GenericAPIView
 from rest_framework.views import APIView as _APIView
 
 from common.permissions import login_required
 from common.views import mixins
 
 
-class APIView(_APIView):
+class APIView(mixins.SafeMethodsNonAtomicMixin, mixins.StickyPrimaryMixin, _APIView):
     _ignore_model_permissions = True
 
 
+class GenericAPIView(mixins.SafeMethodsNonAtomicMixin, mixins.StickyPrimaryMixin, _GenericAPIView):
+    """
+    安全方法不使用请求级事务，见SafeMethodsNonAtomicMixin
+    写操作后读主库，见StickyPrimaryMixin
+    """
+
+
 class CreateAPIView(mixins.CreateModelMixin,
                     GenericAPIView):
     """
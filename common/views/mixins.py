@@ -1,9 +1,144 @@
-from django.db import IntegrityError
+import hashlib
+from contextlib import ExitStack
+from functools import partial
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import QuerySet
+from django.utils import translation
 from rest_framework import mixins as _mixins, serializers
 from rest_framework import status
 from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response as _Response
+
+from common.core.cache import tiered_cache
+from common.core.cache_metrics import instrument
+from common.core.renderers import ENVELOPE_KEYS, JSONRenderer
+from common.core.routers import replica_reads, stick_to_primary
+from common.models.managers import cache_version
+from common.serializers.compiled import compile_values_serializer
+from common.utils.json import RawJSON
+from common.views.response import Envelope, Response
+
+RESPONSE_KEY = 'response:%s:%s:%s'  # 模型label、版本号、路径、格式、语言（及用户）的摘要
+ENVELOPE = 'envelope'
+RAW = 'raw'
+
+response_cache = instrument(tiered_cache)
+
+
+class SafeMethodsNonAtomicMixin:
+    """
+    ATOMIC_REQUESTS开启时，安全方法（GET/HEAD/OPTIONS）不再包裹在请求级事务中，
+    省去BEGIN/COMMIT两次往返，也不会在序列化期间一直持有InnoDB的read view。
+    写操作（POST/PUT/PATCH/DELETE）仍在事务中执行。
+
+    atomic_safe_methods：安全方法是否仍使用事务（如GET中有写操作的视图，设为True）
+    dispatch用transaction.non_atomic_requests装饰（method_decorator）时，对应的数据库任何方法都不使用事务
+    """
+    atomic_safe_methods = False
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # 跳过django的请求级事务，由dispatch根据请求方法决定是否开启；保留已声明的non_atomic_requests
+        view._non_atomic_requests = getattr(view, '_non_atomic_requests', set()) | set(cls._atomic_request_aliases())
+        return view
+
+    @staticmethod
+    def _atomic_request_aliases():
+        return [alias for alias, settings_dict in connections.settings.items()
+                if settings_dict.get('ATOMIC_REQUESTS')]
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in SAFE_METHODS and not self.atomic_safe_methods:
+            return super().dispatch(request, *args, **kwargs)
+        # 子类的dispatch（最外层）上声明的non_atomic_requests
+        non_atomic = getattr(self.dispatch, '_non_atomic_requests', set())
+        with ExitStack() as stack:
+            for alias in self._atomic_request_aliases():
+                if alias not in non_atomic:
+                    stack.enter_context(transaction.atomic(using=alias))
+            return super().dispatch(request, *args, **kwargs)
+
+
+class StickyPrimaryMixin:
+    """
+    写操作成功后，该用户接下来的读操作固定使用主库一段时间，避免读到从库中的旧数据
+    """
 
-from common.views.response import Response
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            stick_to_primary(getattr(request, 'user', None))
+        return response
+
+
+class CachedResponseMixin:
+    """
+    list、retrieve的响应数据缓存为已编码的JSON，命中时不查询（retrieve仍获取对象以检查权限）、
+    不序列化、不重新编码，返回的RawJSON由渲染器原样输出，CompressionMiddleware同时缓存压缩结果
+
+    默认不开启；只缓存JSONRenderer的响应，key包含请求的媒体类型和当前语言
+
+    cache_response_seconds：缓存时间，为0时不缓存
+    cache_response_depends_on：序列化结果还依赖的模型（如关联表），key包含各模型的版本号，任一模型写入后失效
+    cache_response_per_user：数据与当前用户有关（如按用户过滤的queryset）时，key包含用户
+
+    版本号随post_save、post_delete、m2m_changed改变；queryset.update()、bulk_create()等不发送信号，
+    写入后需调用common.models.managers.bump_version(model)，否则cache_response_seconds内返回旧数据
+    """
+    cache_response_seconds = 0
+    cache_response_depends_on = ()
+    cache_response_per_user = False
+
+    def get_response_cache_key(self, request):
+        model = self.get_queryset().model
+        versions = '.'.join(str(cache_version(m)) for m in (model, *self.cache_response_depends_on))
+        # 不同格式（Accept的参数，如indent）、不同语言（msg等翻译的文本）不共用
+        path = '%s|%s|%s' % (request.get_full_path(), request.accepted_media_type, translation.get_language())
+        if self.cache_response_per_user:
+            path += '#%s' % request.user.pk
+        digest = hashlib.blake2b(path.encode(), digest_size=16).hexdigest()
+        return RESPONSE_KEY % (model._meta.label, versions, digest)
+
+    def cached_response(self, request, build):
+        """
+        build() -> Response；状态码为200的响应编码后缓存
+        """
+        if (not self.cache_response_seconds or request.method != 'GET'
+                or not isinstance(getattr(request, 'accepted_renderer', None), JSONRenderer)):
+            return build()
+        key = self.get_response_cache_key(request)
+        entry = response_cache.get(key)
+        if entry is not None:
+            return self._restore_response(entry)
+        response = build()
+        entry = self._response_entry(response)
+        if entry is not None:
+            response_cache.set(key, entry, self.cache_response_seconds)
+        return response
+
+    @staticmethod
+    def _response_entry(response):
+        if response.status_code != 200 or response.exception:
+            return
+        data = response.data
+        if isinstance(data, Envelope):
+            if data.keys() != ENVELOPE_KEYS or data['msg']:
+                return
+            # 只缓存data，命中时由Response重新套上{code, msg, data}
+            return ENVELOPE, JSONRenderer().render(data['data'])
+        # 分页等DRF的Response，缓存整个响应数据
+        return RAW, JSONRenderer().render(data)
+
+    def _restore_response(self, entry):
+        kind, content = entry
+        if kind == ENVELOPE:
+            return Response(RawJSON(content))
+        response = _Response(RawJSON(content))
+        response.cache_compressed = True
+        return response
 
 
 class CreateModelMixin(_mixins.CreateModelMixin):
@@ -30,20 +165,47 @@ class CreateModelMixin(_mixins.CreateModelMixin):
         return self.create_response(response_data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class ListModelMixin:
+class ListModelMixin(CachedResponseMixin):
     """
     List a queryset.
     """
     list_response = Response
+    # 序列化器只包含简单字段时，用values_list读取并直接生成数据，不实例化模型
+    values_serializer = True
 
     def _handle_serializer_data(self, serializer_data):
         return serializer_data
 
+    def get_values_projection(self, queryset):
+        if not self.values_serializer or not isinstance(queryset, QuerySet):
+            return
+        query = queryset.query
+        # distinct、annotate、extra、union等：只取序列化器的列时行集合可能不同（行合并、注解被忽略），使用模型实例
+        if (query.distinct or query.annotations or query.extra or query.combinator
+                or queryset._fields is not None):
+            return
+        return compile_values_serializer(self.get_serializer())
+
     def list(self, request, *args, **kwargs):
+        # 从库读取（配置了从库时）
+        with replica_reads(user=request.user):
+            return self.cached_response(request, self._list)
+
+    def _list(self):
         # 优先拿queryset属性（有permission校验会先获取）
         queryset = self.queryset if self.queryset is not None else self.get_queryset()
         queryset = self.filter_queryset(queryset)
 
+        projection = self.get_values_projection(queryset)
+        if projection is not None:
+            rows = projection.values_list(queryset)
+            page = self.paginate_queryset(rows)
+            if page is not None:
+                data = self._handle_serializer_data(projection.to_representation(page))
+                return self.get_paginated_response(data)
+            data = self._handle_serializer_data(projection.to_representation(rows))
+            return self.list_response(data)
+
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -52,18 +214,23 @@ class ListModelMixin:
 
         serializer = self.get_serializer(queryset, many=True)
         data = self._handle_serializer_data(serializer.data)
-
         return self.list_response(data)
 
 
-class RetrieveModelMixin:
+class RetrieveModelMixin(CachedResponseMixin):
     """
     Retrieve a model instance.
     """
     retrieve_response = Response
 
     def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
+        # 从库读取（配置了从库时）
+        with replica_reads(user=request.user):
+            # 缓存命中时也获取对象，检查对象权限
+            instance = self.get_object()
+            return self.cached_response(request, partial(self._retrieve, instance))
+
+    def _retrieve(self, instance):
         serializer = self.get_serializer(instance)
         data = self._handle_serializer_data(serializer.data, instance)
         return self.retrieve_response(data)
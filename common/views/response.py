@@ -6,12 +6,24 @@ from django.core.files.images import ImageFile
 from rest_framework import status as http_status
 from rest_framework.response import Response as _Response
 
+from common.utils.json import RawJSON
+
+
+class Envelope(dict):
+    """
+    Response的数据格式：{code, msg, data}（debug时还有debug）
+
+    common.core.renderers.JSONRenderer渲染时直接拼接固定的前后缀，只对data进行编码
+    """
+
 
 class Response(_Response):
+    # data为缓存的RawJSON时，CompressionMiddleware缓存压缩结果
+    cache_compressed = False
 
     @staticmethod
     def format_data(status=None, msg: list = None, data=None, context: dict = None):
-        res = dict()
+        res = Envelope()
         if context and settings.DEBUG:
             # 出现异常，且debug开启时
             request = context['request']
@@ -47,5 +59,7 @@ class Response(_Response):
 
     def __init__(self, data: Union[dict, list] = None, status=None, msg: list = None, *args, **kwargs):
         context = kwargs.pop('context', None)
+        if isinstance(data, RawJSON):
+            self.cache_compressed = True
         data = self.format_data(status=status, msg=msg, data=data, context=context)
         super().__init__(data=data, status=status, *args, **kwargs)
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        if getattr(settings, 'PROJECT_SETTINGS_WATCH', False):
+            from common.core.settings import project_settings
+
+            project_settings.watch(sighup=getattr(settings, 'PROJECT_SETTINGS_SIGHUP', False))
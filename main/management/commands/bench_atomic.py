@@ -0,0 +1,74 @@
+"""
+对比安全方法（GET）在请求级事务内外的耗时
+
+python manage.py bench_atomic --requests 2000
+"""
+import statistics
+import time
+
+from django.core.handlers.base import BaseHandler
+from django.core.management import BaseCommand
+from rest_framework.test import APIRequestFactory
+
+from apiv1.views.base import ListCreateServerGroup
+
+
+class Command(BaseCommand):
+    help = 'Benchmark GET requests with and without the request-wide transaction.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=1000,
+            help='Requests to send for each case.'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=50,
+            help='Requests sent before timing each case.'
+        )
+        parser.add_argument(
+            '--page-size', type=int, default=10,
+            help='Page size of the list request.'
+        )
+
+    @staticmethod
+    def _make_view(atomic):
+        view_class = type(
+            'BenchServerGroupView', (ListCreateServerGroup,),
+            {'authentication_classes': (), 'permission_classes': (), 'atomic_safe_methods': atomic}
+        )
+        # 与django处理请求时一致，按ATOMIC_REQUESTS包装视图
+        return BaseHandler().make_view_atomic(view_class.as_view())
+
+    @staticmethod
+    def _run(view, request_factory, count, page_size):
+        timings = list()
+        for _ in range(count):
+            request = request_factory.get('/', {'page_size': page_size})
+            start = time.perf_counter()
+            response = view(request)
+            response.render()
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        page_size = options['page_size']
+        request_factory = APIRequestFactory()
+
+        results = dict()
+        for name, atomic in (('atomic', True), ('non-atomic', False)):
+            view = self._make_view(atomic)
+            self._run(view, request_factory, options['warmup'], page_size)
+            results[name] = self._run(view, request_factory, count, page_size)
+
+        for name, timings in results.items():
+            self.stdout.write(
+                '%-12s mean %.3f ms, median %.3f ms, p95 %.3f ms' % (
+                    name,
+                    statistics.mean(timings) * 1000,
+                    statistics.median(timings) * 1000,
+                    statistics.quantiles(timings, n=20)[-1] * 1000
+                )
+            )
+        saved = statistics.mean(results['atomic']) - statistics.mean(results['non-atomic'])
+        self.stdout.write(self.style.SUCCESS('Saved per request: %.3f ms' % (saved * 1000)))
@@ -0,0 +1,77 @@
+"""
+缓存实例的编码对比：pickle实例+zlib（django-redis的默认方式） vs ModelCodec+pickle+zlib
+
+不访问数据库，用Model.from_db构造Server实例（带select_related的group）
+
+python manage.py bench_cache_codec --sizes 1 100 10000
+"""
+import pickle
+import time
+import zlib
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from common.models.codec import ModelCodec
+from main.models import Server, ServerGroup
+
+
+class Command(BaseCommand):
+    help = 'Compare size and speed of pickled model instances with ModelCodec rows, both zlib compressed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1, 100, 10000],
+            help='Instance counts of each case.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Repeat times of each case, the best one is reported.'
+        )
+
+    @staticmethod
+    def make_instances(count):
+        now = timezone.now()
+        group_attnames = [field.attname for field in ServerGroup._meta.concrete_fields]
+        server_attnames = [field.attname for field in Server._meta.concrete_fields]
+        field = Server._meta.get_field('group')
+        instances = list()
+        for i in range(count):
+            group = ServerGroup.from_db('default', group_attnames, (i % 10 + 1, f'group-{i % 10}', '测试分组', now))
+            server = Server.from_db('default', server_attnames, (
+                i + 1, f'server-{i}', '测试服务器 %d' % i, f'10.0.{i // 256 % 256}.{i % 256}',
+                bool(i % 2), group.pk, now, None,
+            ))
+            field.set_cached_value(server, group)
+            instances.append(server)
+        return instances
+
+    @staticmethod
+    def best(func, repeat):
+        timings = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings) * 1000
+
+    def handle(self, *args, **options):
+        codec = ModelCodec(Server, select_related=('group',))
+        repeat = options['repeat']
+        self.stdout.write('%-10s %7s %12s %12s %12s' % ('case', 'rows', 'bytes', 'dumps ms', 'loads ms'))
+        for size in options['sizes']:
+            instances = self.make_instances(size)
+            cases = {
+                'pickle': (
+                    lambda: zlib.compress(pickle.dumps(instances, pickle.HIGHEST_PROTOCOL)),
+                    lambda data: pickle.loads(zlib.decompress(data)),
+                ),
+                'codec': (
+                    lambda: zlib.compress(pickle.dumps(codec.encode(instances), pickle.HIGHEST_PROTOCOL)),
+                    lambda data: codec.decode(pickle.loads(zlib.decompress(data)), 'default'),
+                ),
+            }
+            for name, (dumps, loads) in cases.items():
+                data = dumps()
+                self.stdout.write('%-10s %7d %12d %12.3f %12.3f' % (
+                    name, size, len(data), self.best(dumps, repeat), self.best(lambda: loads(data), repeat)))
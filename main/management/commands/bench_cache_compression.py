@@ -0,0 +1,100 @@
+"""
+缓存值的序列化、压缩对比，用于确定common.core.redis_cache的默认值
+
+对常见的缓存值（标志、NOT_FOUND、CacheManager的条目、统计数据、序列化后的行、已压缩的响应），
+比较pickle与AdaptiveSerializer，以及不压缩与各zlib级别的大小和耗时
+
+python manage.py bench_cache_compression
+"""
+import gzip
+import os
+import pickle
+import time
+import zlib
+
+from django.core.management import BaseCommand
+
+from common.core.redis_cache import AdaptiveCompressor, AdaptiveSerializer
+from common.models.codec import ModelCodec
+from common.models.managers import NOT_FOUND
+from main.management.commands.bench_cache_codec import Command as CodecCommand
+from main.models import Server
+
+LEVELS = (1, 3, 6, 9)
+
+
+class Command(BaseCommand):
+    help = 'Compare serializers and zlib levels over typical cache values to pick the redis cache defaults.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=200,
+            help='Repeat times of each measurement, the best one is reported.'
+        )
+
+    @staticmethod
+    def payloads():
+        codec = ModelCodec(Server, select_related=('group',))
+
+        def entry(count):
+            return codec.encode(CodecCommand.make_instances(count)), time.time(), 0.001
+
+        def rows(count):
+            return [
+                {'id': i, 'name': f'group-{i}', 'description': '测试分组 %d' % i,
+                 'created_at': '2024-01-01T00:00:00.000000+08:00'}
+                for i in range(count)
+            ]
+
+        return {
+            'flag (True)': True,
+            'NOT_FOUND': NOT_FOUND,
+            'instance entry (1)': entry(1),
+            'serialized rows (10)': rows(10),
+            'metrics snapshot': {
+                'worker': 'host:1', 'updated_at': time.time(),
+                'groups': {f'namespace:{i}': {'hits': i, 'misses': i, 'latency': [i] * 10} for i in range(5)},
+            },
+            'queryset entry (100)': entry(100),
+            'serialized rows (1000)': rows(1000),
+            'queryset entry (10000)': entry(10000),
+            'gzip response (32KB)': gzip.compress(os.urandom(16 * 1024).hex().encode()),
+        }
+
+    @staticmethod
+    def best_us(func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1e6
+
+    def handle(self, *args, **options):
+        serializer = AdaptiveSerializer({'PICKLE_VERSION': -1})
+        compressor = AdaptiveCompressor({})
+        for name, value in self.payloads().items():
+            repeat = options['repeat'] if len(pickle.dumps(value)) < 100000 else 5
+            pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            adaptive = serializer.dumps(value)
+            self.stdout.write(f'\n{name}')
+            self.stdout.write('  %-22s %9d B  dumps %9.1f us  loads %9.1f us' % (
+                'pickle', len(pickled),
+                self.best_us(lambda: pickle.dumps(value, pickle.HIGHEST_PROTOCOL), repeat),
+                self.best_us(lambda: pickle.loads(pickled), repeat)))
+            self.stdout.write('  %-22s %9d B  dumps %9.1f us  loads %9.1f us' % (
+                'AdaptiveSerializer', len(adaptive),
+                self.best_us(lambda: serializer.dumps(value), repeat),
+                self.best_us(lambda: serializer.loads(adaptive), repeat)))
+            for level in LEVELS:
+                compressed = zlib.compress(adaptive, level)
+                self.stdout.write('  %-22s %9d B  comp  %9.1f us  decomp %8.1f us' % (
+                    f'zlib level {level}', len(compressed),
+                    self.best_us(lambda: zlib.compress(adaptive, level), repeat),
+                    self.best_us(lambda: zlib.decompress(compressed), repeat)))
+            stored = compressor.compress(adaptive)
+            self.stdout.write('  %-22s %9d B  comp  %9.1f us  decomp %8.1f us' % (
+                'AdaptiveCompressor', len(stored),
+                self.best_us(lambda: compressor.compress(adaptive), repeat),
+                self.best_us(lambda: compressor.decompress(stored), repeat)))
@@ -0,0 +1,99 @@
+"""
+JSON编码性能对比（Server数据）
+
+python manage.py bench_json --rows 10000
+"""
+import decimal
+import json
+import time
+import uuid
+from datetime import datetime, date
+
+from django.core.management import BaseCommand
+from django.db.models import Model
+from django.db.models.fields.files import FieldFile
+from django.forms import model_to_dict
+from django.utils import timezone
+from django.utils.functional import Promise
+
+from common.utils import json as json_utils
+from common.utils.json import JsonEncoder, SENSITIVE_FIELDS
+from main.models import Server
+from main.utils import fake_server_rows
+
+
+class LegacyJsonEncoder(json.JSONEncoder):
+    """
+    合并前的CJsonEncoder，作为对比基准
+    """
+    objects_to_string = (decimal.Decimal, uuid.UUID, Promise)
+
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return timezone.localtime(obj).strftime('%Y-%m-%d %H:%M:%S')
+        elif isinstance(obj, date):
+            obj = datetime(obj.year, obj.month, obj.day, 0, 0, 0, tzinfo=timezone.get_current_timezone())
+            return timezone.localdate(obj).strftime('%Y-%m-%d')
+        elif isinstance(obj, self.objects_to_string):
+            return str(obj)
+        elif obj.__class__.__name__ == 'GenericRelatedObjectManager':
+            return
+        elif isinstance(obj, FieldFile):
+            if obj:
+                return obj.url
+        elif isinstance(obj, Model):
+            return model_to_dict(obj, exclude=SENSITIVE_FIELDS)
+        else:
+            return json.JSONEncoder.default(self, obj)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark JSON encoders over Server rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=10000,
+            help='Number of synthetic Server rows.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Repeat times of each case, the best one is reported.'
+        )
+        parser.add_argument(
+            '--from-db', action='store_true', default=False,
+            help='Use Server rows from the database instead of synthetic rows.'
+        )
+
+    @staticmethod
+    def _best(func, repeat):
+        timings = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def handle(self, *args, **options):
+        if options['from_db']:
+            rows = list(Server.objects.values())
+        else:
+            rows = fake_server_rows(options['rows'])
+        repeat = options['repeat']
+
+        cases = {
+            'legacy CJsonEncoder': lambda: json.dumps(rows, cls=LegacyJsonEncoder),
+            'JsonEncoder (json)': lambda: json.dumps(
+                rows, cls=JsonEncoder, ensure_ascii=False, separators=(',', ':')),
+        }
+        if json_utils.orjson is not None:
+            cases['JsonEncoder (orjson)'] = lambda: json_utils.dumps_bytes(rows)
+
+        self.stdout.write(f'{len(rows)} rows, best of {repeat}')
+        baseline = None
+        for name, func in cases.items():
+            seconds = self._best(func, repeat)
+            baseline = baseline or seconds
+            self.stdout.write(
+                '%-24s %9.2f ms  %8.0f rows/s  x%.2f' % (
+                    name, seconds * 1000, len(rows) / seconds, baseline / seconds)
+            )
@@ -0,0 +1,64 @@
+"""
+JSON与MessagePack的大小和编解码耗时对比（Server数据）
+
+python manage.py bench_msgpack --rows 1000
+"""
+import json
+import time
+import zlib
+
+import msgpack
+from django.core.management import BaseCommand
+
+from common.core.parsers import MessagePackParser
+from common.core.renderers import JSONRenderer, MessagePackRenderer
+from common.views.response import Response
+from main.utils import fake_server_rows
+
+
+class Command(BaseCommand):
+    help = 'Compare size and latency of JSON and MessagePack responses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=1000,
+            help='Number of synthetic Server rows in each response.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help='Repeat times of each case, the best one is reported.'
+        )
+
+    @staticmethod
+    def _best(func, repeat):
+        timings = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        data = Response(fake_server_rows(options['rows'])).data
+
+        json_renderer = JSONRenderer()
+        msgpack_renderer = MessagePackRenderer()
+        cases = {
+            'json': (lambda: json_renderer.render(data), json.loads),
+            'msgpack': (lambda: msgpack_renderer.render(data),
+                        lambda content: msgpack.unpackb(content, raw=False, strict_map_key=False)),
+        }
+
+        self.stdout.write(
+            f'{options["rows"]} rows, best of {repeat} ({MessagePackParser.media_type} vs application/json)')
+        self.stdout.write('%-8s %10s %12s %11s %11s' % ('format', 'bytes', 'zlib bytes', 'encode ms', 'decode ms'))
+        for name, (encode, decode) in cases.items():
+            content = encode()
+            self.stdout.write('%-8s %10d %12d %11.3f %11.3f' % (
+                name,
+                len(content),
+                len(zlib.compress(content)),
+                self._best(encode, repeat) * 1000,
+                self._best(lambda: decode(content), repeat) * 1000,
+            ))
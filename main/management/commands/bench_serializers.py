@@ -0,0 +1,209 @@
+"""
+序列化与渲染的性能测试
+
+在内存SQLite中生成ServerGroup、Server、User数据，对比各序列化方式在不同行数下的耗时，
+结果写入JSON文件，可与之前的结果对比
+
+python manage.py bench_serializers --sizes 10 1000 100000 --output bench.json
+python manage.py bench_serializers --compare bench.json
+"""
+import json
+import platform
+import time
+
+import django
+import rest_framework
+from django.contrib.auth import models as auth_models
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from apiv1.serializers.base import ServerGroupSerializer
+from common.core.renderers import JSONRenderer
+from common.serializers.compiled import compile_values_serializer
+from common.utils import json as json_utils
+from common.utils.serializer import model_serializer_factory
+from common.utils.text import CJsonEncoder
+from common.views.response import Response
+from main.models import Server, ServerGroup, User
+
+BENCH_DB = 'bench'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark serializers, JSON encoding and Response rendering over synthetic rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10, 1000, 100000],
+            help='Row counts of each case.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Repeat times of each case, the best one is reported.'
+        )
+        parser.add_argument(
+            '--output', default=None,
+            help='Write results to this JSON file.'
+        )
+        parser.add_argument(
+            '--compare', default=None,
+            help='Compare with a previous JSON result file.'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.1,
+            help='Relative slowdown reported as a regression when comparing, default 0.1 (10%%).'
+        )
+
+    @staticmethod
+    def _timings(func, repeat):
+        timings = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    @staticmethod
+    def setup_database():
+        """
+        独立的内存SQLite，不影响项目数据库
+        """
+        connections.settings[BENCH_DB] = connections.configure_settings({
+            'default': connections.settings['default'],
+            BENCH_DB: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'},
+        })[BENCH_DB]
+        with connections[BENCH_DB].schema_editor() as editor:
+            # User的groups、user_permissions关联的表也需要
+            for model in (ContentType, auth_models.Permission, auth_models.Group, User, ServerGroup, Server):
+                editor.create_model(model)
+
+    @staticmethod
+    def create_rows(count):
+        now = timezone.now()
+        groups = ServerGroup.objects.using(BENCH_DB).bulk_create(
+            ServerGroup(name=f'group-{i}', description='测试分组 %d' % i) for i in range(count)
+        )
+        users = User.objects.using(BENCH_DB).bulk_create(
+            User(username=f'user-{i}', nickname='用户%d' % i, password='!', date_joined=now)
+            for i in range(count)
+        )
+        Server.objects.using(BENCH_DB).bulk_create(
+            Server(
+                name=f'server-{i}',
+                description='测试服务器 %d' % i,
+                ip_address=f'10.0.{i // 256 % 256}.{i % 256}',
+                is_alive=bool(i % 2),
+                group=groups[i % len(groups)],
+                creator=users[i],
+            )
+            for i in range(count)
+        )
+
+    def get_cases(self):
+        server_serializer = model_serializer_factory(Server)
+        relation_serializer = model_serializer_factory(Server, enable_relation=True)
+        group_projection = compile_values_serializer(ServerGroupSerializer())
+        renderer = JSONRenderer()
+        servers = Server.objects.using(BENCH_DB).order_by('id')
+        groups = ServerGroup.objects.using(BENCH_DB).order_by('id')
+
+        def values_rows(size):
+            return list(servers.values()[:size])
+
+        return {
+            # case: (prepare(size) -> data, run(data))
+            'ServerGroupSerializer': (
+                lambda size: list(groups[:size]),
+                lambda data: ServerGroupSerializer(data, many=True).data,
+            ),
+            'ServerGroupSerializer (values)': (
+                lambda size: groups[:size],
+                lambda data: group_projection.to_representation(group_projection.values_list(data)),
+            ),
+            'model_serializer_factory(Server)': (
+                lambda size: list(servers[:size]),
+                lambda data: server_serializer(data, many=True).data,
+            ),
+            'model_serializer_factory(Server, enable_relation)': (
+                lambda size: list(
+                    servers.select_related('group', 'creator')
+                    .prefetch_related('creator__groups', 'creator__user_permissions')[:size]
+                ),
+                lambda data: relation_serializer(data, many=True).data,
+            ),
+            'CJsonEncoder': (
+                values_rows,
+                lambda data: json.dumps(data, cls=CJsonEncoder),
+            ),
+            'dumps_bytes': (
+                values_rows,
+                lambda data: json_utils.dumps_bytes(data),
+            ),
+            'Response envelope': (
+                lambda size: ServerGroupSerializer(list(groups[:size]), many=True).data,
+                lambda data: renderer.render(Response(data).data),
+            ),
+        }
+
+    def run_cases(self, sizes, repeat):
+        results = list()
+        for name, (prepare, run) in self.get_cases().items():
+            for size in sizes:
+                data = prepare(size)
+                timings = self._timings(lambda: run(data), repeat)
+                best = min(timings)
+                results.append({
+                    'case': name,
+                    'rows': size,
+                    'best_ms': round(best * 1000, 3),
+                    'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+                    'rows_per_second': round(size / best) if best else None,
+                })
+                self.stdout.write('%-52s %7d rows %11.3f ms' % (name, size, best * 1000))
+        return results
+
+    def compare(self, results, path, threshold):
+        with open(path) as f:
+            previous = {(item['case'], item['rows']): item for item in json.load(f)['results']}
+        regressions = list()
+        self.stdout.write(f'\nCompared with {path}')
+        for item in results:
+            old = previous.get((item['case'], item['rows']))
+            if not old or not old['best_ms']:
+                continue
+            ratio = item['best_ms'] / old['best_ms']
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  REGRESSION'
+                regressions.append(item)
+            self.stdout.write('%-52s %7d rows %11.3f ms  x%.2f%s' % (
+                item['case'], item['rows'], item['best_ms'], ratio, flag))
+        return regressions
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['sizes'])
+        self.setup_database()
+        self.stdout.write(f'Creating {sizes[-1]} rows of each model ...')
+        self.create_rows(sizes[-1])
+
+        results = self.run_cases(sizes, options['repeat'])
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'rest_framework': rest_framework.VERSION,
+            'orjson': json_utils.orjson is not None,
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if options['compare']:
+            regressions = self.compare(results, options['compare'], options['threshold'])
+            if regressions:
+                raise CommandError(f'{len(regressions)} case(s) slower than {options["compare"]}.')
@@ -0,0 +1,86 @@
+"""
+输入校验性能对比：DRF的校验与编译的校验（Server数据）
+
+python manage.py bench_validation --rows 1000
+"""
+import time
+
+from django.core.management import BaseCommand
+from rest_framework import serializers
+
+from common.serializers.compiled import CompiledValidationMixin
+from main.models import Server
+
+
+class StockServerSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Server
+        fields = ('name', 'description', 'ip_address', 'is_alive', 'group')
+
+
+class CompiledServerSerializer(CompiledValidationMixin, StockServerSerializer):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark compiled input validation against stock DRF validation.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=1000,
+            help='Number of payloads validated in one bulk request.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Repeat times of each case, the best one is reported.'
+        )
+
+    @staticmethod
+    def _best(func, repeat):
+        timings = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    @staticmethod
+    def _payloads(rows, invalid=False):
+        payloads = list()
+        for i in range(rows):
+            payload = {
+                'name': 'server%d' % i,
+                'description': 'synthetic server %d' % i,
+                'ip_address': '10.0.%d.%d' % (i // 256 % 256, i % 256),
+                'is_alive': bool(i % 2),
+                'group': None,
+            }
+            if invalid and i % 3 == 0:
+                payload.update(name='x' * 64, is_alive='maybe')
+            if invalid and i % 3 == 1:
+                del payload['ip_address']
+            payloads.append(payload)
+        return payloads
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+
+        # 错误信息必须一致
+        invalid = self._payloads(30, invalid=True)
+        stock, compiled = StockServerSerializer(data=invalid, many=True), \
+            CompiledServerSerializer(data=invalid, many=True)
+        stock.is_valid()
+        compiled.is_valid()
+        assert stock.errors == compiled.errors, 'compiled validation errors differ'
+
+        payloads = self._payloads(rows)
+        self.stdout.write(f'{rows} payloads, best of {repeat}')
+        baseline = None
+        for name, serializer_class in (('DRF', StockServerSerializer), ('compiled', CompiledServerSerializer)):
+            def validate():
+                serializer = serializer_class(data=payloads, many=True)
+                assert serializer.is_valid(), serializer.errors
+            seconds = self._best(validate, repeat)
+            baseline = baseline or seconds
+            self.stdout.write('%-10s %9.2f ms  %8.0f rows/s  x%.2f' % (
+                name, seconds * 1000, rows / seconds, baseline / seconds))
@@ -0,0 +1,61 @@
+"""
+各进程的缓存统计（需开启CACHE_METRICS）
+
+python manage.py cache_stats
+python manage.py cache_stats --json
+"""
+import json
+
+from django.core.management import BaseCommand
+
+from common.core.cache_metrics import collect
+
+
+class Command(BaseCommand):
+    help = 'Show cache hits, misses, sets and latency per namespace and model, aggregated over workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--json', action='store_true', default=False,
+            help='Print the raw aggregated result as JSON.'
+        )
+
+    @staticmethod
+    def percentile(latency, buckets, ratio):
+        """
+        耗时分布的近似分位数（桶的上界，毫秒）
+        """
+        total = sum(latency)
+        if not total:
+            return 0
+        count = 0
+        for bound, n in zip(buckets + [None], latency):
+            count += n
+            if count >= total * ratio:
+                return bound * 1000 if bound is not None else float('inf')
+
+    def handle(self, *args, **options):
+        result = collect()
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2, ensure_ascii=False))
+            return
+
+        buckets = result['buckets']
+        self.stdout.write('%-40s %10s %10s %8s %10s %10s %9s %9s' % (
+            'group', 'hits', 'misses', 'ratio', 'sets', 'deletes', 'p50 ms', 'p99 ms'))
+        for name, group in sorted(result['groups'].items()):
+            self.stdout.write('%-40s %10d %10d %7.1f%% %10d %10d %9.2f %9.2f' % (
+                name, group['hits'], group['misses'], group['hit_ratio'] * 100, group['sets'], group['deletes'],
+                self.percentile(group['latency'], buckets, 0.5), self.percentile(group['latency'], buckets, 0.99),
+            ))
+
+        self.stdout.write('\nIn-process tier')
+        for worker, stats in sorted(result['workers'].items()):
+            local = stats['local']
+            self.stdout.write('%-40s hit %5.1f%%  entries %7d  bytes %11d  evictions %7d' % (
+                worker, stats['hit_ratio'] * 100, local['entries'], local['bytes'], local['evictions']))
+
+        if result['redis']:
+            self.stdout.write('\nRedis')
+            for key, value in result['redis'].items():
+                self.stdout.write('%-40s %s' % (key, value))
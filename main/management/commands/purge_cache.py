@@ -0,0 +1,56 @@
+"""
+按命名空间、模型删除缓存（SCAN + UNLINK，不阻塞redis，不影响Celery的数据）
+
+python manage.py purge_cache --namespace compressed metrics
+python manage.py purge_cache --model main.Server main.ServerGroup
+python manage.py purge_cache --all --dry-run
+"""
+from django.core.management import BaseCommand, CommandError
+
+from common.core.cache_purge import NAMESPACES, get_patterns, purge
+
+
+class Command(BaseCommand):
+    help = 'Delete project cache keys by namespace or model with SCAN and pipelined UNLINK.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--namespace', nargs='+', default=[], choices=sorted(NAMESPACES),
+            help='Key namespaces to delete.'
+        )
+        parser.add_argument(
+            '--model', nargs='+', default=[],
+            help='Model labels (app_label.Model) whose cached rows, versions and locks are deleted.'
+        )
+        parser.add_argument(
+            '--all', action='store_true', default=False,
+            help='Delete all keys of this project (KEY_PREFIX), other data in the redis db is kept.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Keys per UNLINK command.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true', default=False,
+            help='Only count the matching keys.'
+        )
+
+    def progress(self, pattern, count):
+        self.stdout.write(f'  {pattern}: {count} keys ...')
+
+    def handle(self, *args, **options):
+        patterns = get_patterns(options['namespace'], options['model'], options['all'])
+        if not patterns:
+            raise CommandError('Specify --namespace, --model or --all.')
+        result = purge(
+            patterns, batch_size=options['batch_size'], dry_run=options['dry_run'], callback=self.progress
+        )
+        action = 'matched' if options['dry_run'] else 'deleted'
+        total_count = total_seconds = 0
+        for pattern, (count, seconds) in result.items():
+            total_count += count
+            total_seconds += seconds
+            self.stdout.write('%-50s %9d keys %s  %8.3f s  %10.0f keys/s' % (
+                pattern, count, action, seconds, count / seconds if seconds else 0))
+        self.stdout.write(self.style.SUCCESS('%d keys %s in %.3f s (%.0f keys/s)' % (
+            total_count, action, total_seconds, total_count / total_seconds if total_seconds else 0)))
@@ -1,3 +1,1603 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import io
+import json
+import os
+import pickle
+import queue
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+import zlib
+from collections import OrderedDict
+from configparser import NoOptionError, NoSectionError
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import MappingProxyType, SimpleNamespace
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core import validators
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db import connection, models, transaction
+from django.db.models import Count
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import isolate_apps
+from django.utils import translation
+from django.utils.decorators import method_decorator
+from django.utils.safestring import SafeString
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError as DRFValidationError
+from rest_framework.renderers import JSONRenderer as DRFJSONRenderer
+from rest_framework.test import APIRequestFactory
+from rest_framework.utils.serializer_helpers import ReturnList
+
+from apiv1.serializers.base import ServerGroupSerializer
+from apiv1.views.base import ListCreateServerGroup, RetrieveUpdateDestroyServerGroup
+from common.core.cache import TieredCache, estimate_size, tiered_cache
+from common.core.cache_metrics import WORKERS_KEY, CacheMetrics, InstrumentedCache, collect, instrument, key_namespace
+from common.core.cache_purge import get_patterns, purge
+from common.core.parsers import MessagePackParser
+from common.core.redis_cache import AdaptiveCompressor, AdaptiveSerializer
+from common.core.renderers import JSONRenderer, MessagePackRenderer
+from common.core.routers import ReplicaRouter, replica_reads, stick_to_primary
+from common.core.settings import BaseSection, BaseSettings
+from common.core.storage import BaseS3Storage
+from common.middleware import CompressionMiddleware
+from common.models.codec import ModelCodec
+from common.models.fields import DictField, ListField
+from common.models.managers import CacheManager, INSTANCE, LOCK_KEY, QUERYSET, VERSION_KEY, ResourceManager
+from common.serializers.compiled import MAX_SIGNATURES, CompiledValidationMixin, compile_values_serializer
+from common.serializers.fields import Base64ImageField
+from common.utils.json import JsonEncoder, RawJSON
+from common.utils.model import trans_objs_to_pks
+from common.validators import ListFieldValidator
+from common.views import generics
+from common.views.response import Response
+from main.models import Group, Server, ServerGroup, User
+
+
+class ReplicaRouterTests(TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        ReplicaRouter._lags.clear()
+        ServerGroup.objects.create(name='primary only')
+        self.user = User(pk=1, username='user1')
+
+    def test_reads_use_primary_by_default(self):
+        self.assertEqual(ServerGroup.objects.count(), 1)
+
+    def test_replica_reads(self):
+        with replica_reads(user=self.user) as use_replica:
+            self.assertTrue(use_replica)
+            self.assertEqual(ServerGroup.objects.count(), 0)
+        self.assertEqual(ServerGroup.objects.count(), 1)
+
+    def test_writes_use_primary(self):
+        with replica_reads():
+            ServerGroup.objects.create(name='written')
+        self.assertEqual(ServerGroup.objects.using('replica').count(), 0)
+        self.assertEqual(ServerGroup.objects.using('default').count(), 2)
+
+    def test_instance_read_from_replica_saved_to_primary(self):
+        ServerGroup.objects.using('replica').create(name='replicated')
+        with replica_reads():
+            group = ServerGroup.objects.get(name='replicated')
+            self.assertEqual(group._state.db, 'replica')
+            group.name = 'renamed'
+            group.save()
+        self.assertEqual(ServerGroup.objects.using('default').get(pk=group.pk).name, 'renamed')
+        self.assertEqual(ServerGroup.objects.using('replica').get(pk=group.pk).name, 'replicated')
+
+    def test_relation_between_primary_and_replica(self):
+        router = ReplicaRouter()
+        with replica_reads():
+            group = ServerGroup.objects.using('replica').create(name='replicated')
+        server = Server(name='server1', ip_address='10.0.0.1')
+        server._state.db = 'default'
+        self.assertTrue(router.allow_relation(server, group))
+        group._state.db = 'other'
+        self.assertIsNone(router.allow_relation(server, group))
+
+    def test_sticky_after_write(self):
+        stick_to_primary(self.user)
+        with replica_reads(user=self.user) as use_replica:
+            self.assertFalse(use_replica)
+            self.assertEqual(ServerGroup.objects.count(), 1)
+        # other users are not affected
+        with replica_reads(user=User(pk=2, username='user2')):
+            self.assertEqual(ServerGroup.objects.count(), 0)
+
+    def test_anonymous_user_not_sticky(self):
+        stick_to_primary(AnonymousUser())
+        with replica_reads(user=AnonymousUser()) as use_replica:
+            self.assertTrue(use_replica)
+
+    def test_lagging_replica_skipped(self):
+        with mock.patch.object(ReplicaRouter, 'get_replication_lag', return_value=10):
+            with replica_reads():
+                self.assertEqual(ServerGroup.objects.count(), 1)
+
+    def test_coroutines_isolated(self):
+        router = ReplicaRouter()
+        seen = dict()
+
+        async def request(name, use_replica):
+            if use_replica:
+                with replica_reads():
+                    await asyncio.sleep(0.01)
+                    seen[name] = router.db_for_read(ServerGroup)
+            else:
+                await asyncio.sleep(0.005)
+                seen[name] = router.db_for_read(ServerGroup)
+
+        async def main():
+            await asyncio.gather(request('replica', True), request('primary', False))
+
+        asyncio.run(main())
+        self.assertEqual(seen, {'replica': 'replica', 'primary': None})
+
+    def test_replication_lag_cached(self):
+        with mock.patch.object(ReplicaRouter, 'get_replication_lag', return_value=0) as get_lag:
+            with replica_reads():
+                ServerGroup.objects.count()
+                ServerGroup.objects.count()
+        get_lag.assert_called_once_with('replica')
+
+
+class SafeMethodsNonAtomicTests(TransactionTestCase):
+
+    class View(generics.APIView):
+        authentication_classes = ()
+        permission_classes = ()
+        in_atomic_block = None
+
+        def get(self, request):
+            type(self).in_atomic_block = connection.in_atomic_block
+            return Response()
+
+        def post(self, request):
+            type(self).in_atomic_block = connection.in_atomic_block
+            ServerGroup.objects.create(name='written')
+            if request.data.get('fail'):
+                raise RuntimeError('fail after write')
+            return Response()
+
+    @method_decorator(transaction.non_atomic_requests, name='dispatch')
+    class NonAtomicView(View):
+        pass
+
+    def request(self, view_class, method, data=None):
+        request = getattr(APIRequestFactory(), method)('/', data, format='json')
+        return view_class.as_view()(request)
+
+    def test_get_not_atomic(self):
+        self.request(self.View, 'get')
+        self.assertFalse(self.View.in_atomic_block)
+
+    def test_post_atomic_and_rolled_back(self):
+        self.request(self.View, 'post')
+        self.assertTrue(self.View.in_atomic_block)
+        with self.assertRaises(RuntimeError):
+            self.request(self.View, 'post', {'fail': True})
+        self.assertEqual(ServerGroup.objects.count(), 1)
+
+    def test_declared_non_atomic_respected(self):
+        self.assertIn('default', self.NonAtomicView.as_view()._non_atomic_requests)
+        self.request(self.NonAtomicView, 'post')
+        self.assertFalse(self.NonAtomicView.in_atomic_block)
+
+class JsonEncoderTests(SimpleTestCase):
+
+    def encode(self, obj, cls=JsonEncoder):
+        return json.loads(json.dumps(obj, cls=cls))
+
+    def test_types(self):
+        self.assertEqual(self.encode(timedelta(minutes=1, milliseconds=500)), '60.5')
+        self.assertEqual(self.encode(b'abc'), 'abc')
+        self.assertEqual(self.encode(Decimal('1.10')), '1.10')
+        self.assertEqual(self.encode(MappingProxyType({'a': 1})), {'a': 1})
+        self.assertEqual(self.encode({1, 2}), [1, 2])
+        self.assertEqual(self.encode(item for item in range(3)), [0, 1, 2])
+
+    def test_subclass_override(self):
+        class SecondsEncoder(JsonEncoder):
+            def encode_timedelta(self, obj):
+                return obj.total_seconds()
+
+        class MappingEncoder(JsonEncoder):
+            handlers = {**JsonEncoder.handlers, MappingProxyType: 'encode_iterable'}
+
+        self.assertEqual(self.encode(timedelta(seconds=3), SecondsEncoder), 3)
+        self.assertEqual(self.encode(MappingProxyType({'a': 1}), MappingEncoder), ['a'])
+        # 子类的查找结果不影响基类
+        self.assertEqual(self.encode(MappingProxyType({'a': 1})), {'a': 1})
+        self.assertEqual(self.encode(timedelta(seconds=3)), '3.0')
+
+
+class ValuesSerializerTests(TestCase):
+
+    class ServerSerializer(serializers.ModelSerializer):
+        class Meta:
+            model = Server
+            fields = '__all__'
+
+    class MethodFieldSerializer(serializers.ModelSerializer):
+        extra = serializers.SerializerMethodField()
+
+        class Meta:
+            model = ServerGroup
+            fields = ('id', 'extra')
+
+        def get_extra(self, obj):
+            return obj.pk
+
+    def setUp(self):
+        group = ServerGroup.objects.create(name='group1', description='desc')
+        Server.objects.create(name='server1', ip_address='10.0.0.1', group=group)
+        Server.objects.create(name='server2', ip_address='10.0.0.2', is_alive=True)
+
+    def assertSameData(self, serializer_class):
+        queryset = serializer_class.Meta.model.objects.all()
+        projection = compile_values_serializer(serializer_class(many=True))
+        self.assertIsNotNone(projection)
+        expected = [dict(item) for item in serializer_class(queryset, many=True).data]
+        self.assertEqual(projection.to_representation(projection.values_list(queryset)), expected)
+
+    def test_simple_fields(self):
+        self.assertSameData(ServerGroupSerializer)
+
+    def test_datetime_and_relation_fields(self):
+        self.assertSameData(self.ServerSerializer)
+
+    def test_unsupported_field_fallback(self):
+        self.assertIsNone(compile_values_serializer(self.MethodFieldSerializer()))
+
+    def test_context_dependent_fields(self):
+        class ContextSerializer(serializers.ModelSerializer):
+            class Meta:
+                model = ServerGroup
+                fields = ('id', 'created_at')
+
+            def get_fields(self):
+                fields = super().get_fields()
+                fields['created_at'] = serializers.DateTimeField(format=self.context.get('format'))
+                return fields
+
+        queryset = ServerGroup.objects.all()
+        for fmt in ('%Y', None, '%Y'):
+            serializer = ContextSerializer(queryset, many=True, context={'format': fmt})
+            projection = compile_values_serializer(serializer)
+            self.assertEqual(projection.to_representation(projection.values_list(queryset)),
+                             [dict(item) for item in serializer.data])
+        # 结果保存在类上，相同的配置只编译一次
+        self.assertEqual(len(ContextSerializer._values_projections), 2)
+        self.assertNotIn('_values_projections', serializers.ModelSerializer.__dict__)
+
+    def test_compiled_per_class_bounded(self):
+        class LimitSerializer(serializers.ModelSerializer):
+            class Meta:
+                model = ServerGroup
+                fields = ('id', 'name')
+
+            def get_fields(self):
+                fields = super().get_fields()
+                fields['name'] = serializers.CharField(max_length=self.context['max_length'])
+                return fields
+
+        for max_length in range(MAX_SIGNATURES + 5):
+            compile_values_serializer(LimitSerializer(context={'max_length': max_length + 1}))
+        self.assertLessEqual(len(LimitSerializer._values_projections), MAX_SIGNATURES)
+
+    def test_view_falls_back_for_changed_row_sets(self):
+        view = ListCreateServerGroup(request=None, format_kwarg=None, kwargs={})
+        view.request = APIRequestFactory().get('/')
+        queryset = ServerGroup.objects.all()
+        self.assertIsNotNone(view.get_values_projection(queryset))
+        for changed in (queryset.distinct(), queryset.annotate(servers=Count('server')),
+                        queryset.extra(select={'one': '1'}), queryset.union(queryset),
+                        queryset.values('id')):
+            self.assertIsNone(view.get_values_projection(changed))
+
+    @override_settings(REPLICA={'ALIASES': [], 'MAX_LAG': 0})
+    def test_list_view(self):
+        request = APIRequestFactory().get('/', {'page_size': 1})
+        responses = list()
+        for values_serializer in (True, False):
+            view = ListCreateServerGroup.as_view(
+                authentication_classes=(), permission_classes=(), values_serializer=values_serializer,
+                cache_response_seconds=0)
+            responses.append(view(request).render().content)
+        self.assertIn(b'group1', responses[0])
+        self.assertEqual(responses[0], responses[1])
+
+
+class JSONRendererTests(SimpleTestCase):
+
+    def setUp(self):
+        self.renderer = JSONRenderer()
+
+    def test_envelope(self):
+        data = {'name': '分组\u2028', 'count': Decimal('1.5')}
+        content = self.renderer.render(Response.format_data(data=data))
+        self.assertTrue(content.startswith(b'{"code":200,"msg":[],"data":'))
+        self.assertTrue(content.endswith(b'}}'))
+        self.assertIn(b'\\u2028', content)
+        self.assertEqual(json.loads(content), {'code': 200, 'msg': [], 'data': {'name': '分组\u2028', 'count': '1.5'}})
+        # msg不为空时不使用缓存的前缀
+        content = self.renderer.render(Response.format_data(status=400, msg=['错误']))
+        self.assertEqual(json.loads(content), {'code': 400, 'msg': ['错误'], 'data': {}})
+
+    def test_same_as_drf(self):
+        data = Response.format_data(data=[{'id': 1, 'name': 'a'}])
+        self.assertEqual(json.loads(self.renderer.render(data)), json.loads(DRFJSONRenderer().render(data)))
+
+    def test_pagination(self):
+        data = OrderedDict(count=1, next=None, previous=None, results=[{'id': 1}])
+        self.assertEqual(self.renderer.render(data), b'{"count":1,"next":null,"previous":null,"results":[{"id":1}]}')
+
+    def test_raw_json(self):
+        raw = RawJSON(b'{"id":1}')
+        self.assertEqual(self.renderer.render(raw), b'{"id":1}')
+        self.assertEqual(self.renderer.render(Response(raw).data), b'{"code":200,"msg":[],"data":{"id":1}}')
+        # 嵌套的RawJSON解码后重新编码
+        self.assertEqual(self.renderer.render({'data': raw}), b'{"data":{"id":1}}')
+
+
+class MessagePackTests(SimpleTestCase):
+
+    def setUp(self):
+        self.renderer = MessagePackRenderer()
+        self.parser = MessagePackParser()
+
+    def round_trip(self, data):
+        return self.parser.parse(io.BytesIO(self.renderer.render(data)))
+
+    def test_envelope(self):
+        data = Response.format_data(data=ReturnList(
+            [OrderedDict(id=1, price=Decimal('1.5'), tags=('a', 'b'))], serializer=None))
+        self.assertEqual(self.round_trip(data), {
+            'code': 200, 'msg': [], 'data': [{'id': 1, 'price': '1.5', 'tags': ['a', 'b']}]
+        })
+
+    def test_raw_json(self):
+        raw = RawJSON(b'{"id":1,"name":"\xe5\x88\x86\xe7\xbb\x84"}')
+        expected = {'id': 1, 'name': '分组'}
+        self.assertEqual(self.round_trip(raw), expected)
+        self.assertEqual(self.round_trip(Response(raw).data), {'code': 200, 'msg': [], 'data': expected})
+        # 嵌套的RawJSON不会被编码为二进制
+        self.assertEqual(self.round_trip({'items': [raw]}), {'items': [expected]})
+        self.assertEqual(self.round_trip({'file': b'\x00\x01'}), {'file': b'\x00\x01'})
+
+
+class CachedResponseTests(TestCase):
+
+    def setUp(self):
+        self.group = ServerGroup.objects.create(name='group1')
+        self.factory = APIRequestFactory()
+        self.options = dict(authentication_classes=(), permission_classes=(), cache_response_seconds=60)
+
+    def get(self, view_class, path, accept=None, **kwargs):
+        view = view_class.as_view(**self.options)
+        headers = {'HTTP_ACCEPT': accept} if accept else {}
+        response = view(self.factory.get(path, **headers), **kwargs)
+        response.accepted_renderer = JSONRenderer()
+        response.accepted_media_type = 'application/json'
+        response.renderer_context = {}
+        return response, response.render().content
+
+    @override_settings(REPLICA={'ALIASES': [], 'MAX_LAG': 0})
+    def test_list(self):
+        response, content = self.get(ListCreateServerGroup, '/?page_size=10')
+        self.assertFalse(getattr(response, 'cache_compressed', False))
+        with self.assertNumQueries(0):
+            cached, cached_content = self.get(ListCreateServerGroup, '/?page_size=10')
+        self.assertIsInstance(cached.data, RawJSON)
+        self.assertTrue(cached.cache_compressed)
+        self.assertEqual(cached_content, content)
+        self.assertEqual(json.loads(content)['results'][0]['name'], 'group1')
+        # 查询参数不同，key不同
+        with self.assertNumQueries(2):
+            self.get(ListCreateServerGroup, '/?page_size=5')
+        # 写入后失效
+        ServerGroup.objects.create(name='group2')
+        _, content = self.get(ListCreateServerGroup, '/?page_size=10')
+        self.assertEqual(json.loads(content)['count'], 2)
+
+    @override_settings(REPLICA={'ALIASES': [], 'MAX_LAG': 0})
+    def test_disabled_by_default(self):
+        self.options.pop('cache_response_seconds')
+        self.get(ListCreateServerGroup, '/')
+        with self.assertNumQueries(2):
+            self.get(ListCreateServerGroup, '/')
+
+    @override_settings(REPLICA={'ALIASES': [], 'MAX_LAG': 0})
+    def test_keyed_on_format_and_language(self):
+        self.get(ListCreateServerGroup, '/')
+        # 其他渲染器不使用缓存
+        for _ in range(2):
+            with self.assertNumQueries(2):
+                response = self.get(ListCreateServerGroup, '/', accept='application/msgpack')[0]
+            self.assertNotIsInstance(response.data, RawJSON)
+        # 媒体类型的参数不同
+        with self.assertNumQueries(2):
+            self.get(ListCreateServerGroup, '/', accept='application/json; indent=2')
+        with translation.override('zh-hans'), self.assertNumQueries(2):
+            self.get(ListCreateServerGroup, '/')
+        with self.assertNumQueries(0):
+            self.get(ListCreateServerGroup, '/')
+
+    @override_settings(REPLICA={'ALIASES': [], 'MAX_LAG': 0})
+    def test_retrieve(self):
+        _, content = self.get(RetrieveUpdateDestroyServerGroup, '/', pk=self.group.pk)
+        # 命中时仍获取对象（检查权限），不序列化
+        with self.assertNumQueries(1):
+            cached, cached_content = self.get(RetrieveUpdateDestroyServerGroup, '/', pk=self.group.pk)
+        self.assertIsInstance(cached.data['data'], RawJSON)
+        self.assertTrue(cached.cache_compressed)
+        self.assertEqual(cached_content, content)
+        self.group.name = 'renamed'
+        self.group.save()
+        _, content = self.get(RetrieveUpdateDestroyServerGroup, '/', pk=self.group.pk)
+        self.assertEqual(json.loads(content)['data']['name'], 'renamed')
+
+
+class CompressionMiddlewareTests(TestCase):
+
+    def setUp(self):
+        tiered_cache.clear()
+        self.middleware = CompressionMiddleware(lambda request: None)
+        self.factory = RequestFactory()
+        self.content = b'{"name":"group"}' * 200
+
+    def process(self, response, accept_encoding='gzip, deflate'):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return self.middleware.process_response(request, response)
+
+    def test_negotiate(self):
+        negotiate = self.middleware.negotiate
+        self.assertEqual(negotiate('gzip, deflate, br'), 'gzip')
+        self.assertEqual(negotiate('gzip;q=0.5, deflate'), 'deflate')
+        self.assertEqual(negotiate('br, *;q=0.1'), 'gzip')
+        self.assertIsNone(negotiate('gzip;q=0, identity'))
+        self.assertIsNone(negotiate(''))
+
+    def test_compress(self):
+        response = self.process(HttpResponse(self.content, headers={'ETag': '"abc"'}))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), self.content)
+        response = self.process(HttpResponse(self.content), accept_encoding='deflate')
+        self.assertEqual(zlib.decompress(response.content), self.content)
+
+    def test_skipped(self):
+        # 小于COMPRESSION_MIN_LENGTH
+        response = self.process(HttpResponse(b'{}'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        # 已压缩的格式
+        response = self.process(HttpResponse(self.content, content_type='image/png'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        # 已有Content-Encoding
+        response = self.process(HttpResponse(self.content, headers={'Content-Encoding': 'br'}))
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(response.content, self.content)
+        # 客户端不接受压缩，仍需要Vary
+        response = self.process(HttpResponse(self.content), accept_encoding='identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        # 压缩后没有变小
+        response = self.process(HttpResponse(os.urandom(2048)))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming(self):
+        chunks = list()
+
+        def content():
+            for i in range(3):
+                chunks.append(i)
+                yield self.content
+
+        response = self.process(StreamingHttpResponse(content(), headers={'Content-Length': '9600'}))
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        streaming = iter(response.streaming_content)
+        # 每块压缩后立即输出
+        first = next(streaming)
+        self.assertEqual(chunks, [0])
+        self.assertEqual(zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(first), self.content)
+        self.assertEqual(gzip.decompress(first + b''.join(streaming)), self.content * 3)
+
+    def test_async_streaming(self):
+        async def content():
+            for _ in range(3):
+                yield self.content
+
+        response = self.process(StreamingHttpResponse(content()))
+
+        async def consume():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        self.assertEqual(gzip.decompress(asyncio.run(consume())), self.content * 3)
+
+    @override_settings(REPLICA={'ALIASES': [], 'MAX_LAG': 0})
+    def test_cached_response_not_recompressed(self):
+        group = ServerGroup.objects.create(name='group', description='x' * 2000)
+        view = RetrieveUpdateDestroyServerGroup.as_view(
+            authentication_classes=(), permission_classes=(), cache_response_seconds=60)
+        bodies = list()
+        with mock.patch.object(self.middleware, 'compress', wraps=self.middleware.compress) as compress:
+            for _ in range(3):
+                response = view(self.factory.get('/'), pk=group.pk).render()
+                bodies.append(self.process(response).content)
+        # 第一次未命中响应缓存，第二次命中后压缩并缓存压缩结果，第三次直接使用
+        self.assertEqual(compress.call_count, 2)
+        self.assertEqual(len(set(bodies)), 1)
+        self.assertIn(b'group', gzip.decompress(bodies[0]))
+
+
+@isolate_apps('main')
+class JsonFieldTests(TransactionTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        class Document(models.Model):
+            tags = ListField(blank=True)
+            extra = DictField(null=True)
+
+            class Meta:
+                app_label = 'main'
+                db_table = 'test_json_document'
+
+        cls.Document = Document
+        with connection.schema_editor() as editor:
+            editor.create_model(Document)
+
+    @classmethod
+    def tearDownClass(cls):
+        with connection.schema_editor() as editor:
+            editor.delete_model(cls.Document)
+        super().tearDownClass()
+
+    def raw(self, pk):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tags, extra FROM test_json_document WHERE id = %s', [pk])
+            return cursor.fetchone()
+
+    def test_round_trip(self):
+        doc = self.Document.objects.create(tags=['a', '分组'], extra={'n': 1, 'd': Decimal('1.5')})
+        doc = self.Document.objects.get(pk=doc.pk)
+        self.assertEqual(doc.tags, ['a', '分组'])
+        self.assertEqual(doc.extra, {'n': 1, 'd': '1.5'})
+        # 存储格式与原来一致
+        self.assertEqual(self.raw(doc.pk), ('["a", "\\u5206\\u7ec4"]', '{"n": 1, "d": "1.5"}'))
+        self.assertEqual(self.Document.objects.create(tags=[], extra=None).extra, None)
+
+    def test_values(self):
+        doc = self.Document.objects.create(tags=[1, 2], extra={'a': None})
+        self.assertEqual(list(self.Document.objects.filter(pk=doc.pk).values('tags', 'extra')),
+                         [{'tags': [1, 2], 'extra': {'a': None}}])
+        self.assertEqual(list(self.Document.objects.filter(pk=doc.pk).values_list('tags', flat=True)), [[1, 2]])
+
+    def test_deferred(self):
+        doc = self.Document.objects.create(tags=['a'], extra={'a': 1})
+        doc = self.Document.objects.defer('extra').get(pk=doc.pk)
+        self.assertEqual(doc.get_deferred_fields(), {'extra'})
+        self.assertEqual(doc.extra, {'a': 1})
+
+    def test_save_without_change(self):
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO test_json_document (tags, extra) VALUES (%s, %s)',
+                           ['["b", "a"]', '{"z": 1, "a": [true, null]}'])
+            pk = cursor.lastrowid
+        stored = self.raw(pk)
+        doc = self.Document.objects.get(pk=pk)
+        doc.save()
+        self.assertEqual(self.raw(pk), stored)
+        doc.extra['a'].append(2)
+        doc.save()
+        self.assertEqual(self.raw(pk)[1], '{"z": 1, "a": [true, null, 2]}')
+
+    def test_value_to_string(self):
+        doc = self.Document(tags=['a', '分组'], extra={'n': '1'})
+        with mock.patch('json.loads') as loads:
+            for field in ('tags', 'extra'):
+                field = self.Document._meta.get_field(field)
+                self.assertEqual(field.value_to_string(doc), field.get_prep_value(field.value_from_object(doc)))
+        loads.assert_not_called()
+        # 字符串按JSON字符串编码，与保存时一致
+        doc.extra = '123'
+        self.assertEqual(self.Document._meta.get_field('extra').value_to_string(doc), '"123"')
+
+    def test_validator(self):
+        validator = ListFieldValidator()
+        for value in (['a'], '[1, 2]', 'null'):
+            validator(value)
+        for value in ({'a': 1}, '{"a": 1}', '[1', ''):
+            with self.assertRaises(ValidationError):
+                validator(value)
+
+
+class Base64ImageFieldTests(SimpleTestCase):
+
+    @staticmethod
+    def make_png(size=(8, 8), noise=False):
+        image = Image.new('RGB', size, 'red')
+        if noise:
+            image.putdata([tuple(os.urandom(3)) for _ in range(size[0] * size[1])])
+        output = io.BytesIO()
+        image.save(output, 'PNG')
+        return output.getvalue()
+
+    def decode(self, data, **kwargs):
+        field = Base64ImageField(**kwargs)
+        file = field.run_validation(data)
+        self.addCleanup(file.close)
+        file.seek(0)
+        return file, file.read()
+
+    def test_valid(self):
+        png = self.make_png()
+        encoded = base64.b64encode(png).decode()
+        for data in (encoded, 'data:image/png;base64,' + encoded):
+            file, content = self.decode(data)
+            self.assertEqual(content, png)
+            self.assertEqual(file.size, len(png))
+            self.assertTrue(file.name.endswith('.png'))
+
+    def test_whitespace_and_chunks(self):
+        png = self.make_png(noise=True)
+        encoded = base64.b64encode(png).decode()
+        # 按76个字符换行（MIME），并使分块边界落在4个字符的中间
+        wrapped = '\r\n'.join(encoded[i:i + 76] for i in range(0, len(encoded), 76))
+        with mock.patch.object(Base64ImageField, 'chunk_size', 10):
+            _, content = self.decode(wrapped)
+        self.assertEqual(content, png)
+
+    def test_invalid(self):
+        encoded = base64.b64encode(self.make_png()).decode()
+        for data in (encoded.rstrip('=') + 'A', encoded[:-4] + '!!!=', encoded[:10] + '*' + encoded[11:],
+                     base64.b64encode(b'not an image at all').decode(), 123):
+            with self.assertRaises((ValidationError, DRFValidationError)):
+                Base64ImageField().run_validation(data)
+        # 文件头不是允许的类型时不继续解码
+        class PNGField(Base64ImageField):
+            allowed_types = ('png',)
+
+        gif = base64.b64encode(b'GIF89a' + b'\x00' * 100).decode()
+        with self.assertRaises(ValidationError) as cm:
+            PNGField().run_validation(gif)
+        self.assertIn("couldn't be determined", str(cm.exception))
+
+    def test_max_size(self):
+        png = self.make_png(size=(64, 64), noise=True)
+        encoded = base64.b64encode(png).decode()
+        with self.assertRaises(ValidationError) as cm:
+            Base64ImageField(max_size=len(png) - 1).run_validation(encoded)
+        self.assertIn('too large', str(cm.exception))
+        _, content = self.decode(encoded, max_size=len(png))
+        self.assertEqual(content, png)
+
+    def test_large_upload_uses_temporary_file(self):
+        png = self.make_png(size=(64, 64), noise=True)
+        encoded = base64.b64encode(png).decode()
+        with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024):
+            file, content = self.decode(encoded)
+        self.assertIsInstance(file, TemporaryUploadedFile)
+        self.assertEqual(content, png)
+        file, _ = self.decode(base64.b64encode(self.make_png()).decode())
+        self.assertIsInstance(file, InMemoryUploadedFile)
+
+
+    def represent(self, storage, name, **kwargs):
+        field = Base64ImageField(represent_in_base64=True, **kwargs)
+        return field.to_representation(SimpleNamespace(storage=storage, name=name))
+
+    def test_representation_cache(self):
+        Base64ImageField.base64_cache.clear()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        png = self.make_png()
+        FileSystemStorage(location=root).save('a.png', ContentFile(png))
+        # 相同位置的不同存储实例共用缓存
+        with mock.patch.object(Base64ImageField, 'encode_file', side_effect=Base64ImageField.encode_file,
+                               autospec=True) as encode:
+            self.assertEqual(self.represent(FileSystemStorage(location=root), 'a.png'), base64.b64encode(png).decode())
+            self.represent(FileSystemStorage(location=root), 'a.png')
+            self.assertEqual(encode.call_count, 1)
+            # 不同位置的同名文件不共用
+            other = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, other)
+            FileSystemStorage(location=other).save('a.png', ContentFile(self.make_png(noise=True)))
+            self.represent(FileSystemStorage(location=other), 'a.png')
+            self.assertEqual(encode.call_count, 2)
+        # 大小相同的替换，修改时间不同
+        replaced = self.make_png(size=(8, 8), noise=True)
+        path = os.path.join(root, 'a.png')
+        with open(path, 'wb') as f:
+            f.write(replaced[:len(png)].ljust(len(png), b'\0'))
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        self.assertNotEqual(self.represent(FileSystemStorage(location=root), 'a.png'), base64.b64encode(png).decode())
+
+    def test_s3_version_cached(self):
+        Base64ImageField.version_cache.clear()
+        Base64ImageField.base64_cache.clear()
+        png = self.make_png()
+        storage = mock.Mock(spec=['meta', 'open', 'settings'])
+        storage.settings = SimpleNamespace(AWS_S3_ENDPOINT_URL='http://s3', AWS_S3_BUCKET_NAME='media',
+                                           AWS_S3_KEY_PREFIX='')
+        storage.meta.return_value = {'ETag': '"1"'}
+        storage.open.side_effect = lambda name, mode: io.BytesIO(png)
+        for _ in range(3):
+            self.assertEqual(self.represent(storage, 'a.png'), base64.b64encode(png).decode())
+        self.assertEqual(storage.meta.call_count, 1)
+        self.assertEqual(storage.open.call_count, 1)
+        # 过期后重新请求ETag
+        with mock.patch.object(Base64ImageField, 'version_timeout', 0):
+            Base64ImageField.version_cache.clear()
+            storage.meta.return_value = {'ETag': '"2"'}
+            self.represent(storage, 'a.png')
+            self.represent(storage, 'a.png')
+        self.assertEqual(storage.meta.call_count, 3)
+        self.assertEqual(storage.open.call_count, 2)
+
+class CompiledValidationTests(TestCase):
+
+    class StockSerializer(serializers.ModelSerializer):
+        class Meta:
+            model = Server
+            fields = ('name', 'description', 'ip_address', 'is_alive', 'group')
+
+    class CompiledSerializer(CompiledValidationMixin, StockSerializer):
+        pass
+
+    payloads = [
+        {'name': ' server1 ', 'ip_address': '10.0.0.1', 'is_alive': True, 'group': None},
+        {'name': 'x' * 64, 'ip_address': '', 'is_alive': 'maybe'},
+        {'name': 'a\x00b', 'description': ['not', 'a', 'string'], 'ip_address': 1},
+        {'name': None, 'ip_address': '10.0.0.2', 'is_alive': 'true'},
+    ]
+
+    def assertSameResult(self, **kwargs):
+        stock = self.StockSerializer(**kwargs)
+        compiled = self.CompiledSerializer(**kwargs)
+        self.assertEqual(stock.is_valid(), compiled.is_valid())
+        self.assertEqual(stock.errors, compiled.errors)
+        if not stock.errors:
+            self.assertEqual(stock.validated_data, compiled.validated_data)
+
+    def test_valid(self):
+        self.assertSameResult(data=self.payloads[0])
+
+    def test_errors(self):
+        for payload in self.payloads[1:]:
+            self.assertSameResult(data=payload)
+
+    def test_many(self):
+        self.assertSameResult(data=self.payloads, many=True)
+
+    def test_partial(self):
+        self.assertSameResult(data={'name': 'server2'}, partial=True)
+
+    def test_context_dependent_fields(self):
+        class ContextSerializer(CompiledValidationMixin, serializers.ModelSerializer):
+            class Meta:
+                model = Server
+                fields = ('name', 'ip_address')
+
+            def get_fields(self):
+                fields = super().get_fields()
+                fields['name'] = serializers.CharField(max_length=self.context['max_length'])
+                return fields
+
+        data = {'name': 'server1', 'ip_address': '10.0.0.1'}
+        self.assertTrue(ContextSerializer(data=data, context={'max_length': 32}).is_valid())
+        serializer = ContextSerializer(data=data, context={'max_length': 4})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['name'][0].code, 'max_length')
+        self.assertEqual(len(ContextSerializer._compiled_validators), 2)
+
+
+    class FieldsSerializer(serializers.Serializer):
+        name = serializers.CharField(max_length=8, min_length=2)
+        blank = serializers.CharField(allow_blank=True, required=False, trim_whitespace=False)
+        nullable = serializers.CharField(allow_null=True, required=False, validators=[validators.MaxLengthValidator(3)])
+        email = serializers.EmailField(required=False)
+        slug = serializers.SlugField(required=False)
+        count = serializers.IntegerField(min_value=0, max_value=10, required=False)
+        bounded = serializers.IntegerField(
+            required=False, validators=[validators.MinValueValidator(2), validators.MaxValueValidator(5)])
+        flag = serializers.BooleanField(required=False)
+        flag_limited = serializers.BooleanField(required=False, validators=[validators.MaxValueValidator(False)])
+        level = serializers.ChoiceField(
+            choices=[(1, 'a'), (5, 'b'), (20, 'c')], required=False, validators=[validators.MaxValueValidator(10)])
+        kind = serializers.ChoiceField(
+            choices=['x', 'yy', 'zzz'], allow_blank=True, required=False, validators=[validators.MaxLengthValidator(2)])
+
+    class CompiledFieldsSerializer(CompiledValidationMixin, FieldsSerializer):
+        pass
+
+    def test_parity_with_drf(self):
+        values = [None, '', ' ', 'a', 'ab', ' abc ', 'abcdefghij', 'a\x00b', '\ud800x', 'x@y.com', 'bad email', 'a-b',
+                  0, 1, 2, 5, 10, 11, 20, -1, True, False, 1.5, '5', '20', 'x', 'yy', 'zzz', [], {}, 'true']
+        names = list(self.FieldsSerializer._declared_fields)
+        rng = random.Random(0)
+        for _ in range(500):
+            data = {name: rng.choice(values) for name in names if rng.random() < 0.8}
+            stock = self.FieldsSerializer(data=data)
+            compiled = self.CompiledFieldsSerializer(data=data)
+            self.assertEqual(stock.is_valid(), compiled.is_valid(), data)
+            self.assertEqual(stock.errors, compiled.errors, data)
+            if not stock.errors:
+                self.assertEqual(stock.validated_data, compiled.validated_data, data)
+
+    @isolate_apps('main')
+    def test_model_choices_with_validators(self):
+        class Task(models.Model):
+            level = models.IntegerField(choices=[(1, 'low'), (20, 'high')], validators=[validators.MaxValueValidator(10)])
+
+            class Meta:
+                app_label = 'main'
+
+        class TaskSerializer(serializers.ModelSerializer):
+            class Meta:
+                model = Task
+                fields = ('level',)
+
+        class CompiledTaskSerializer(CompiledValidationMixin, TaskSerializer):
+            pass
+
+        for level in (1, 20):
+            stock, compiled = TaskSerializer(data={'level': level}), CompiledTaskSerializer(data={'level': level})
+            self.assertEqual(stock.is_valid(), compiled.is_valid())
+            self.assertEqual(stock.errors, compiled.errors)
+        self.assertIn('level', compiled.errors)
+
+class CacheManagerTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if not hasattr(ServerGroup, 'cached'):
+            CacheManager().contribute_to_class(ServerGroup, 'cached')
+
+    def setUp(self):
+        tiered_cache.clear()
+        self.group = ServerGroup.objects.create(name='group1')
+
+    def test_get_hit_runs_no_query(self):
+        ServerGroup.cached.get(pk=self.group.pk)
+        with self.assertNumQueries(0):
+            instance = ServerGroup.cached.get(pk=self.group.pk)
+        self.assertEqual(instance, self.group)
+        self.assertEqual(instance.name, 'group1')
+        self.assertFalse(instance._state.adding)
+
+    def test_filter_caches_evaluated_rows(self):
+        list(ServerGroup.cached.filter(name='group1'))
+        with self.assertNumQueries(0):
+            self.assertEqual(list(ServerGroup.cached.filter(name='group1', use_cache=True)), [self.group])
+
+    def test_chained_queryset_not_cached(self):
+        ServerGroup.cached.all().count()
+        self.assertEqual(ServerGroup.cached.all().filter(name='other').count(), 0)
+        with self.assertNumQueries(1):
+            list(ServerGroup.cached.all(use_cache=True))
+
+    def test_write_during_query_not_cached_as_current(self):
+        fetch_all = models.QuerySet._fetch_all
+
+        def fetch_then_write(queryset):
+            if queryset._result_cache is not None:
+                return
+            fetch_all(queryset)
+            # 读取行之后、写入缓存之前，其他请求写入
+            ServerGroup.objects.filter(pk=self.group.pk).update(name='renamed')
+            ServerGroup.cached.invalidate()
+
+        with mock.patch.object(models.QuerySet, '_fetch_all', fetch_then_write):
+            list(ServerGroup.cached.filter(pk=self.group.pk))
+        with self.assertNumQueries(1):
+            self.assertEqual([g.name for g in ServerGroup.cached.filter(pk=self.group.pk, use_cache=True)], ['renamed'])
+
+    def test_save_and_delete_invalidate(self):
+        ServerGroup.cached.get(pk=self.group.pk)
+        self.group.name = 'renamed'
+        self.group.save()
+        self.assertEqual(ServerGroup.cached.get(pk=self.group.pk).name, 'renamed')
+        list(ServerGroup.cached.all())
+        self.group.delete()
+        self.assertEqual(list(ServerGroup.cached.all(use_cache=True)), [])
+
+    def test_get_many(self):
+        other = ServerGroup.objects.create(name='group2')
+        ServerGroup.cached.get(pk=self.group.pk)
+        with self.assertNumQueries(1):
+            result = ServerGroup.cached.get_many([self.group.pk, other.pk, 0])
+        self.assertEqual(result, {self.group.pk: self.group, other.pk: other})
+        with self.assertNumQueries(0):
+            self.assertEqual(ServerGroup.cached.get(pk=other.pk).name, 'group2')
+        # 不存在的0也已缓存
+        with self.assertNumQueries(0):
+            self.assertEqual(trans_objs_to_pks([0, other.pk, self.group.pk], ServerGroup, True), [other.pk, self.group.pk])
+
+    def test_get_many_backfills_keys_built_before_query(self):
+        in_bulk = models.QuerySet.in_bulk
+
+        def fetch_then_write(queryset, *args, **kwargs):
+            result = in_bulk(queryset, *args, **kwargs)
+            ServerGroup.objects.filter(pk=self.group.pk).update(name='renamed')
+            ServerGroup.cached.invalidate()
+            return result
+
+        with mock.patch.object(models.QuerySet, 'in_bulk', fetch_then_write), \
+                mock.patch.object(ServerGroup.cached, '_makeup_key', wraps=ServerGroup.cached._makeup_key) as makeup:
+            ServerGroup.cached.get_many([self.group.pk])
+        self.assertEqual(makeup.call_count, 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(ServerGroup.cached.get(pk=self.group.pk).name, 'renamed')
+
+    def test_expired_entry_refreshed_by_lock_holder(self):
+        ServerGroup.cached.get(pk=self.group.pk)
+        key = ServerGroup.cached._makeup_key(INSTANCE, pk=self.group.pk)
+        rows, expires_at, delta = tiered_cache.get(key)
+        self.assertLessEqual(expires_at, time.time() + ServerGroup.cached.cache_seconds)
+        tiered_cache.set(key, (rows, time.time() - 1, delta))
+        # 其他进程正在刷新，返回旧值
+        tiered_cache.add(LOCK_KEY % key, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(ServerGroup.cached.get(pk=self.group.pk), self.group)
+        tiered_cache.delete(LOCK_KEY % key)
+        with self.assertNumQueries(1):
+            ServerGroup.cached.get(pk=self.group.pk)
+        self.assertGreater(tiered_cache.get(key)[1], time.time())
+        self.assertIsNone(tiered_cache.get(LOCK_KEY % key))
+
+    def test_missing_row_cached_until_created(self):
+        for _ in range(2):
+            with self.assertRaises(ServerGroup.DoesNotExist):
+                ServerGroup.cached.get(name='group2')
+        with self.assertNumQueries(0), self.assertRaises(ServerGroup.DoesNotExist):
+            ServerGroup.cached.get(name='group2')
+        other = ServerGroup.objects.create(name='group2')
+        self.assertEqual(ServerGroup.cached.get(name='group2'), other)
+        self.assertEqual(ServerGroup.cached.get_many([0]), {})
+        with self.assertNumQueries(0):
+            self.assertEqual(ServerGroup.cached.get_many([0]), {})
+
+    def test_entry_of_other_schema_rejected(self):
+        ServerGroup.cached.get(pk=self.group.pk)
+        key = ServerGroup.cached._makeup_key(INSTANCE, pk=self.group.pk)
+        (fingerprint, rows), expires_at, delta = tiered_cache.get(key)
+        self.assertEqual(fingerprint, ModelCodec(ServerGroup).fingerprint)
+        self.assertNotEqual(fingerprint, ModelCodec(Server).fingerprint)
+        tiered_cache.set(key, (('old', rows), expires_at, delta))
+        with self.assertNumQueries(1):
+            self.assertEqual(ServerGroup.cached.get(pk=self.group.pk), self.group)
+
+    def test_long_key_hashed(self):
+        key = ServerGroup.cached._makeup_key(QUERYSET, name__in=['x' * 50] * 10)
+        self.assertLess(len(key), 100)
+
+
+class RelatedCacheTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if not hasattr(Server, 'cached'):
+            CacheManager(select_related=('group', 'creator'), depends_on=('main.User_groups',)).contribute_to_class(
+                Server, 'cached')
+
+    def setUp(self):
+        tiered_cache.clear()
+        self.group = ServerGroup.objects.create(name='group1')
+        self.server = Server.objects.create(name='server1', ip_address='10.0.0.1', group=self.group)
+
+    def test_related_instances_cached(self):
+        Server.cached.get(pk=self.server.pk)
+        with self.assertNumQueries(0):
+            server = Server.cached.get(pk=self.server.pk)
+            self.assertEqual(server.group.name, 'group1')
+            self.assertIsNone(server.creator)
+        list(Server.cached.all())
+        with self.assertNumQueries(0):
+            self.assertEqual([s.group for s in Server.cached.all(use_cache=True)], [self.group])
+
+    def test_get_many_caches_related_instances(self):
+        with self.assertNumQueries(1):
+            servers = Server.cached.get_many([self.server.pk])
+            self.assertEqual(servers[self.server.pk].group.name, 'group1')
+        with self.assertNumQueries(0):
+            server = Server.cached.get(pk=self.server.pk)
+            self.assertEqual(server.group.name, 'group1')
+            self.assertIsNone(server.creator)
+
+    def test_dependency_write_invalidates(self):
+        Server.cached.get(pk=self.server.pk)
+        self.group.name = 'renamed'
+        self.group.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(Server.cached.get(pk=self.server.pk).group.name, 'renamed')
+        user = User.objects.create(username='user1')
+        Server.cached.get(pk=self.server.pk)
+        user.groups.add(Group.objects.create(name='auth group'))
+        with self.assertNumQueries(1):
+            Server.cached.get(pk=self.server.pk)
+
+
+class TieredCacheTests(TestCase):
+
+    class Redis(object):
+        """
+        只实现publish和pubsub，每个订阅者一个队列
+        """
+
+        def __init__(self):
+            self.queues = list()
+
+        def publish(self, channel, data):
+            for messages in self.queues:
+                messages.put({'type': 'message', 'data': data})
+
+        def pubsub(self, ignore_subscribe_messages=False):
+            messages = queue.Queue()
+            pubsub = mock.Mock()
+            pubsub.subscribe.side_effect = lambda channel: self.queues.append(messages)
+            pubsub.listen.side_effect = lambda: iter(messages.get, None)
+            return pubsub
+
+    def setUp(self):
+        cache.clear()
+        self.cache = TieredCache(MAX_ENTRIES=2)
+
+    def test_local_hit_skips_remote(self):
+        self.cache.set('a', 1)
+        with mock.patch.object(cache, 'get') as remote_get:
+            self.assertEqual(self.cache.get('a'), 1)
+        remote_get.assert_not_called()
+        self.assertEqual(self.cache.stats()['local']['hits'], 1)
+
+    def test_remote_hit_fills_local(self):
+        cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        stats = self.cache.stats()
+        self.assertEqual((stats['local']['hits'], stats['remote']['hits'], stats['remote']['misses']), (1, 1, 1))
+
+    def test_local_bounded_by_entries(self):
+        for key in 'abc':
+            self.cache.set(key, key)
+        self.assertEqual(len(self.cache.local), 2)
+        self.assertEqual(self.cache.get('a'), 'a')
+
+    def test_invalidation_message(self):
+        self.cache.set('a', 1)
+        cache.set('a', 2)
+        self.cache._handle_message('{"token": "%s", "keys": ["a"]}' % self.cache._token)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.cache._handle_message('{"token": "other", "keys": ["a"]}')
+        self.assertEqual(self.cache.get('a'), 2)
+
+    @staticmethod
+    def wait_for(condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, 'timed out'
+            time.sleep(0.01)
+
+    def test_pubsub_invalidation(self):
+        redis = self.Redis()
+        other = TieredCache()
+        with mock.patch.object(TieredCache, '_redis', return_value=redis):
+            self.cache._ensure_listener()
+            other._ensure_listener()
+            self.wait_for(lambda: len(redis.queues) == 2)
+            other.set('a', 1)
+            self.assertEqual(self.cache.get('a'), 1)
+            self.assertIsNotNone(self.cache.local.get('a'))
+            # 其他进程写入后，本进程的进程内缓存被删除
+            other.set('a', 2)
+            self.wait_for(lambda: self.cache.local.get('a') is None)
+            self.assertEqual(self.cache.get('a'), 2)
+            self.assertEqual(other.get('a'), 2)
+
+    def test_clear_keeps_other_keys(self):
+        unlinked = list()
+        redis = mock.Mock()
+        redis.scan_iter.return_value = iter([b':1:a'])
+        redis.pipeline.side_effect = lambda transaction: PurgeCacheTests.Pipeline(unlinked)
+        self.cache.set('a', 1)
+        with mock.patch.object(TieredCache, '_redis', return_value=redis), \
+                mock.patch('django_redis.get_redis_connection', return_value=redis), \
+                mock.patch.object(cache, 'clear') as remote_clear:
+            self.cache.clear()
+        remote_clear.assert_not_called()
+        redis.flushdb.assert_not_called()
+        self.assertEqual(redis.scan_iter.call_args.kwargs['match'], cache.make_key('*', version='*'))
+        self.assertEqual(unlinked, [b':1:a'])
+        self.assertEqual(len(self.cache.local), 0)
+        self.assertIn('"clear": true', redis.publish.call_args.args[1])
+
+    def test_local_size_counts_nested_values(self):
+        self.cache.set('a', [[['x' * 10000]]])
+        self.assertGreater(self.cache.local.total_bytes, 10000)
+        # 按抽样的元素外推，不序列化
+        rows = [(i, 'x' * 100, {'n': i}) for i in range(1000)]
+        actual = sys.getsizeof(rows) + sum(
+            sys.getsizeof(row) + sum(sys.getsizeof(item) for item in row) + sys.getsizeof('n') + sys.getsizeof(row[0])
+            for row in rows
+        )
+        with mock.patch('pickle.dumps') as dumps:
+            estimated = estimate_size(rows)
+        dumps.assert_not_called()
+        self.assertLess(abs(estimated - actual), actual * 0.2)
+
+
+class CacheMetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.metrics = CacheMetrics()
+        self.cache = InstrumentedCache(cache, 'main.ServerGroup', self.metrics)
+
+    def test_disabled_returns_backend(self):
+        self.assertIs(instrument(cache), cache)
+        with self.settings(CACHE_METRICS=True):
+            self.assertIsInstance(instrument(cache), InstrumentedCache)
+
+    def test_records_per_namespace_and_model(self):
+        self.cache.get('I:a')
+        self.cache.set('I:a', 1)
+        self.assertEqual(self.cache.get('I:a'), 1)
+        self.assertEqual(self.cache.get_many(['I:a', 'I:b']), {'I:a': 1})
+        self.cache.delete('I:a')
+        for name in ('namespace:I', 'model:main.ServerGroup'):
+            group = self.metrics.groups[name]
+            self.assertEqual([group[event] for event in ('hits', 'misses', 'sets', 'deletes')], [2, 2, 1, 1])
+            # get_many的hits、misses只记录一次耗时
+            self.assertEqual(sum(group['latency']), 5)
+
+    def test_internal_keys_have_own_namespaces(self):
+        self.assertEqual(key_namespace('I:main.Server:1:pk.1'), 'I')
+        self.assertEqual(key_namespace(VERSION_KEY % 'main.Server'), 'cache:version')
+        self.assertEqual(key_namespace(LOCK_KEY % 'I:main.Server:1:pk.1'), 'cache:lock')
+        self.assertEqual(key_namespace(WORKERS_KEY), 'cache:metrics')
+        self.assertEqual(key_namespace(1), '1')
+
+    def test_flush_in_background(self):
+        flushed = threading.Event()
+        threads = list()
+        metrics = CacheMetrics(flush_interval=0)
+
+        def flush():
+            threads.append(threading.current_thread())
+            flushed.set()
+
+        with mock.patch.object(metrics, 'flush', side_effect=flush):
+            InstrumentedCache(cache, metrics=metrics).get('I:a')
+            self.assertTrue(flushed.wait(5))
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_workers_registered_in_redis_hash(self):
+        redis = mock.Mock()
+        key = cache.make_key(WORKERS_KEY)
+        redis.hgetall.return_value = {b'old': b'0', self.metrics.worker.encode(): str(time.time()).encode()}
+        with mock.patch('common.core.cache_metrics._redis', return_value=redis):
+            self.metrics.flush()
+        self.assertEqual(redis.hset.call_args.args[:2], (key, self.metrics.worker))
+        redis.hdel.assert_called_once_with(key, 'old')
+
+    def test_collect_aggregates_flushed_workers(self):
+        self.cache.get('Q:a')
+        self.metrics.flush()
+        other = CacheMetrics()
+        other.worker = 'other'
+        InstrumentedCache(cache, metrics=other).get('Q:b')
+        other.flush()
+        self.assertEqual(collect()['groups']['namespace:Q']['misses'], 2)
+
+
+class BulkUpsertTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if not hasattr(Server, 'resources'):
+            ResourceManager().contribute_to_class(Server, 'resources')
+
+    def test_insert_then_update(self):
+        group = ServerGroup.objects.create(name='group1')
+        rows = [{'id': i, 'name': f'server{i}', 'ip_address': f'10.0.0.{i}', 'group_id': group.pk, 'unknown': 1}
+                for i in range(1, 4)]
+        self.assertEqual(Server.resources.bulk_upsert(rows, ['id'], batch_size=2), 3)
+        created_at = Server.objects.get(pk=1).created_at
+        rows[0].update(name='renamed', is_alive=True)
+        with self.assertNumQueries(1):
+            Server.resources.bulk_upsert(rows[:2], ['id'])
+        server = Server.objects.get(pk=1)
+        self.assertEqual((server.name, server.is_alive, server.created_at), ('renamed', True, created_at))
+        self.assertEqual(Server.objects.count(), 3)
+
+
+class RedisCacheCodecTests(TestCase):
+
+    def setUp(self):
+        self.compressor = AdaptiveCompressor({})
+        self.serializer = AdaptiveSerializer({})
+
+    def test_compressor(self):
+        small, large, random = b'x' * 10, b'x' * 100000, os.urandom(1000)
+        self.assertEqual(self.compressor.compress(small), b'\x00' + small)
+        self.assertLess(len(self.compressor.compress(large)), 1000)
+        self.assertEqual(len(self.compressor.compress(random)), 1001)
+        for value in (small, large, random):
+            self.assertEqual(self.compressor.decompress(self.compressor.compress(value)), value)
+        # ZlibCompressor写入的旧数据
+        self.assertEqual(self.compressor.decompress(zlib.compress(large)), large)
+
+    def test_serializer(self):
+        values = (True, 'not-found', {'a': [1, 2.5, None]}, [{'id': 1}], (1, 'a'), SafeString('[]'), b'\x80')
+        for value in values:
+            loaded = self.serializer.loads(self.serializer.dumps(value))
+            self.assertEqual(loaded, value)
+            self.assertIs(type(loaded), type(value))
+        self.assertEqual(self.serializer.dumps({'a': 1})[:1], b'm')
+        self.assertEqual(self.serializer.loads(pickle.dumps({'a': 1})), {'a': 1})
+
+
+class PurgeCacheTests(TestCase):
+
+    class Pipeline(list):
+
+        def __init__(self, unlinked):
+            super().__init__()
+            self.unlinked = unlinked
+
+        def unlink(self, *keys):
+            self.append(keys)
+
+        def execute(self):
+            self.unlinked.extend(key for keys in self for key in keys)
+            self.clear()
+
+    def test_patterns(self):
+        self.assertEqual(get_patterns(everything=True), ['*'])
+        self.assertEqual(get_patterns(['compressed']), ['compressed:*'])
+        self.assertIn('cache:version:main.Server', get_patterns(models=['main.Server']))
+        self.assertIn(WORKERS_KEY, get_patterns(['metrics']))
+
+    def test_purge_unlinks_in_batches(self):
+        keys = [b'key%d' % i for i in range(1234)]
+        unlinked = list()
+        redis = mock.Mock()
+        redis.scan_iter.return_value = iter(keys)
+        redis.pipeline.side_effect = lambda transaction: self.Pipeline(unlinked)
+        with mock.patch('django_redis.get_redis_connection', return_value=redis):
+            result = purge(['I:*'], batch_size=100, pipeline_size=3)
+        self.assertEqual(result['I:*'][0], 1234)
+        self.assertEqual(unlinked, keys)
+        self.assertEqual(redis.scan_iter.call_args.kwargs['match'], cache.make_key('I:*', version='*'))
+
+
+class ProjectSettingsTests(TestCase):
+
+    class Security(BaseSection):
+        password_level: str
+        password_min_length: int
+        strict: bool
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'settings.ini')
+        self.write('low', '6', 'true')
+
+        class Settings(BaseSettings):
+            path = self.path
+            security = self.Security()
+
+        self.settings = Settings()
+
+    def write(self, level, length, strict, mtime=None):
+        with open(self.path, 'w') as f:
+            f.write(f'[Security]\npassword_level = {level}\npassword_min_length = {length}\nstrict = {strict}\n')
+        if mtime:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_typed_snapshot(self):
+        security = self.settings.security
+        self.assertEqual((security.password_level, security.password_min_length, security.strict), ('low', 6, True))
+        with self.assertRaises(NoOptionError):
+            security.undefined
+
+    def test_validated_up_front(self):
+        self.write('low', 'six', 'maybe')
+        with self.assertRaises(ImproperlyConfigured) as cm:
+            self.settings.reload()
+        self.assertIn('password_min_length', str(cm.exception))
+        self.assertIn('strict', str(cm.exception))
+        # 保留原配置
+        self.assertEqual(self.settings.security.password_min_length, 6)
+
+    def test_reload_on_mtime_change(self):
+        self.assertFalse(self.settings.reload_if_changed())
+        self.write('high', '12', 'false', mtime=time.time() + 10)
+        self.assertTrue(self.settings.reload_if_changed())
+        self.assertEqual((self.settings.security.password_level, self.settings.security.strict), ('high', False))
+        self.write('high', 'x', 'false', mtime=time.time() + 20)
+        with self.assertLogs('common.core.settings', 'ERROR'):
+            self.assertFalse(self.settings.reload_if_changed())
+        self.assertEqual(self.settings.security.password_min_length, 12)
+
+
+    def test_missing_section_reported_at_load(self):
+        class Replica(BaseSection):
+            hosts: str
+
+        class Redis(BaseSection):
+            host: str
+
+        class Settings(BaseSettings):
+            path = self.path
+            security = self.Security()
+            redis = Redis()
+
+        with self.assertRaises(ImproperlyConfigured) as cm:
+            Settings()
+        self.assertIn('[Redis]: missing section', str(cm.exception))
+
+        class OptionalSettings(BaseSettings):
+            path = self.path
+            security = self.Security()
+            replica = Replica(required=False)
+
+        with self.assertRaises(NoSectionError):
+            OptionalSettings().replica.hosts
+
+    def test_reload_if_changed_holds_lock(self):
+        load = self.settings._load
+        held = list()
+
+        def locked_load():
+            held.append(self.settings._lock.locked())
+            return load()
+
+        self.write('high', '12', 'false', mtime=time.time() + 10)
+        with mock.patch.object(self.settings, '_load', side_effect=locked_load):
+            self.assertTrue(self.settings.reload_if_changed())
+        self.assertEqual(held, [True])
+
+    def watch(self, **kwargs):
+        with mock.patch.object(BaseSettings, '_watch'), \
+                mock.patch('os.register_at_fork') as register_at_fork:
+            self.settings.watch(**kwargs)
+        return register_at_fork
+
+    def test_watch_without_sighup(self):
+        with mock.patch('signal.signal') as set_signal:
+            register_at_fork = self.watch()
+        set_signal.assert_not_called()
+        # fork出的子进程中重新启动后台线程
+        register_at_fork.assert_called_once_with(after_in_child=self.settings._after_fork)
+        with mock.patch.object(BaseSettings, '_watch'):
+            self.settings._after_fork()
+        self.assertIsNotNone(self.settings._watcher)
+        self.assertFalse(self.settings._reload_requested.is_set())
+
+    def test_sighup_chains_python_handler(self):
+        previous = mock.Mock()
+        with mock.patch('signal.getsignal', return_value=previous), mock.patch('signal.signal') as set_signal:
+            self.watch(sighup=True)
+        handler = set_signal.call_args.args[1]
+        handler(signal.SIGHUP, None)
+        previous.assert_called_once_with(signal.SIGHUP, None)
+        self.assertTrue(self.settings._reload_requested.is_set())
+
+    def test_sighup_keeps_non_python_handler(self):
+        with mock.patch('signal.getsignal', return_value=None), mock.patch('signal.signal') as set_signal, \
+                self.assertLogs('common.core.settings', 'WARNING'):
+            self.watch(sighup=True)
+        set_signal.assert_not_called()
+
+class S3StandIn(ThreadingHTTPServer):
+    """
+    测试用的本地S3：只支持路径形式的PutObject、分段上传和GetObject，不校验签名
+
+    请求体按64KB写入临时目录，不占用测试进程的内存
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), S3StandInHandler)
+        self.directory = tempfile.mkdtemp()
+        self.uploads = dict()  # {upload_id: {part_number: 路径}}
+        self.objects = dict()  # {key: 路径}
+        self.parts = list()  # 收到的分段的大小
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint_url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def read(self, key):
+        with open(self.objects[key], 'rb') as f:
+            return f.read()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self.directory)
+
+
+class S3StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body_chunks(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            yield from self._decode_chunked()
+            return
+        if 'aws-chunked' in self.headers.get('Content-Encoding', ''):
+            yield from self._decode_chunked()
+            return
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 64 * 1024))
+            remaining -= len(chunk)
+            yield chunk
+
+    def _decode_chunked(self):
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if not size:
+                # 校验和trailer
+                while self.rfile.readline().strip():
+                    pass
+                return
+            while size:
+                chunk = self.rfile.read(min(size, 64 * 1024))
+                size -= len(chunk)
+                yield chunk
+            self.rfile.readline()
+
+    def _save_body(self):
+        path = os.path.join(self.server.directory, uuid.uuid4().hex)
+        size = 0
+        with open(path, 'wb') as f:
+            for chunk in self._body_chunks():
+                f.write(chunk)
+                size += len(chunk)
+        return path, size
+
+    def _respond(self, status=200, body=b'', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _parse(self):
+        url = urlsplit(self.path)
+        return url.path.split('/', 2)[2], parse_qs(url.query, keep_blank_values=True)
+
+    def do_PUT(self):
+        key, query = self._parse()
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        try:
+            path, size = self._save_body()
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+        if 'uploadId' in query:
+            self.server.uploads[query['uploadId'][0]][int(query['partNumber'][0])] = path
+            self.server.parts.append(size)
+        else:
+            self.server.objects[key] = path
+        self._respond(headers={'ETag': '"%s"' % uuid.uuid4().hex})
+
+    def do_POST(self):
+        key, query = self._parse()
+        for _ in self._body_chunks():
+            pass
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            self.server.uploads[upload_id] = dict()
+            body = '<InitiateMultipartUploadResult><Bucket>test</Bucket><Key>%s</Key>' \
+                   '<UploadId>%s</UploadId></InitiateMultipartUploadResult>' % (key, upload_id)
+        else:
+            parts = self.server.uploads.pop(query['uploadId'][0])
+            path = os.path.join(self.server.directory, uuid.uuid4().hex)
+            with open(path, 'wb') as f:
+                for part_number in sorted(parts):
+                    with open(parts[part_number], 'rb') as part:
+                        shutil.copyfileobj(part, f)
+            self.server.objects[key] = path
+            body = '<CompleteMultipartUploadResult><Bucket>test</Bucket><Key>%s</Key>' \
+                   '<ETag>"%s"</ETag></CompleteMultipartUploadResult>' % (key, uuid.uuid4().hex)
+        self._respond(body=body.encode())
+
+    def do_DELETE(self):
+        _, query = self._parse()
+        self.server.uploads.pop(query.get('uploadId', [None])[0], None)
+        self._respond(204)
+
+
+class S3StorageUploadTests(TestCase):
+    chunksize = 5 * 1024 * 1024
+
+    def setUp(self):
+        self.server = S3StandIn()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.close)
+        self.storage = BaseS3Storage(
+            aws_s3_bucket_name='test',
+            aws_s3_endpoint_url=self.server.endpoint_url,
+            aws_access_key_id='test',
+            aws_secret_access_key='test',
+            aws_s3_addressing_style='path',
+            aws_s3_multipart_threshold=self.chunksize,
+            aws_s3_multipart_chunksize=self.chunksize,
+            aws_s3_max_concurrency=2,
+        )
+
+    def make_file(self, size):
+        f = tempfile.TemporaryFile()
+        self.addCleanup(f.close)
+        for i in range(size // (1024 * 1024)):
+            f.write(bytes([i % 256]) * 1024 * 1024)
+        f.write(os.urandom(size % (1024 * 1024)))
+        f.seek(0)
+        return File(f, name='upload.bin')
+
+    def test_small_file_single_put(self):
+        content = self.make_file(1024)
+        self.assertEqual(self.storage.save('small.bin', content), 'small.bin')
+        self.assertEqual(self.server.parts, [])
+        content.seek(0)
+        self.assertEqual(self.server.read('small.bin'), content.read())
+
+    def test_multipart_streams_with_bounded_buffer(self):
+        size = 8 * self.chunksize + 123
+        content = self.make_file(size)
+        tracemalloc.start()
+        try:
+            self.storage.save('large.bin', content)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(self.server.parts, [self.chunksize] * 8 + [123])
+        self.assertLessEqual(self.server.max_active, 2)
+        # 2个上传中的分段 + 1个等待上传的分段（原来读取整个文件）
+        self.assertLess(peak, 4 * self.chunksize)
+        # 上传后文件不被关闭
+        self.assertFalse(content.closed)
+        content.seek(0)
+        self.assertEqual(self.server.read('large.bin'), content.read())
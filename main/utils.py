@@ -1,5 +1,10 @@
 import asyncio
+import decimal
 import re
+import uuid
+from datetime import timedelta
+
+from django.utils import timezone
 
 
 async def run_command(shell_cmd, html=False) -> (int, str):
@@ -23,3 +28,25 @@ async def ping(address) -> (bool, str):
     res = re.findall(r'icmp_seq=1.*?time=([\d|.]+\s(ms|s))', output)
     delay = res[0][0] if res else 'Unknown'
     return succeeded, delay
+
+
+def fake_server_rows(count) -> list:
+    """
+    模拟Server.objects.values()的数据，用于性能测试
+    """
+    now = timezone.now()
+    return [
+        {
+            'id': i,
+            'name': f'server-{i}',
+            'description': '测试服务器 %d' % i,
+            'ip_address': f'10.0.{i // 256 % 256}.{i % 256}',
+            'is_alive': bool(i % 2),
+            'group_id': i % 10 or None,
+            'created_at': now - timedelta(minutes=i),
+            'creator_id': None,
+            'uuid': uuid.uuid4(),
+            'cost': decimal.Decimal('%d.50' % i),
+        }
+        for i in range(count)
+    ]
@@ -1,31 +1,29 @@
 """
 仅用于测试环境
+
+删除本项目的所有缓存（KEY_PREFIX下的key），不使用FLUSHALL，Celery的broker、result数据不受影响；
+按命名空间、模型删除见：python manage.py purge_cache --help
 """
 import os
 import sys
 
-from redis import Redis
-
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if BASE_DIR not in sys.path:
     sys.path.append(BASE_DIR)
 
-from common.core.settings import project_settings
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DRFLearning.settings')
 
 
 def clean():
-    redis = Redis(
-        socket_connect_timeout=2,
-        host=project_settings.redis.host,
-        port=project_settings.redis.port,
-        password=project_settings.redis.password
-    )
-    redis.flushall()
-    print('  Redis data all flushed.')
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command('purge_cache', all=True)
 
 
 if __name__ == '__main__':
-    print('All redis data will be deleted!')
+    print('All cache data of this project will be deleted!')
     try:
         user_input = input('Are you sure? (y/n): ')
     except KeyboardInterrupt: